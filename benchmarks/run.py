@@ -0,0 +1,360 @@
+"""
+pydevops overhead benchmarks.
+
+Runs offline: the remote hosts and docker containers are emulated by
+the fake ssh/scp/docker commands (see the shims directory), which execute
+the "remote" commands on the local machine.
+
+Usage:
+
+    python benchmarks/run.py --output results.json
+
+The results are saved in JSON, so they can be compared between releases.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHIMS_DIR = os.path.join(ROOT_DIR, "benchmarks", "shims")
+sys.path.insert(0, ROOT_DIR)
+
+from pydevops.version import __version__
+from pydevops.base import (Process, Step, Environment, create_context,
+                           apply_aliases)
+from pydevops.__main__ import to_args_string, sanitize_remote_options
+
+SUITES = ("startup", "process", "options", "remote")
+
+N_STEPS = (10, 100, 1000)
+STEPS_PER_STAGE = 10
+
+CFG_TEMPLATE = """
+from pydevops.base import Step
+
+
+class NoOp(Step):
+    def execute(self, ctx):
+        pass
+
+
+stages = {stages}
+init_stages = []
+build_stages = list(stages.keys())
+aliases = {{}}
+defaults = {{}}
+"""
+
+
+class NoOp(Step):
+    def execute(self, ctx):
+        pass
+
+
+def measure(func, repeat=5, number=1):
+    """
+    Returns the best (minimum) time of `number` calls of the given function
+    [s], out of `repeat` measurements.
+    """
+    result = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        result = min(result, (time.perf_counter() - start)/number)
+    return result
+
+
+@contextlib.contextmanager
+def no_logging():
+    logging.disable(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def get_env(log_path=None):
+    env = dict(os.environ)
+    env["PATH"] = SHIMS_DIR + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    if log_path is not None:
+        env["PYDEVOPS_BENCH_LOG"] = log_path
+    return env
+
+
+def run_pydevops(args, cwd, env):
+    """
+    Runs pydevops in a new process, returns the wall time [s].
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "pydevops"] + args, cwd=cwd,
+                   env=env, check=True, stdin=subprocess.DEVNULL,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def get_stages(n_steps, step):
+    stages = {}
+    for i in range(n_steps):
+        stage = f"stage{i // STEPS_PER_STAGE}"
+        stages.setdefault(stage, []).append((f"step{i % STEPS_PER_STAGE}",
+                                             step))
+    return stages
+
+
+def write_cfg(src_dir, n_steps):
+    stages = {stage: [(name, "NoOp") for name, _ in steps]
+              for stage, steps in get_stages(n_steps, None).items()}
+    # Replace the quoted class names with the class.
+    stages_str = repr(stages).replace("'NoOp'", "NoOp")
+    with open(os.path.join(src_dir, "devops.py"), "w") as f:
+        f.write(CFG_TEMPLATE.format(stages=stages_str))
+
+
+def bench_startup(work_dir):
+    """
+    Interpreter startup and pydevops import time.
+    """
+    env = get_env()
+
+    def python_startup():
+        subprocess.run([sys.executable, "-c", "pass"], env=env, check=True)
+
+    def pydevops_import():
+        subprocess.run([sys.executable, "-c", "import pydevops.__main__"],
+                       env=env, check=True)
+
+    python_time = measure(python_startup)
+    import_time = measure(pydevops_import)
+    return {
+        "python_startup_s": python_time,
+        "pydevops_import_s": import_time - python_time
+    }
+
+
+def bench_process(work_dir):
+    """
+    Pipelines with 10, 100 and 1000 no-op steps: the whole pydevops run
+    (new process) and the Process.execute in this process (without logging).
+    """
+    result = {}
+    env = get_env()
+    for n_steps in N_STEPS:
+        src_dir = os.path.join(work_dir, f"process_{n_steps}")
+        build_dir = os.path.join(src_dir, "build")
+        os.makedirs(src_dir)
+        write_cfg(src_dir, n_steps)
+        args = ["--src_dir", src_dir, "--build_dir", build_dir]
+        # The first run initializes the build directory.
+        run_pydevops(args, src_dir, env)
+        e2e_time = min(run_pydevops(args, src_dir, env) for _ in range(3))
+        first_stage_time = min(
+            run_pydevops(args + ["--stage", "stage0"], src_dir, env)
+            for _ in range(3))
+
+        cfg = types.SimpleNamespace(stages=get_stages(n_steps, NoOp),
+                                    defaults={}, aliases={})
+        env_ = Environment(host="localhost", docker=None, src_dir=src_dir,
+                           build_dir=build_dir)
+        ctx = create_context(env_, types.SimpleNamespace(build_dir=build_dir),
+                             {}, cfg)
+
+        def execute():
+            Process(cfg.stages, list(cfg.stages.keys()), ctx).execute()
+
+        with no_logging():
+            process_time = measure(execute, repeat=3)
+        # The run of the first stage only is the baseline (startup).
+        n_extra_steps = n_steps - STEPS_PER_STAGE
+        per_step_overhead = None
+        if n_extra_steps > 0:
+            per_step_overhead = (e2e_time - first_stage_time)/n_extra_steps
+            per_step_overhead *= 1e3
+        result[str(n_steps)] = {
+            "e2e_s": e2e_time,
+            "first_stage_s": first_stage_time,
+            "per_step_overhead_ms": per_step_overhead,
+            "in_process_per_step_us": process_time/n_steps*1e6
+        }
+    return result
+
+
+def bench_options(work_dir):
+    """
+    Option resolution microbenchmarks.
+    """
+    n_options = 3000
+    n_steps = 1000
+    n_aliases = 1000
+    stages = get_stages(n_steps, NoOp)
+    step_names = [f"/{stage}/{name}" for stage, steps in stages.items()
+                  for name, _ in steps]
+    options = {}
+    for i in range(n_options):
+        stage, name = step_names[i % n_steps].strip("/").split("/")
+        scope = i % 3
+        if scope == 0:
+            options[f"option{i}"] = str(i)
+        elif scope == 1:
+            options[f"/{stage}/option{i}"] = str(i)
+        else:
+            options[f"/{stage}/{name}/option{i}"] = str(i)
+    aliases = {f"alias{i}": (f"{step_names[i % n_steps]}/a",
+                             f"{step_names[(i + 1) % n_steps]}/a")
+               for i in range(n_aliases)}
+    alias_options = {**options, **{a: "1" for a in aliases}}
+    defaults = {f"default{i}": (lambda c: "value") for i in range(100)}
+    cfg = types.SimpleNamespace(defaults=defaults, aliases=aliases)
+    ctx = create_context(None, None, alias_options, cfg)
+
+    def step_views():
+        # A fresh context, so the option index is built every time.
+        fresh = create_context(None, None, alias_options, cfg)
+        for name in step_names:
+            fresh.step_view(name)
+
+    remote_args = {f"arg{i}": f"value {i}" for i in range(100)}
+    remote_args["options"] = [f"key{i}=value {i}" for i in range(1000)]
+
+    def remote_options():
+        args = dict(remote_args)
+        args["options"] = sanitize_remote_options(args["options"])
+        to_args_string(args, double_escape_str=True)
+
+    with no_logging():
+        return {
+            "n_options": len(alias_options),
+            "n_steps": n_steps,
+            "n_aliases": n_aliases,
+            "create_context_ms": measure(
+                lambda: create_context(None, None, alias_options, cfg))*1e3,
+            "apply_aliases_ms": measure(
+                lambda: apply_aliases(alias_options, aliases))*1e3,
+            "step_view_all_steps_ms": measure(step_views)*1e3,
+            "step_view_us": measure(lambda: ctx.step_view(step_names[-1]),
+                                    number=100)*1e6,
+            "remote_args_ms": measure(remote_options)*1e3
+        }
+
+
+def make_source_tree(src_dir, n_files=200, file_size=16*1024):
+    os.makedirs(os.path.join(src_dir, "src"))
+    for i in range(n_files):
+        with open(os.path.join(src_dir, "src", f"file{i}.txt"), "wb") as f:
+            f.write(os.urandom(file_size))
+    write_cfg(src_dir, 10)
+
+
+def read_bench_log(path):
+    """
+    Returns the number of the fake ssh/scp/docker invocations and bytes
+    transferred, and clears the log.
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    os.remove(path)
+    return len(entries), sum(e["bytes"] for e in entries)
+
+
+def bench_remote(work_dir):
+    """
+    Remote dispatch through the fake ssh and docker: the first (clean) run,
+    a run without changes and a run with a single file modified.
+    """
+    if os.name == "nt":
+        return {"skipped": "the fake ssh/docker commands require POSIX"}
+    result = {}
+    for transport in ("ssh", "docker"):
+        transport_dir = os.path.join(work_dir, f"remote_{transport}")
+        src_dir = os.path.join(transport_dir, "local_src")
+        build_dir = os.path.join(transport_dir, "local_build")
+        remote_src_dir = os.path.join(transport_dir, "remote_src")
+        remote_build_dir = os.path.join(transport_dir, "remote_build")
+        log_path = os.path.join(transport_dir, "bench.log")
+        make_source_tree(src_dir)
+        env = get_env(log_path)
+        args = ["--src_dir", src_dir, "--build_dir", build_dir]
+        if transport == "ssh":
+            args += ["--host", "bench@benchhost",
+                     "--ssh_src_dir", remote_src_dir,
+                     "--ssh_build_dir", remote_build_dir]
+        else:
+            args += ["--docker", "name::bench",
+                     "--docker_src_dir", remote_src_dir,
+                     "--docker_build_dir", remote_build_dir]
+        scenarios = {}
+        duration = run_pydevops(args + ["--clean"], transport_dir, env)
+        scenarios["clean"] = (duration, *read_bench_log(log_path))
+        duration = run_pydevops(args + ["--sync"], transport_dir, env)
+        scenarios["sync_unchanged"] = (duration, *read_bench_log(log_path))
+        with open(os.path.join(src_dir, "src", "file0.txt"), "ab") as f:
+            f.write(b"modified")
+        duration = run_pydevops(args + ["--sync"], transport_dir, env)
+        scenarios["sync_one_file"] = (duration, *read_bench_log(log_path))
+        duration = run_pydevops(args, transport_dir, env)
+        scenarios["no_sync"] = (duration, *read_bench_log(log_path))
+        result[transport] = {
+            name: {"wall_s": duration, "n_commands": n_commands,
+                   "bytes_copied": n_bytes}
+            for name, (duration, n_commands, n_bytes) in scenarios.items()
+        }
+    return result
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--output", dest="output",
+                        help="Path to the output JSON file. By default, "
+                             "the results are printed to stdout.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--suite", dest="suite",
+                        help=f"Benchmark suites to run, available: {SUITES}."
+                             f" By default, all of them.",
+                        type=str, required=False, default=list(SUITES),
+                        nargs="*", choices=SUITES)
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="pydevops_bench_")
+    try:
+        for suite in args.suite:
+            print(f"Running benchmark: {suite}", file=sys.stderr)
+            suite_dir = os.path.join(work_dir, suite)
+            os.makedirs(suite_dir)
+            results[suite] = globals()[f"bench_{suite}"](suite_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        "pydevops_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
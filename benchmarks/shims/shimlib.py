@@ -0,0 +1,90 @@
+"""
+Common code of the fake ssh, scp and docker commands, which execute
+"remote" commands and copy files on the local machine.
+
+Each invocation is appended (as a JSON line) to the file pointed by
+the PYDEVOPS_BENCH_LOG environment variable, together with the number
+of bytes transferred to the "remote" side (stdin or copied files).
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+
+def log(tool: str, argv, n_bytes=0):
+    path = os.environ.get("PYDEVOPS_BENCH_LOG", None)
+    if path is None:
+        return
+    with open(path, "a") as f:
+        f.write(json.dumps({"tool": tool, "argv": list(argv),
+                            "bytes": n_bytes}) + "\n")
+
+
+def get_state_dir():
+    """
+    Returns the directory, where the fake docker keeps its containers.
+    """
+    path = os.environ.get("PYDEVOPS_BENCH_LOG", None)
+    if path is None:
+        path = os.path.join(os.getcwd(), "bench.log")
+    result = os.path.join(os.path.dirname(os.path.abspath(path)),
+                          "containers")
+    os.makedirs(result, exist_ok=True)
+    return result
+
+
+def run(args, shell=False):
+    """
+    Runs the given command with the stdin of this process piped to it.
+    Returns the exit code and the number of bytes read from stdin.
+    """
+    process = subprocess.Popen(args, shell=shell, stdin=subprocess.PIPE)
+    n_bytes = [0]
+
+    def pump():
+        try:
+            for chunk in iter(lambda: sys.stdin.buffer.read1(64*1024), b""):
+                n_bytes[0] += len(chunk)
+                process.stdin.write(chunk)
+                process.stdin.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    pump_thread = threading.Thread(target=pump, daemon=True)
+    pump_thread.start()
+    return_code = process.wait()
+    # Do not wait for the stdin, that is never closed (e.g. a terminal).
+    pump_thread.join(timeout=0.1)
+    return return_code, n_bytes[0]
+
+
+def get_size(path: str):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def copy(src: str, dst: str):
+    """
+    Copies the given file or directory (like cp -r), returns the number of
+    bytes copied.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src.rstrip("/")))
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, dirs_exist_ok=True)
+    else:
+        shutil.copy2(src, dst)
+    return get_size(src)
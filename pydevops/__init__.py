@@ -1,2 +1,9 @@
+import sys
+
+if "--import_profile" in sys.argv:
+    # Profile also the imports of the pydevops modules.
+    import pydevops.import_profile
+    pydevops.import_profile.enable()
+
 from pydevops.version import __version__
-from pydevops.__main__ import main
\ No newline at end of file
+from pydevops.__main__ import main
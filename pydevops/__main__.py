@@ -2,6 +2,7 @@ import argparse
 import dataclasses
 import importlib
 import importlib.util
+import json
 import logging
 import pathlib
 import sys
@@ -10,6 +11,7 @@ from collections import defaultdict
 from collections.abc import Iterable
 from typing import Tuple
 import pickle
+import shlex
 
 from pydevops.utils import get_logger
 from pydevops.base import (
@@ -20,19 +22,59 @@ from pydevops.base import (
     create_context
 )
 import pydevops.sh as sh
+import pydevops.trace as trace
+import pydevops.import_profile as import_profile
+import pydevops.pipeline as pipeline
 from pydevops.version import __version__
-from pydevops.docker import DockerClient
-from pydevops.ssh import SshClient
+
+# Note: the modules needed only by the remote targets, the agent and
+# the matrix mode (docker, ssh, sync, bootstrap, agent, matrix) are imported
+# in the functions that use them, so that they do not slow down
+# the startup of the local pipelines.
 
 logger = get_logger("__main__")
 
 CFG_NAME = "devops.py"
 CONTEXT_FILE_NAME = "pydevops.cfg"
+STEP_LOGS_DIR_NAME = "pydevops_logs"
+ARTIFACTS_DIR_NAME = "artifacts"
+# The files of the build directory kept by pydevops (context, caches, logs):
+# never overwritten by the artifacts.
+PYDEVOPS_FILE_PATTERNS = (CONTEXT_FILE_NAME, "pydevops_*", ".pydevops_*")
+
+# Loaded devops.py modules: (path, hash) -> module. Reused between the runs
+# of the agent.
+_loaded_cfgs = {}
 
 
-def load_cfg(path):
+def load_cfg(path, build_dir=None):
+    """
+    Loads the devops.py module.
+
+    If the devops.py sets `cacheable = True`, its normalized description is
+    cached in the build directory and used instead of executing the devops.py
+    (and importing the step modules), as long as the file is not modified.
+    """
     if not pathlib.Path(path).is_file():
         raise ValueError(f"{path} file not found.")
+    cfg_hash = pipeline.hash_cfg(path, __version__)
+    key = (os.path.abspath(path), cfg_hash)
+    if key in _loaded_cfgs:
+        return _loaded_cfgs[key]
+    if build_dir is not None:
+        cfg = pipeline.load(build_dir, cfg_hash)
+        if cfg is not None:
+            logger.debug(f"Using the cached pipeline: {build_dir}")
+            return cfg
+    module = exec_cfg(path)
+    if (build_dir is not None and getattr(module, "cacheable", False)
+            and pathlib.Path(build_dir).is_dir()):
+        pipeline.save(build_dir, cfg_hash, module)
+    _loaded_cfgs[key] = module
+    return module
+
+
+def exec_cfg(path):
     module_name = "pydevops_cfg"
     spec = importlib.util.spec_from_file_location(module_name, path)
     module = importlib.util.module_from_spec(spec)
@@ -80,6 +122,33 @@ def parse_options(options_str):
     return result
 
 
+def create_process(cfg, stages, ctx, args):
+    max_parallel_steps = args.max_parallel_steps
+    if max_parallel_steps is None:
+        max_parallel_steps = getattr(cfg, "max_parallel_steps", 1)
+    logs_dir = None
+    if args.step_logs:
+        logs_dir = os.path.join(args.build_dir, STEP_LOGS_DIR_NAME)
+    return Process(cfg.stages, stages, ctx=ctx,
+                   depends_on=getattr(cfg, "depends_on", None),
+                   max_parallel_steps=max_parallel_steps,
+                   incremental=args.incremental,
+                   timeouts=getattr(cfg, "timeouts", None),
+                   logs_dir=logs_dir)
+
+
+def get_sh_options(args):
+    """
+    Returns the default parameters of the commands run by the pipeline steps.
+    """
+    result = {}
+    if args.command_timeout is not None:
+        result["timeout"] = args.command_timeout
+    if args.output_tail > 0:
+        result["tail_size"] = args.output_tail*1024
+    return result
+
+
 def get_stages_to_execute(args, cfg, saved_context):
     """
     User input arguments have the higher priority than configuration file
@@ -140,12 +209,15 @@ def cleanup(src_dir, build_dir, args):
     sh.mkdir(build_dir)
     # create new environment from the input args, set it to saved_context
     env = Environment(host=args.host, docker=docker, src_dir=src_dir,
-                      build_dir=build_dir)
+                      build_dir=build_dir,
+                      ssh_options=tuple(args.ssh_options or ()))
     return env
 
 
-def main():
+def create_parser():
     parser = argparse.ArgumentParser(description="PyDevOps tools")
+    parser.add_argument("--version", action="version",
+                        version=f"pydevops {__version__}")
     parser.add_argument("--stage", dest="stage",
                         help="Stages to execute, when not provided, "
                              "the sequence of the `init_stages` and "
@@ -169,6 +241,12 @@ def main():
                              "or the path to the Dockerfile (file:path). "
                              "By default (None) docker will be not used",
                         type=str, required=False, default=None)
+    parser.add_argument("--docker_remove", dest="docker_remove",
+                        help="Stop and remove the docker container used by "
+                             "the pipeline in the given build directory, "
+                             "then exit. The container will be created "
+                             "again on the next pipeline run.",
+                        action="store_true", default=False)
     parser.add_argument("--ssh_src_dir", dest="ssh_src_dir",
                         help="Path to the remote host source directory.",
                         type=str, required=False, default=None)
@@ -177,6 +255,17 @@ def main():
                              "This directory will be used to keep the "
                              "pydevops.cfg file for the local machine.",
                         type=str, required=False, default=None)
+    parser.add_argument("--ssh_options", dest="ssh_options",
+                        help="A list of additional ssh options, in the "
+                             "ssh_config format Key=Value, "
+                             "e.g. Compression=yes. A single connection "
+                             "to the remote host is reused for all "
+                             "the commands (except on Windows); use "
+                             "ControlMaster=no to turn it off. The options "
+                             "are saved in the build directory and reused "
+                             "by the subsequent runs.",
+                        type=str, required=False, default=[],
+                        nargs="*")
     parser.add_argument("--docker_src_dir", dest="docker_src_dir",
                         help="Path to the docker container's source directory.",
                         type=str, required=False, default=None)
@@ -199,6 +288,13 @@ def main():
                              "previously created artifacts. Pipeline will go "
                              "through all init stages.",
                         action="store_true", default=False)
+    parser.add_argument("--sync", dest="sync",
+                        help="Synchronize the local source directory with "
+                             "the remote host (or docker container) source "
+                             "directory, also when "
+                             "the --clean is not set. Only new and modified "
+                             "files are transferred.",
+                        action="store_true", default=False)
     parser.add_argument("--secrets", dest="secrets",
                         help="A list of option names that should be not saved "
                              "to the context file. Use it e.g. to avoid "
@@ -206,16 +302,278 @@ def main():
                              "authentication tokens.",
                         type=str, required=False, default=None,
                         nargs="*")
-    logger.debug(f"SYS ARGV: {sys.argv}")
-    args = parser.parse_args()
+    parser.add_argument("--max_parallel_steps", dest="max_parallel_steps",
+                        help="Maximum number of steps that can be executed "
+                             "concurrently. Applies only to pipelines "
+                             "that declare `depends_on`. By default, the "
+                             "`max_parallel_steps` value from the "
+                             "configuration file is used (1 if not set).",
+                        type=int, required=False, default=None)
+    parser.add_argument("--incremental", dest="incremental",
+                        help="Skip the steps whose declared inputs (options, "
+                             "files, environment variables) have not changed "
+                             "since their last successful execution.",
+                        action="store_true", default=False)
+    parser.add_argument("--trace", dest="trace",
+                        help="Record the execution trace of stages, steps "
+                             "and commands (including the remote ones) and "
+                             "save it to the build directory, in the Chrome "
+                             "trace event format. A summary table is printed "
+                             "at the end of the run.",
+                        action="store_true", default=False)
+    parser.add_argument("--step_logs", dest="step_logs",
+                        help="Write the output of the commands run by each "
+                             "step to a separate log file in the "
+                             f"{STEP_LOGS_DIR_NAME} subdirectory of the "
+                             "build directory. The output is still "
+                             "printed to the console.",
+                        action="store_true", default=False)
+    parser.add_argument("--command_timeout", dest="command_timeout",
+                        help="The maximum execution time of a single "
+                             "command [s]. When exceeded, the command and "
+                             "all its child processes are killed and "
+                             "the pipeline fails. By default: no timeout.",
+                        type=float, required=False, default=None)
+    parser.add_argument("--output_tail", dest="output_tail",
+                        help="Keep the last N KB of each command's output "
+                             "and print them when the command fails "
+                             "(useful when the output is long). "
+                             "By default: 0 (turned off).",
+                        type=int, required=False, default=0)
+    parser.add_argument("--import_profile", dest="import_profile",
+                        help="Print the startup time profile: the time of "
+                             "loading the devops.py and of the slowest "
+                             "module imports.",
+                        action="store_true", default=False)
+    parser.add_argument("--bootstrap", dest="bootstrap",
+                        help="Install pydevops (with the same version as "
+                             "the local one) on the remote host or docker "
+                             "container, in the ~/.cache/pydevops/<version> "
+                             "directory, and use it to run the remote "
+                             "pipeline. The installation is reused by all "
+                             "the subsequent runs (also with --clean). "
+                             "By default, pydevops available in the remote "
+                             "PATH is used.",
+                        action="store_true", default=False)
+    parser.add_argument("--bootstrap_wheels", dest="bootstrap_wheels",
+                        help="A local directory with the wheels that "
+                             "should be installed by --bootstrap (pydevops "
+                             "and its dependencies). By default, the wheel "
+                             "is built from the local pydevops package.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--agent", dest="agent",
+                        help="Run the remote pipeline in a long-lived "
+                             "pydevops process (agent) on the remote host "
+                             "or docker container, started on the first "
+                             "use. The agent keeps the devops.py and "
+                             "the step modules loaded between the runs, "
+                             "which reduces the fixed overhead of each "
+                             "pydevops call. POSIX targets only.",
+                        action="store_true", default=False)
+    parser.add_argument("--agent_serve", dest="agent_serve",
+                        help="Start the agent listening on the given unix "
+                             "socket path (used internally by --agent).",
+                        type=str, required=False, default=None)
+    parser.add_argument("--artifacts", dest="artifacts",
+                        help="A list of glob patterns (relative to the "
+                             "remote build directory, e.g. \"install/**\") "
+                             "of the files that should be copied from "
+                             "the remote host (or docker container) after "
+                             "the remote pipeline finishes. By default, "
+                             "the `artifacts` from the configuration file "
+                             "are used (none if not set).",
+                        type=str, required=False, default=None,
+                        nargs="*")
+    parser.add_argument("--artifacts_dir", dest="artifacts_dir",
+                        help="Local directory, where the artifacts should "
+                             "be copied to. By default: the artifacts "
+                             "subdirectory of the local build directory.",
+                        type=str, required=False, default=None)
+    parser.add_argument("--matrix", dest="matrix",
+                        help="Run the pipeline for each combination of "
+                             "the given option values, e.g. "
+                             "build_type=Debug,Release python=ON,OFF. "
+                             "Each combination is run in a separate "
+                             "process, in its own build subdirectory "
+                             "{build_dir}/{combination name}. "
+                             "The combinations run concurrently, "
+                             "the available CPUs and memory are split "
+                             "between them.",
+                        type=str, required=False, default=None,
+                        nargs="*")
+    parser.add_argument("--targets", dest="targets",
+                        help="Run the pipeline on each of the given remote "
+                             "hosts (host=address) and docker containers "
+                             "(docker=parameters) concurrently, e.g. "
+                             "host=user@10.0.0.1 \"docker=name::ubuntu\". "
+                             "Each target uses its own local build "
+                             "subdirectory {build_dir}/{target name}.",
+                        type=str, required=False, default=None,
+                        nargs="*")
+    parser.add_argument("--max_parallel_pipelines",
+                        dest="max_parallel_pipelines",
+                        help="Maximum number of the matrix combinations "
+                             "(targets) that can run concurrently. "
+                             "By default, determined by the available CPUs "
+                             "and memory (all the targets).",
+                        type=int, required=False, default=None)
+    parser.add_argument("--fail_fast", dest="fail_fast",
+                        help="Stop all the matrix combinations (targets) "
+                             "after the first failure.",
+                        action="store_true", default=False)
+    return parser
+
+
+def run_many(args):
+    """
+    Runs the pipeline for each target and/or matrix combination.
+    """
+    import pydevops.matrix as matrix
+    args_dict = vars(args)
+    matrix_axes = args_dict.pop("matrix")
+    targets = args_dict.pop("targets")
+    max_parallel = args_dict.pop("max_parallel_pipelines")
+    fail_fast = args_dict.pop("fail_fast")
+    variants = [("", args_dict)]
+    if targets:
+        targets = matrix.parse_targets(targets)
+        variants = matrix.get_target_variants(args_dict, targets)
+    if matrix_axes:
+        axes = matrix.parse_axes(matrix_axes)
+        variants = [
+            (f"{name}/{v_name}" if name else v_name, v_args)
+            for name, variant_args in variants
+            for v_name, v_args in matrix.get_matrix_variants(variant_args,
+                                                             axes)]
+    jobs = matrix.create_jobs(variants)
+    # The pipelines run on the remote targets do not use the local CPUs.
+    # The combinations run on the same remote host (container) split
+    # its resources.
+    remote = any(is_remote_run(v_args) for _, v_args in variants)
+    return matrix.run(jobs, max_parallel=max_parallel, fail_fast=fail_fast,
+                      split_resources=not targets, remote=remote)
+
+
+def is_remote_run(args_dict: dict):
+    """
+    Returns True if the pipeline with the given arguments runs on a remote
+    host or in a docker container.
+    """
+    host = args_dict.get("host", None)
+    docker = args_dict.get("docker", None)
+    if not args_dict.get("clean", False):
+        # The environment saved in the build directory is used.
+        saved_context = read_context(args_dict["build_dir"])
+        if saved_context.is_initialized:
+            host, docker = saved_context.env.host, saved_context.env.docker
+    return host != "localhost" or docker is not None
+
+
+def get_remote_env_prefix(env: dict):
+    """
+    Returns the prefix of the remote shell command, that sets the given
+    environment variables.
+    """
+    return "".join(f"{k}={shlex.quote(v)} " for k, v in env.items())
+
+
+def fetch_artifacts(client, remote_build_dir, patterns, artifacts_dir,
+                    build_dir):
+    """
+    Copies the artifacts matching the given patterns from the remote build
+    directory to the local artifacts directory. The pydevops files of
+    the local build directory are never overwritten.
+    """
+    from pydevops.sync import FETCH_CACHE_FILE_NAME
+    if not patterns:
+        return
+    logger.info(f"Fetching artifacts: {patterns}")
+    exclude = []
+    try:
+        rel_build_dir = pathlib.Path(os.path.abspath(build_dir)).relative_to(
+            os.path.abspath(artifacts_dir)).as_posix()
+    except ValueError:
+        # The build directory is not located in the artifacts directory.
+        rel_build_dir = None
+    if rel_build_dir is not None:
+        prefix = "" if rel_build_dir == "." else f"{rel_build_dir}/"
+        exclude = [f"{prefix}{p}" for p in PYDEVOPS_FILE_PATTERNS]
+    client.cp_from_remote(
+        remote_build_dir, patterns, artifacts_dir,
+        cache_file=os.path.join(build_dir, FETCH_CACHE_FILE_NAME),
+        exclude=exclude)
+
+
+def fetch_remote_trace(client, remote_build_dir, name):
+    """
+    Merges the trace of the remote pydevops into the local trace.
+    """
+    from pydevops.sync import read_remote_file
+    try:
+        remote_trace = read_remote_file(client, remote_build_dir,
+                                        trace.TRACE_FILE_NAME)
+        if remote_trace:
+            trace.get_tracer().merge(json.loads(remote_trace), name)
+    except Exception as e:
+        logger.warning(f"Unable to fetch the remote trace: {e}")
+
+
+def save_trace(tracer, build_dir):
+    sh.mkdir(build_dir, exist_ok=True)
+    path = os.path.join(build_dir, trace.TRACE_FILE_NAME)
+    tracer.save(path)
+    logger.info(f"Execution trace saved to: {path}\n{tracer.summary()}")
+
+
+def main(argv=None):
+    parser = create_parser()
+    logger.debug(f"SYS ARGV: {sys.argv if argv is None else argv}")
+    args = parser.parse_args(argv)
     logger.debug(f"OPTIONS: {args.options}")
+    if args.agent_serve:
+        import pydevops.agent as agent
+        agent.serve(args.agent_serve, run_func=main,
+                    on_reload=_loaded_cfgs.clear)
+        return
+    if args.docker_remove:
+        from pydevops.docker import remove_container
+        saved_context = read_context(args.build_dir)
+        if saved_context.is_initialized and saved_context.env.docker:
+            remove_container(saved_context.env.docker)
+        return
+    if args.matrix or args.targets:
+        return run_many(args)
+    profiler = None
+    if args.import_profile:
+        # Normally enabled already, when pydevops is imported (see
+        # pydevops/__init__.py).
+        profiler = import_profile.get_profiler() or import_profile.enable()
+    tracer = None
+    if args.trace:
+        import socket
+        tracer = trace.enable(f"pydevops@{socket.gethostname()}")
+    # Note: run may modify args.
+    build_dir = args.build_dir
+    try:
+        run(args)
+    finally:
+        if tracer is not None:
+            save_trace(tracer, build_dir)
+            # The process may run many pipelines (agent).
+            trace.disable()
+        if profiler is not None:
+            logger.info(f"Startup profile:\n{profiler.report()}")
+
+
+def run(args):
     host = args.host
     docker = args.docker
     src_dir = args.src_dir
     build_dir = args.build_dir
     env_from_params = Environment(host=host, docker=docker, src_dir=src_dir,
                                   build_dir=build_dir)
-    cfg = load_cfg(os.path.join(src_dir, CFG_NAME))
+    with import_profile.section(f"load {CFG_NAME}"):
+        cfg = load_cfg(os.path.join(src_dir, CFG_NAME), build_dir)
     env = None
     ctx_file_exists = (pathlib.Path(build_dir) / pathlib.Path(
         CONTEXT_FILE_NAME)).exists()
@@ -240,26 +598,52 @@ def main():
         # Proceed with execution
         context = create_context(env=saved_context.env, args=args,
                                  options=saved_context.options, cfg=cfg)
+        context.sh_options.update(get_sh_options(args))
         if len(init_stages) > 0:
             logger.info(f"Running initialization steps: {init_stages}")
-            init_process = Process(cfg.stages, init_stages, ctx=context)
+            init_process = create_process(cfg, init_stages, context, args)
             init_process.execute()
 
         save_context(build_dir, saved_context, args.secrets)
 
         if len(build_stages) > 0:
             logger.info(f"Running build steps: {build_stages}")
-            build_process = Process(cfg.stages, build_stages, ctx=context)
+            build_process = create_process(cfg, build_stages, context, args)
             build_process.execute()
     else:
         # Now we are running pydevops on a local machine and executing pipeline
         # on remote machine.
         # Init connection with the remote machine and translate all the options
         # to appropriate settings for remote machine.
+        import pydevops.agent as agent
+        import pydevops.bootstrap as bootstrap
+        import pydevops.matrix as matrix
+        import pydevops.resources as resources
+        from pydevops.docker import DockerClient
+        from pydevops.ssh import SshClient
+        from pydevops.sync import SYNC_CACHE_FILE_NAME
         client = None
         remote_args = vars(args)
         host_src_dir = remote_args.pop("src_dir")
         host_build_dir = remote_args.pop("build_dir")
+        sync_src = remote_args.pop("sync")
+        artifacts = remote_args.pop("artifacts")
+        if artifacts is None:
+            artifacts = getattr(cfg, "artifacts", None)
+        artifacts_dir = (remote_args.pop("artifacts_dir")
+                         or os.path.join(host_build_dir, ARTIFACTS_DIR_NAME))
+        use_bootstrap = remote_args.pop("bootstrap")
+        bootstrap_wheels = remote_args.pop("bootstrap_wheels")
+        use_agent = remote_args.pop("agent")
+        remote_args.pop("agent_serve")
+        # The share of the remote machine resources (e.g. a matrix
+        # combination), the local CPU and memory budgets do not apply there.
+        resource_env = {}
+        if os.environ.get(resources.RESOURCE_SHARE_ENV, None):
+            resource_env[resources.RESOURCE_SHARE_ENV] = os.environ[
+                resources.RESOURCE_SHARE_ENV]
+        # The agent gets the options as a list (no quoting is needed).
+        agent_options = list(remote_args.get("options", None) or [])
         if "options" in remote_args:
             # Convert each option value to string, to avoid passing
             # e.g. description=Build #4 test instead of 
@@ -276,16 +660,51 @@ def main():
             remote_args["src_dir"] = ssh_src_dir
             remote_args["build_dir"] = ssh_build_dir
             remote_args["host"] = "localhost"
+            # The ssh options given in the command line replace the saved
+            # ones.
+            ssh_options = (remote_args.pop("ssh_options")
+                           or list(saved_context.env.ssh_options))
+            env = dataclasses.replace(env, ssh_options=tuple(ssh_options))
+            saved_context = SavedContext(version=__version__, env=env,
+                                         options=options)
+            remote_args.pop("docker_remove")
+            agent_args = matrix.to_args_list(
+                {**remote_args, "options": agent_options})
             remote_args = to_args_string(remote_args, double_escape_str=True)
-            client = SshClient(address=saved_context.env.host,
-                               start_dir=args.src_dir)
-            if args.clean:
-                client.rmdir(ssh_src_dir, cd_to_start_dir=False)
-                client.rmdir(ssh_build_dir, cd_to_start_dir=False)
-                client.cp_to_remote(src_dir, ssh_src_dir, cd_to_start_dir=False)
-            client.sh(f"pydevops {remote_args}")
+            with SshClient(address=saved_context.env.host,
+                           start_dir=args.src_dir,
+                           options=ssh_options) as client:
+                if args.clean:
+                    client.rmdir(ssh_src_dir, cd_to_start_dir=False)
+                    client.rmdir(ssh_build_dir, cd_to_start_dir=False)
+                if args.clean or sync_src:
+                    client.sync_to_remote(
+                        src_dir, ssh_src_dir, exclude=[build_dir],
+                        cache_file=os.path.join(build_dir,
+                                                SYNC_CACHE_FILE_NAME))
+                pydevops_cmd = "pydevops"
+                if use_bootstrap:
+                    pydevops_cmd = bootstrap.bootstrap(client,
+                                                       bootstrap_wheels)
+                try:
+                    if use_agent:
+                        socket_path, agent_env = agent.start(client,
+                                                             pydevops_cmd)
+                        agent.run(client, socket_path, agent_args,
+                                  src_dir=ssh_src_dir, cwd=ssh_src_dir,
+                                  env={**agent_env, **resource_env})
+                    else:
+                        client.sh(f"{get_remote_env_prefix(resource_env)}"
+                                  f"{pydevops_cmd} {remote_args}")
+                    fetch_artifacts(client, ssh_build_dir, artifacts,
+                                    artifacts_dir, build_dir)
+                finally:
+                    if args.trace:
+                        fetch_remote_trace(client, ssh_build_dir,
+                                           f"pydevops@{client.host}")
             save_context(build_dir, saved_context, args.secrets)
         elif saved_context.env.docker is not None:
+            remote_args.pop("ssh_options")
             docker_src_dir = remote_args.pop("docker_src_dir")
             docker_build_dir = remote_args.pop("docker_build_dir")
 
@@ -294,22 +713,53 @@ def main():
             # Remove docker attribute (now we will execute commands in the
             # docker container).
             remote_args.pop("docker")
+            remote_args.pop("docker_remove")
+            agent_args = matrix.to_args_list(
+                {**remote_args, "options": agent_options})
             remote_args = to_args_string(remote_args)
-            client = DockerClient(parameters=saved_context.env.docker)
+            client = DockerClient(parameters=saved_context.env.docker,
+                                  build_dir=build_dir)
+            if client.is_source_mounted:
+                # Used whenever a new container is created.
+                client.add_source_mount(src_dir, docker_src_dir)
+            # On --clean, a fresh container is created.
+            client.start(recreate=args.clean)
             # Update local SavedContext:
             # in the next try not to build new image, but simply run the
-            # existing.
+            # existing container.
             env = dataclasses.replace(env, docker=client.params)
             saved_context = SavedContext(version=__version__, env=env,
                                          options=options)
             if args.clean:
                 logger.info("Cleaning up docker target directories...")
-                client.rmdir(docker_src_dir)
+                if not client.is_source_mounted:
+                    client.rmdir(docker_src_dir)
                 client.rmdir(docker_build_dir)
-                client.cp_to_remote(src_dir, docker_src_dir)
             else:
                 logger.info("No clean.")
-            client.sh(f"pydevops {remote_args}")
+            if (args.clean or sync_src) and not client.is_source_mounted:
+                client.sync_to_remote(
+                    src_dir, docker_src_dir, exclude=[build_dir],
+                    cache_file=os.path.join(build_dir, SYNC_CACHE_FILE_NAME))
+            pydevops_cmd = "pydevops"
+            if use_bootstrap:
+                pydevops_cmd = bootstrap.bootstrap(client, bootstrap_wheels)
+            try:
+                if use_agent:
+                    socket_path, agent_env = agent.start(client,
+                                                         pydevops_cmd)
+                    agent.run(client, socket_path, agent_args,
+                              src_dir=docker_src_dir,
+                              env={**agent_env, **resource_env})
+                else:
+                    client.sh(f"{get_remote_env_prefix(resource_env)}"
+                              f"{pydevops_cmd} {remote_args}")
+                fetch_artifacts(client, docker_build_dir, artifacts,
+                                artifacts_dir, build_dir)
+            finally:
+                if args.trace:
+                    fetch_remote_trace(client, docker_build_dir,
+                                       f"pydevops@{client.container_id}")
             save_context(build_dir, saved_context, args.secrets)
 
 
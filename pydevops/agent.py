@@ -0,0 +1,396 @@
+"""
+Long-lived pydevops process (agent) on the remote hosts and docker
+containers.
+
+The agent listens on a unix socket and runs the pipelines requested by
+the local pydevops (JSON requests with the list of the command line
+arguments), in its own process: the interpreter, pydevops, the devops.py
+and the step modules are loaded once and kept between the requests.
+The output of each run is streamed back to the client. Each run gets
+the environment of the remote shell that has requested it (the agent
+itself keeps the environment of the shell that has started it).
+
+The agent runs a single pipeline at a time and exits after being idle for
+AGENT_IDLE_TIMEOUT seconds. POSIX only.
+"""
+import codecs
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from pydevops.utils import get_logger
+import pydevops.sync as sync
+
+logger = get_logger("pydevops.agent")
+
+AGENT_ROOT_DIR = "~/.cache/pydevops"
+AGENT_IDLE_TIMEOUT = 3600  # [s]
+AGENT_START_TIMEOUT = 60  # [s]
+AGENT_REQUEST_TIMEOUT = 30  # [s]
+
+OUTPUT = "output"
+EXIT = "exit"
+
+# Executed on the remote side: starts the agent (unless it is already
+# running) and prints the path to its socket and the environment of
+# the remote shell (JSON).
+_START_SCRIPT = """
+import json, os, socket, subprocess, sys, time
+root, version, exe, start_timeout = sys.argv[1:5]
+agent_dir = os.path.expanduser(root)
+os.makedirs(agent_dir, exist_ok=True)
+path = os.path.join(agent_dir, f"agent-{version}.sock")
+
+def is_running():
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+if not is_running():
+    with open(f"{path}.log", "ab") as log:
+        subprocess.Popen([exe, "--agent_serve", path],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         start_new_session=True)
+    deadline = time.time() + float(start_timeout)
+    while not is_running():
+        if time.time() > deadline:
+            sys.exit(f"pydevops agent has not started, see: {path}.log")
+        time.sleep(0.1)
+print(json.dumps({"path": path, "env": dict(os.environ)}))
+"""
+
+# Executed on the remote side: connects the stdin/stdout to the agent socket.
+_RELAY_SCRIPT = """
+import os, socket, sys, threading
+s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+s.connect(sys.argv[1])
+
+def forward_stdin():
+    for chunk in iter(lambda: os.read(0, 65536), b""):
+        s.sendall(chunk)
+    s.shutdown(socket.SHUT_WR)
+
+threading.Thread(target=forward_stdin, daemon=True).start()
+for chunk in iter(lambda: s.recv(65536), b""):
+    os.write(1, chunk)
+"""
+
+
+def _send(output, message: dict):
+    output.write((json.dumps(message) + "\n").encode("utf-8"))
+    output.flush()
+
+
+def _get_module_mtimes(root_dir: str) -> dict:
+    """
+    Returns the modification times of the files of all the loaded modules
+    located in the given directory: module name -> mtime.
+    """
+    root_dir = os.path.join(os.path.abspath(root_dir), "")
+    result = {}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(root_dir):
+            try:
+                result[name] = os.path.getmtime(path)
+            except OSError:
+                result[name] = None
+    return result
+
+
+class AgentServer:
+    """
+    Runs the requested pipelines, one at a time.
+
+    :param socket_path: path to the unix socket to listen on
+    :param run_func: runs the pipeline for the given command line arguments
+    :param on_reload: called, when the modules of the source directory have
+      been modified and should be reloaded
+    :param idle_timeout: exit after this number of seconds without requests
+    """
+
+    def __init__(self, socket_path: str, run_func, on_reload=None,
+                 idle_timeout: float = AGENT_IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.run_func = run_func
+        self.on_reload = on_reload
+        self.idle_timeout = idle_timeout
+        self.module_mtimes = {}
+
+    def serve_forever(self):
+        import fcntl
+        lock = open(f"{self.socket_path}.lock", "a")
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.info("Another agent is already running.")
+            return
+        if os.path.exists(self.socket_path):
+            # Leftover of the previous agent.
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        server.listen()
+        server.settimeout(self.idle_timeout)
+        sys.stdout.reconfigure(line_buffering=True)
+        logger.info(f"Listening on {self.socket_path}")
+        try:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    logger.info("Idle timeout, exiting.")
+                    return
+                with connection:
+                    # Do not wait forever for the request.
+                    connection.settimeout(AGENT_REQUEST_TIMEOUT)
+                    self.handle(connection)
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            lock.close()
+
+    def handle(self, connection: socket.socket):
+        output = connection.makefile("wb")
+        try:
+            line = connection.makefile("rb").readline()
+        except socket.timeout:
+            logger.warning("No request received.")
+            return
+        if not line.strip():
+            # E.g. the check whether the agent is running.
+            return
+        connection.settimeout(None)
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+            args = [str(arg) for arg in request["args"]]
+            src_dir = request["src_dir"]
+            cwd = request.get("cwd", None)
+            env = request.get("env", None)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Invalid request: {e!r}")
+            self.reply(output, f"Invalid pydevops agent request: {e!r}\n", 2)
+            return
+        logger.info(f"Running: {args}")
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        try:
+            if env is not None:
+                os.environ.clear()
+                os.environ.update(env)
+            if cwd:
+                os.chdir(cwd)
+            self.reload_modified_modules(src_dir)
+            exit_code = self.run_captured(output, args)
+            self.module_mtimes = _get_module_mtimes(src_dir)
+        except Exception as e:
+            logger.exception("Unable to run the pipeline.")
+            self.reply(output, f"pydevops agent error: {e!r}\n", 1)
+            return
+        finally:
+            os.chdir(saved_cwd)
+            if env is not None:
+                os.environ.clear()
+                os.environ.update(saved_env)
+        self.reply(output, None, exit_code)
+
+    def reply(self, output, message, exit_code: int):
+        """
+        Sends the given message (if any) and the exit code to the client.
+        """
+        try:
+            if message is not None:
+                _send(output, {"type": OUTPUT, "data": message})
+            _send(output, {"type": EXIT, "code": exit_code})
+        except OSError:
+            logger.warning("The client has disconnected.")
+
+    def reload_modified_modules(self, src_dir: str):
+        """
+        Unloads the modules of the source directory, if any of them
+        has been modified since the last run (e.g. synchronized).
+        """
+        if _get_module_mtimes(src_dir) == self.module_mtimes:
+            return
+        for name in self.module_mtimes:
+            sys.modules.pop(name, None)
+        if self.on_reload is not None:
+            self.on_reload()
+
+    def run_captured(self, output, args) -> int:
+        """
+        Runs the pipeline with the stdout and stderr of this process
+        (and all the child processes) redirected to the client.
+        """
+        read_fd, write_fd = os.pipe()
+        saved_fds = os.dup(1), os.dup(2)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+
+        def forward():
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for chunk in iter(lambda: os.read(read_fd, 65536), b""):
+                try:
+                    _send(output, {"type": OUTPUT,
+                                   "data": decoder.decode(chunk)})
+                except OSError:
+                    # The client has disconnected, drain the output.
+                    pass
+            os.close(read_fd)
+
+        forward_thread = threading.Thread(target=forward, daemon=True)
+        forward_thread.start()
+        try:
+            self.run_func(args)
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else int(
+                e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+        # Note: processes started in the background by the pipeline keep
+        # the output open, do not wait for them.
+        forward_thread.join(timeout=5)
+        return exit_code
+
+
+def serve(socket_path: str, run_func, on_reload=None):
+    AgentServer(socket_path, run_func, on_reload=on_reload).serve_forever()
+
+
+def start(client, pydevops_cmd: str = "pydevops", version: str = None):
+    """
+    Starts the agent on the remote host (container), unless it is already
+    running. Returns a pair: the path to the remote agent socket and
+    the environment of the remote shell (see run).
+
+    :param client: remote client, that implements
+      `remote_command_args(cmd: str) -> list`
+    :param pydevops_cmd: the remote pydevops executable
+    """
+    if version is None:
+        from pydevops.version import __version__ as version
+    cmd = sync.python_command(_START_SCRIPT, AGENT_ROOT_DIR, version,
+                              pydevops_cmd, AGENT_START_TIMEOUT)
+    result = subprocess.run(client.remote_command_args(cmd),
+                            stdout=subprocess.PIPE, check=True)
+    state = json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+    return state["path"], state["env"]
+
+
+class _SocketChannel:
+
+    def __init__(self, path: str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.input = self.socket.makefile("rb")
+        self.output = self.socket.makefile("wb")
+
+    def end_request(self):
+        self.output.close()
+        self.socket.shutdown(socket.SHUT_WR)
+
+    def close(self):
+        self.input.close()
+        self.socket.close()
+
+
+class _RelayChannel:
+
+    def __init__(self, client, path: str):
+        cmd = sync.python_command(_RELAY_SCRIPT, path)
+        self.process = subprocess.Popen(client.remote_command_args(cmd),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+        self.input = self.process.stdout
+        self.output = self.process.stdin
+
+    def end_request(self):
+        self.output.close()
+
+    def close(self):
+        self.input.close()
+        self.process.wait()
+
+
+def connect(client, socket_path: str):
+    """
+    Opens a connection with the remote agent: through the forwarded socket
+    (ssh), or a relay process run with the client (docker exec, ssh without
+    the master connection).
+    """
+    forward = getattr(client, "forward_unix_socket", None)
+    local_path = forward(socket_path) if forward is not None else None
+    if local_path is not None:
+        try:
+            return _SocketChannel(local_path)
+        except OSError as e:
+            logger.debug(f"Unable to use the forwarded socket: {e}")
+    return _RelayChannel(client, socket_path)
+
+
+def run(client, socket_path: str, args, src_dir: str, cwd: str = None,
+        env: dict = None):
+    """
+    Runs pydevops with the given command line arguments in the remote agent.
+    The output is printed to the stdout.
+
+    :param src_dir: the remote source directory; the modules loaded from it
+      are reloaded by the agent, when modified
+    :param cwd: the remote working directory, by default: the agent's one
+    :param env: the environment of the run (e.g. returned by start),
+      by default: the agent's one
+
+    :raises subprocess.CalledProcessError: when the pipeline fails
+    """
+    start_time = time.monotonic()
+    channel = connect(client, socket_path)
+    exit_code = None
+    try:
+        _send(channel.output, {"args": list(args), "src_dir": src_dir,
+                               "cwd": cwd, "env": env})
+        # A single request per connection.
+        channel.end_request()
+        for line in channel.input:
+            message = json.loads(line.decode("utf-8"))
+            if message["type"] == OUTPUT:
+                sys.stdout.write(message["data"])
+                sys.stdout.flush()
+            elif message["type"] == EXIT:
+                exit_code = message["code"]
+                break
+    finally:
+        channel.close()
+    logger.debug(f"Agent run finished in "
+                 f"{time.monotonic() - start_time:.2f} s")
+    if exit_code is None:
+        raise subprocess.CalledProcessError(
+            -1, ["pydevops"] + list(args),
+            stderr="The connection with the agent has been lost.")
+    if exit_code != 0:
+        raise subprocess.CalledProcessError(exit_code,
+                                            ["pydevops"] + list(args))
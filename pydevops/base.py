@@ -1,12 +1,20 @@
 """Base classes and functions."""
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+import importlib
 import inspect
+import os
+import re
+import time
+from collections import defaultdict
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from pydevops.sh import Shell
+from pydevops.sh import Shell, AsyncShell
 from pydevops.utils import get_logger
+import pydevops.fingerprint as fingerprint
+import pydevops.trace as trace
 
 
 def sanitize(v: str):
@@ -59,12 +67,27 @@ class DevopsCfgContext:
 
 
 def expand_defaults(defaults, ctx: DevopsCfgContext):
+    """
+    Converts the callable defaults to raw values.
+
+    The callable default of an option set by the user is not called (its
+    value would be overridden anyway), unless a subsequent default removes
+    that option.
+    """
     result = {}
-    # Convert all functions to raw values.
+    overridden = []
     for k, v in defaults.items():
         if callable(v):
+            if ctx.has_option(k):
+                overridden.append(k)
+                # Placeholder, keeps the position of the option.
+                result[k] = None
+                continue
             v = v(ctx)
         result[k] = v
+    for k in overridden:
+        if not ctx.has_option(k):
+            result[k] = defaults[k](ctx)
     return result
 
 
@@ -77,12 +100,63 @@ def create_context(env, args, options, cfg):
     return Context(env=env, args=args, options=options)
 
 
+class OptionIndex:
+    """
+    Options indexed by their scope: global options (`name`), stage options
+    (`/stage/name`) and step options (`/stage/step/name`). The option paths
+    are parsed only once, the options of a given step can be then collected
+    in the time proportional to the number of options visible to that step.
+
+    When the same option name is set in many scopes, the option that
+    is the last one in the options order wins (regardless of the scope).
+    """
+
+    def __init__(self, options: dict):
+        # name -> (first position, last position, value)
+        self.global_options = {}
+        # stage -> name -> ...
+        self.stage_options = defaultdict(dict)
+        # (stage, step) -> name -> ...
+        self.step_options = defaultdict(dict)
+        for position, (key, value) in enumerate(options.items()):
+            parts = [sanitize(p) for p in key.strip("/").split("/")]
+            if len(parts) == 1:
+                bucket = self.global_options
+            elif len(parts) == 2:
+                bucket = self.stage_options[parts[0]]
+            elif len(parts) == 3:
+                bucket = self.step_options[(parts[0], parts[1])]
+            else:
+                continue
+            name = parts[-1]
+            first = bucket[name][0] if name in bucket else position
+            bucket[name] = (first, position, value)
+
+    def get_step_options(self, stage: str, step: str) -> dict:
+        """
+        Returns the options visible to the given step.
+        """
+        result = dict(self.global_options)
+        for bucket in (self.stage_options.get(stage, {}),
+                       self.step_options.get((stage, step), {})):
+            for name, (first, last, value) in bucket.items():
+                if name in result:
+                    current_first, current_last, current_value = result[name]
+                    if last < current_last:
+                        last, value = current_last, current_value
+                    first = min(first, current_first)
+                result[name] = (first, last, value)
+        entries = sorted(result.items(), key=lambda e: e[1][0])
+        return {name: value for name, (_, _, value) in entries}
+
+
 @dataclass(frozen=True)
 class Environment:
     host: Optional[str]
     docker: Optional[str]
     src_dir: str
     build_dir: str
+    ssh_options: Tuple[str, ...] = ()
 
     @property
     def is_local(self):
@@ -101,41 +175,30 @@ class SavedContext:
 
 
 class Context:
-    def __init__(self, env: Environment, args, options: dict):
+    def __init__(self, env: Environment, args, options: dict,
+                 sh_options: Optional[dict] = None, cmd_exec: Shell = None):
         self.env = env
         self.args = args
         self.options = options
-        self.cmd_exec = Shell()
+        # Default keyword arguments of Shell.run (e.g. timeout, log_file).
+        self.sh_options = dict(sh_options or {})
+        self.cmd_exec = cmd_exec if cmd_exec is not None else Shell()
+        self._async_cmd_exec = None
+        self._option_index = None
 
     def step_view(self, step_name: str):
         """
         Returns a new Context with options limited to a given step.
+        The new context shares the shell with this context.
         """
         step_name = step_name.strip("/")
         stage, step = step_name.split("/")
         stage, step = sanitize(stage), sanitize(step)
-        new_options = {}
-        for k, v in self.options.items():
-            k = k.strip("/")
-            parts = k.split("/")
-            if len(parts) == 1:
-                # Global options. Allow only if it's not the alias name.
-                option_name = sanitize(parts[0])
-                new_options[option_name] = v
-            elif len(parts) == 2:
-                option_stage, option_name = parts
-                option_stage = sanitize(option_stage)
-                option_name = sanitize(option_name)
-                if option_stage == stage:
-                    new_options[option_name] = v
-            elif len(parts) == 3:
-                option_stage, option_step, option_name = k.split("/")
-                option_stage = sanitize(option_stage)
-                option_step = sanitize(option_step)
-                option_name = sanitize(option_name)
-                if option_stage == stage and option_step == step:
-                    new_options[option_name] = v
-        return Context(env=self.env, args=self.args, options=new_options)
+        if self._option_index is None:
+            self._option_index = OptionIndex(self.options)
+        new_options = self._option_index.get_step_options(stage, step)
+        return Context(env=self.env, args=self.args, options=new_options,
+                       sh_options=self.sh_options, cmd_exec=self.cmd_exec)
 
     def get_param(self, name: str):
         """
@@ -184,7 +247,41 @@ class Context:
         return self.options.copy()
 
     def sh(self, *args, **kwargs):
-        return self.cmd_exec.run(*args, **kwargs)
+        return self.cmd_exec.run(*args, **{**self.sh_options, **kwargs})
+
+    @property
+    def async_cmd_exec(self):
+        if self._async_cmd_exec is None:
+            self._async_cmd_exec = AsyncShell()
+        return self._async_cmd_exec
+
+    async def async_sh(self, *args, **kwargs):
+        """
+        Awaitable version of sh.
+        """
+        return await self.async_cmd_exec.run(
+            *args, **{**self.sh_options, **kwargs})
+
+    async def async_sh_many(self, cmds, max_parallel: int = None, **kwargs):
+        """
+        Awaitable version of sh_many.
+        """
+        return await self.async_cmd_exec.run_many(
+            cmds, max_parallel=max_parallel, **{**self.sh_options, **kwargs})
+
+    def sh_many(self, cmds, max_parallel: int = None, **kwargs):
+        """
+        Runs the given commands concurrently and returns the list of their
+        results (in the order of the given commands). If any of the commands
+        fails, the other commands are stopped and the exception is raised.
+
+        :param cmds: commands to run
+        :param max_parallel: the maximum number of commands run concurrently
+          (by default: all of them)
+        :param kwargs: parameters of each command (see sh)
+        """
+        import asyncio
+        return asyncio.run(self.async_sh_many(cmds, max_parallel, **kwargs))
 
     def rmdir(self, path: str):
         return self.cmd_exec.rmdir(path)
@@ -198,6 +295,24 @@ class Context:
 
 
 class Step(ABC):
+    """
+    Pipeline step.
+
+    A step can declare its inputs, so it can be skipped in the incremental
+    mode, when none of them has changed since the last successful execution:
+
+    - `input_options`: names of the step options (or "*" for all options),
+    - `input_files`: glob patterns of files, relative to the source directory,
+    - `input_build_files`: glob patterns of files, relative to the build
+      directory (e.g. generated by the previous steps),
+    - `input_env`: names of the environment variables.
+
+    Steps that declare no inputs are always executed.
+    """
+    input_options = None
+    input_files = None
+    input_build_files = None
+    input_env = None
 
     def __init__(self, name):
         self.name = name
@@ -207,18 +322,169 @@ class Step(ABC):
         raise ValueError("Abstract method.")
 
 
+def is_step_reference(value):
+    """
+    Returns true if the given value is a reference to the step class
+    in the "module:Class" format (e.g. "pydevops.cmake:Configure").
+    """
+    return isinstance(value, str) and ":" in value
+
+
+def is_step_class(value):
+    return inspect.isclass(value) or is_step_reference(value)
+
+
+def get_step_reference(cls):
+    """
+    Returns the reference ("module:Class") to the given step class.
+    """
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def resolve_step_class(step):
+    """
+    Returns the step class for the given class or reference to the class.
+    """
+    if not is_step_reference(step):
+        return step
+    module_name, _, qualname = step.partition(":")
+    result = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        result = getattr(result, attr)
+    return result
+
+
+def get_step_class_name(step):
+    """
+    Returns the default step name for the given step class or reference.
+    """
+    if is_step_reference(step):
+        return step.replace(":", ".")
+    return get_class_full_name(step)
+
+
+def normalize_steps(steps):
+    """
+    Returns the list of pairs (step name, step class or reference),
+    for the given stage steps, specified in any of the supported formats:
+    a single class, a single pair (name, class), a list of classes or
+    a list of pairs.
+    """
+    # A single class
+    if is_step_class(steps):
+        return [(get_step_class_name(steps), steps)]
+    elif isinstance(steps, list) or isinstance(steps, tuple):
+        # A pair (name, cls)
+        if (len(steps) == 2 and isinstance(steps[0], str)
+                and not is_step_reference(steps[0])
+                and is_step_class(steps[1])):
+            return [tuple(steps)]
+        # A list of [cls1, cls2, cls3]...
+        elif all(is_step_class(c) for c in steps):
+            return [(get_step_class_name(c), c) for c in steps]
+    return [tuple(step) for step in steps]
+
+
+def get_step_dependencies(steps, depends_on: dict, all_stages=None):
+    """
+    Translates the `depends_on` mapping into the step-level dependencies.
+
+    Both the keys and the values of the `depends_on` mapping can be the
+    stage names (e.g. `build`) or full step names (e.g. `/cfg/conan`).
+    A stage name refers to all the steps of that stage. Dependencies on
+    stages/steps that are not executed in the current process are ignored.
+
+    :param steps: list of step instances that will be executed
+    :param depends_on: a mapping: stage or step -> list of stages or steps
+    :param all_stages: names of all the stages available in the pipeline,
+      if provided, the names used in `depends_on` are validated against it
+    :return: a mapping: step name -> set of step names it depends on
+    """
+    stage_steps = defaultdict(list)
+    for step in steps:
+        stage, _ = step.name.strip("/").split("/")
+        stage_steps[stage].append(step.name)
+    all_steps = set(step.name for step in steps)
+
+    def resolve(key):
+        parts = [sanitize(p) for p in key.strip("/").split("/")]
+        if all_stages is not None and parts[0] not in all_stages:
+            raise ValueError(f"Unknown stage in depends_on: {key}")
+        if len(parts) == 1:
+            return stage_steps.get(parts[0], [])
+        elif len(parts) == 2:
+            name = get_step_full_name(*parts)
+            return [name] if name in all_steps else []
+        else:
+            raise ValueError(f"Invalid stage or step name in depends_on: "
+                             f"{key}")
+
+    result = {step.name: set() for step in steps}
+    for key, dependencies in depends_on.items():
+        if isinstance(dependencies, str):
+            dependencies = (dependencies, )
+        dependencies = [d for dep in dependencies for d in resolve(dep)]
+        for step_name in resolve(key):
+            result[step_name].update(d for d in dependencies
+                                     if d != step_name)
+    return result
+
+
+def check_acyclic(dependencies: dict):
+    """
+    Raises ValueError if the given step dependencies contain a cycle.
+    """
+    remaining = {k: set(v) for k, v in dependencies.items()}
+    while remaining:
+        ready = [k for k, v in remaining.items() if not v]
+        if not ready:
+            raise ValueError(f"Cyclic dependency between steps: "
+                             f"{sorted(remaining.keys())}")
+        for k in ready:
+            remaining.pop(k)
+        for v in remaining.values():
+            v.difference_update(ready)
+
+
 class Process:
     """
     Base class for the devops process.
+
+    By default, stages and steps are executed one after another, in the
+    order given by the `stages` list. If the `depends_on` mapping is provided,
+    only the declared dependencies are respected and the steps that are
+    ready to run are executed concurrently, using at most
+    `max_parallel_steps` workers.
+
+    The `timeouts` mapping (stage name or /stage/step name -> seconds) limits
+    the execution time of the commands run by each step: when the step's
+    time runs out, the running command is killed. If `logs_dir` is given,
+    the output of the commands of each step is written to
+    `{logs_dir}/{stage}_{step}.log`.
     """
 
-    def __init__(self, stages_dictionary, stages, ctx: Context):
+    def __init__(self, stages_dictionary, stages, ctx: Context,
+                 depends_on: Optional[dict] = None, max_parallel_steps=1,
+                 incremental=False, timeouts: Optional[dict] = None,
+                 logs_dir: Optional[str] = None):
         self.stages_dictionary = stages_dictionary
         self.stages = stages
         self.ctx = ctx
+        self.depends_on = depends_on
+        self.max_parallel_steps = max(1, int(max_parallel_steps))
+        self.timeouts = {k.strip("/"): float(v)
+                         for k, v in (timeouts or {}).items()}
+        self.logs_dir = logs_dir
         self.logger = get_logger(str(self))
+        self.fingerprints = None
+        if incremental:
+            self.fingerprints = fingerprint.FingerprintStore(
+                ctx.get_param("build_dir"))
 
     def execute(self):
+        if self.depends_on is not None:
+            self.execute_graph()
+            return
         for stage_key in self.stages:
             try:
                 self.execute_stage(stage_key)
@@ -230,31 +496,133 @@ class Process:
 
     def execute_stage(self, stage: str):
         self.logger.info(f"Executing stage: {stage}")
-        steps = self.stages_dictionary[stage]
-        # A single class
-        if inspect.isclass(steps):
-            steps = [(get_class_full_name(steps), steps)]
-        elif isinstance(steps, list) or isinstance(steps, tuple):
-            # A pair (name, cls)
-            if (len(steps) == 2 and isinstance(steps[0], str)
-                    and inspect.isclass(steps[1])):
-                steps = [steps]
-            # A list of [cls1, cls2, cls3]...
-            elif all(inspect.isclass(c) for c in steps):
-                steps = [(get_class_full_name(c), c) for c in steps]
-        names, classes = zip(*steps)
-        names = (get_step_full_name(stage, name) for name in names)
-        instances = [c(name) for name, c in zip(names, classes)]
-        for instance in instances:
-            self.logger.info(f"Executing step: {instance.name}")
-            try:
-                # Create a wrapper for the context, so the step sees only its
-                # options.
-                step_context = self.ctx.step_view(instance.name)
-                self.logger.debug(f"With options: {step_context.options}")
+        with trace.span(stage, trace.STAGE):
+            for instance in self.get_steps(stage):
+                self.execute_step(instance)
+
+    def execute_graph(self):
+        """
+        Executes steps of all the stages, according to the step dependencies.
+        """
+        steps = [step for stage in self.stages
+                 for step in self.get_steps(stage)]
+        dependencies = get_step_dependencies(
+            steps, self.depends_on, all_stages=self.stages_dictionary.keys())
+        check_acyclic(dependencies)
+        pending = list(steps)
+        started_stages = set()
+        # stage -> [start timestamp, end timestamp, number of pending steps]
+        stage_times = {}
+        for step in steps:
+            stage, _ = step.name.strip("/").split("/")
+            stage_times.setdefault(stage, [None, None, 0])[2] += 1
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=self.max_parallel_steps) as pool:
+            while pending or running:
+                if failure is None:
+                    ready = [s for s in pending if not dependencies[s.name]]
+                    n_free = self.max_parallel_steps - len(running)
+                    for step in ready[:n_free]:
+                        stage, _ = step.name.strip("/").split("/")
+                        if stage not in started_stages:
+                            started_stages.add(stage)
+                            stage_times[stage][0] = trace.now_us()
+                            self.logger.info(f"Executing stage: {stage}")
+                        pending.remove(step)
+                        running[pool.submit(self.execute_step, step)] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    if future.exception() is not None:
+                        if failure is None:
+                            failure = (step, future.exception())
+                        continue
+                    for deps in dependencies.values():
+                        deps.discard(step.name)
+                    stage, _ = step.name.strip("/").split("/")
+                    stage_times[stage][2] -= 1
+                    if stage_times[stage][2] == 0:
+                        self._trace_stage(stage, stage_times[stage][0])
+        if failure is not None:
+            step, e = failure
+            stage, _ = step.name.strip("/").split("/")
+            self.logger.error(f"Exception while executing "
+                              f"stage: {stage}. Check the errors.")
+            self.logger.error("Stopping pipeline execution.")
+            raise e
+        if pending:
+            raise ValueError(f"Unable to execute steps: "
+                             f"{[s.name for s in pending]}")
+
+    def _trace_stage(self, stage: str, start: int):
+        tracer = trace.get_tracer()
+        if tracer is not None:
+            tracer.add_span(stage, trace.STAGE, start, trace.now_us() - start)
+
+    def get_steps(self, stage: str):
+        """
+        Returns the list of step instances for the given stage.
+
+        The step classes referenced by import path ("module:Class") are
+        imported here, i.e. only when the stage is executed.
+        """
+        steps = normalize_steps(self.stages_dictionary[stage])
+        names = (get_step_full_name(stage, name) for name, _ in steps)
+        classes = (resolve_step_class(c) for _, c in steps)
+        return [c(name) for name, c in zip(names, classes)]
+
+    def execute_step(self, instance: Step):
+        with trace.span(instance.name, trace.STEP):
+            self._execute_step(instance)
+
+    def _execute_step(self, instance: Step):
+        self.logger.info(f"Executing step: {instance.name}")
+        try:
+            # Create a wrapper for the context, so the step sees only its
+            # options.
+            step_context = self.ctx.step_view(instance.name)
+            self.logger.debug(f"With options: {step_context.options}")
+            self.set_step_sh_options(instance, step_context)
+            if (self.fingerprints is not None
+                    and fingerprint.has_declared_inputs(instance)):
+                self.execute_incremental_step(instance, step_context)
+            else:
                 instance.execute(step_context)
-            except Exception as e:
-                self.logger.error(f"Exception while executing step: "
-                                  f"{instance.name}. Check the errors.")
-                raise e
+        except Exception as e:
+            self.logger.error(f"Exception while executing step: "
+                              f"{instance.name}. Check the errors.")
+            raise e
 
+    def set_step_sh_options(self, instance: Step, step_context: Context):
+        """
+        Sets the step's deadline and log file for the commands run by
+        the step.
+        """
+        stage, step = instance.name.strip("/").split("/")
+        timeout = self.timeouts.get(f"{stage}/{step}",
+                                    self.timeouts.get(stage, None))
+        if timeout is not None:
+            step_context.sh_options["deadline"] = time.monotonic() + timeout
+        if self.logs_dir is not None:
+            os.makedirs(self.logs_dir, exist_ok=True)
+            file_name = re.sub(r"[^\w.-]", "_", f"{stage}_{step}")
+            log_file = os.path.join(self.logs_dir, f"{file_name}.log")
+            # Start with an empty log, the commands append their output.
+            open(log_file, "wb").close()
+            step_context.sh_options["log_file"] = log_file
+
+    def execute_incremental_step(self, instance: Step, step_context: Context):
+        step_fingerprint = fingerprint.compute_fingerprint(instance,
+                                                           step_context)
+        if self.fingerprints.get(instance.name) == step_fingerprint:
+            self.logger.info(f"Skipping step: {instance.name}, its inputs "
+                             f"have not changed since the last run "
+                             f"(fingerprint: {step_fingerprint[:12]}).")
+            return
+        # Invalidate the previous result, in case this execution fails.
+        self.fingerprints.remove(instance.name)
+        instance.execute(step_context)
+        self.fingerprints.set(instance.name, step_fingerprint)
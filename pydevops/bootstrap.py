@@ -0,0 +1,163 @@
+"""
+Installation of pydevops on the remote hosts and docker containers.
+
+The remote pydevops is installed in a virtual environment in the
+version-keyed directory (~/.cache/pydevops/<version>), outside the source
+and build directories, so it survives --clean and is shared by all
+the pipelines run on the given host (container) with the same pydevops
+version. The package is installed from a wheel built from the local
+pydevops package (no network access is needed).
+"""
+import base64
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import tempfile
+import zipfile
+
+from pydevops.utils import get_logger
+from pydevops.version import __version__
+import pydevops.sync as sync
+
+logger = get_logger("pydevops.bootstrap")
+
+DISTRIBUTION_NAME = "pydevops-us4us"
+BOOTSTRAP_ROOT_DIR = "~/.cache/pydevops"
+READY_FILE_NAME = "ready"
+WHEELS_DIR_NAME = "wheels"
+
+# Executed on the remote side: prints the bootstrap state (JSON).
+_HANDSHAKE_SCRIPT = """
+import json, os, sys
+root, version = sys.argv[1], sys.argv[2]
+bootstrap_dir = os.path.join(os.path.expanduser(root), version)
+if os.name == "nt":
+    exe = os.path.join(bootstrap_dir, "venv", "Scripts", "pydevops.exe")
+else:
+    exe = os.path.join(bootstrap_dir, "venv", "bin", "pydevops")
+ready = False
+ready_path = os.path.join(bootstrap_dir, "ready")
+if os.path.isfile(ready_path) and os.path.isfile(exe):
+    with open(ready_path) as f:
+        ready = f.read().strip() == version
+print(json.dumps({"dir": bootstrap_dir, "exe": exe, "ready": ready}))
+"""
+
+# Executed on the remote side: creates the virtual environment and installs
+# pydevops from the wheels directory. Concurrent installations (e.g. many
+# pipelines started on the same host) are serialized with a file lock.
+_INSTALL_SCRIPT = """
+import os, shutil, subprocess, sys
+bootstrap_dir, version, name = sys.argv[1], sys.argv[2], sys.argv[3]
+os.makedirs(bootstrap_dir, exist_ok=True)
+lock = open(os.path.join(bootstrap_dir, "lock"), "a")
+try:
+    import fcntl
+    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+except ImportError:
+    pass
+ready_path = os.path.join(bootstrap_dir, "ready")
+if os.path.isfile(ready_path):
+    sys.exit(0)
+venv_dir = os.path.join(bootstrap_dir, "venv")
+shutil.rmtree(venv_dir, ignore_errors=True)
+subprocess.check_call([sys.executable, "-m", "venv",
+                       "--system-site-packages", venv_dir])
+if os.name == "nt":
+    python = os.path.join(venv_dir, "Scripts", "python.exe")
+else:
+    python = os.path.join(venv_dir, "bin", "python")
+subprocess.check_call([python, "-m", "pip", "install", "--no-index",
+                       "--disable-pip-version-check", "--find-links",
+                       os.path.join(bootstrap_dir, "wheels"),
+                       f"{name}=={version}"])
+with open(ready_path, "w") as f:
+    f.write(version)
+"""
+
+
+def get_wheel_name(version: str = __version__):
+    name = DISTRIBUTION_NAME.replace("-", "_")
+    return f"{name}-{version}-py3-none-any.whl"
+
+
+def _record_hash(data: bytes):
+    digest = hashlib.sha256(data).digest()
+    return "sha256=" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def build_wheel(dst_dir: str, version: str = __version__) -> str:
+    """
+    Builds a (pure python) wheel of the local pydevops package in
+    the dst_dir, returns the path to the wheel.
+
+    Note: the wheel does not declare the dependencies (they are needed only
+    by some of the steps, e.g. github); the remote virtual environment has
+    access to the system site packages.
+    """
+    package_dir = pathlib.Path(__file__).parent
+    dist_info = f"{DISTRIBUTION_NAME.replace('-', '_')}-{version}.dist-info"
+    files = {}
+    for path in sorted(package_dir.rglob("*.py")):
+        rel = path.relative_to(package_dir.parent).as_posix()
+        files[rel] = path.read_bytes()
+    files[f"{dist_info}/METADATA"] = (
+        f"Metadata-Version: 2.1\nName: {DISTRIBUTION_NAME}\n"
+        f"Version: {version}\n").encode("utf-8")
+    files[f"{dist_info}/WHEEL"] = (
+        "Wheel-Version: 1.0\nGenerator: pydevops\n"
+        "Root-Is-Purelib: true\nTag: py3-none-any\n").encode("utf-8")
+    files[f"{dist_info}/entry_points.txt"] = (
+        "[console_scripts]\npydevops = pydevops:main\n").encode("utf-8")
+    record = [f"{name},{_record_hash(data)},{len(data)}"
+              for name, data in files.items()]
+    record.append(f"{dist_info}/RECORD,,")
+    files[f"{dist_info}/RECORD"] = ("\n".join(record) + "\n").encode("utf-8")
+    path = os.path.join(dst_dir, get_wheel_name(version))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as wheel:
+        for name, data in files.items():
+            wheel.writestr(name, data)
+    return path
+
+
+def handshake(client, version: str = __version__) -> dict:
+    """
+    Returns the state of the remote bootstrap: dir (the remote bootstrap
+    directory), exe (the path to the remote pydevops executable), ready
+    (whether the given version is installed).
+    """
+    cmd = sync.python_command(_HANDSHAKE_SCRIPT, BOOTSTRAP_ROOT_DIR, version)
+    result = subprocess.run(client.remote_command_args(cmd),
+                            stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def bootstrap(client, wheels_dir: str = None, version: str = __version__):
+    """
+    Makes sure the pydevops with the given version is installed on the remote
+    host (container), returns the path to the remote pydevops executable.
+
+    :param client: remote client, that implements
+      `remote_command_args(cmd: str) -> list`
+    :param wheels_dir: a local directory with the wheels to install
+      (pydevops and, optionally, its dependencies); by default, the wheel
+      is built from the local pydevops package
+    """
+    state = handshake(client, version)
+    if state["ready"]:
+        logger.debug(f"Using the remote pydevops {version}: {state['exe']}")
+        return state["exe"]
+    logger.info(f"Installing pydevops {version} in {state['dir']}")
+    remote_wheels_dir = f"{state['dir']}/{WHEELS_DIR_NAME}"
+    if wheels_dir is not None:
+        sync.sync_to_remote(client, wheels_dir, remote_wheels_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="pydevops-wheel-") as tmp:
+            build_wheel(tmp, version)
+            sync.sync_to_remote(client, tmp, remote_wheels_dir)
+    cmd = sync.python_command(_INSTALL_SCRIPT, state["dir"], version,
+                              DISTRIBUTION_NAME)
+    subprocess.run(client.remote_command_args(cmd), check=True)
+    return state["exe"]
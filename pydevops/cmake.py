@@ -1,5 +1,34 @@
+import hashlib
+import json
 import os
+import shutil
+import subprocess
 from pydevops.base import Step, Context
+from pydevops.fingerprint import ALL_OPTIONS, hash_file
+import pydevops.resources as resources
+from pydevops.utils import get_logger
+
+CMAKE_CACHE_FILE_NAME = "CMakeCache.txt"
+CTEST_FAILED_TESTS_FILE = os.path.join("Testing", "Temporary",
+                                       "LastTestsFailed.log")
+TEST_CACHE_FILE_NAME = "pydevops_test_cache.json"
+# Build outputs, that the tests can load (shared and static libraries,
+# python extension modules).
+LIBRARY_SUFFIXES = (".so", ".dylib", ".dll", ".a", ".lib", ".pyd")
+# Supported compiler launchers: name -> cache directory env variable.
+COMPILER_LAUNCHERS = {
+    "ccache": "CCACHE_DIR",
+    "sccache": "SCCACHE_DIR"
+}
+COMPILER_LAUNCHER_LANGUAGES = ("C", "CXX", "CUDA")
+
+logger = get_logger("cmake")
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
 
 
 def _convert_dict_to_kv_params(d: dict):
@@ -9,17 +38,114 @@ def _convert_dict_to_kv_params(d: dict):
     return " ".join(result)
 
 
+def find_compiler_launcher(name: str):
+    """
+    Returns the path to the compiler launcher (ccache, sccache), or
+    None if not available.
+
+    :param name: launcher name, "auto" (the first available one) or "none"
+    """
+    name = name.strip().lower()
+    if name == "none":
+        return None
+    if name == resources.AUTO:
+        candidates = COMPILER_LAUNCHERS.keys()
+    elif name in COMPILER_LAUNCHERS:
+        candidates = (name, )
+    else:
+        raise ValueError(f"Unknown compiler launcher: {name}, available: "
+                         f"{list(COMPILER_LAUNCHERS.keys())}, auto, none")
+    for candidate in candidates:
+        path = shutil.which(candidate)
+        if path is not None:
+            return path
+    if name != resources.AUTO:
+        raise ValueError(f"Compiler launcher not found: {name}")
+    return None
+
+
+def get_launcher_name(path: str):
+    name = os.path.basename(path).lower()
+    if name.endswith(".exe"):
+        name = name[:-len(".exe")]
+    return name
+
+
+def get_compiler_launcher_params(launcher: str, cache_dir: str = None):
+    """
+    Returns the cmake parameters, that set the given compiler launcher for
+    all the supported languages. The cache directory is passed to the
+    launcher through the environment (cmake -E env).
+    """
+    value = launcher
+    if cache_dir is not None:
+        env_variable = COMPILER_LAUNCHERS[get_launcher_name(launcher)]
+        cache_dir = os.path.abspath(cache_dir)
+        cmake = shutil.which("cmake") or "cmake"
+        value = f"{cmake};-E;env;{env_variable}={cache_dir};{launcher}"
+    return " ".join(f"\"-DCMAKE_{language}_COMPILER_LAUNCHER={value}\""
+                    for language in COMPILER_LAUNCHER_LANGUAGES)
+
+
+def read_cmake_cache(build_dir: str) -> dict:
+    """
+    Returns the variables from the CMakeCache.txt in the given build
+    directory (name -> value), an empty dict if there is no cache.
+    """
+    result = {}
+    path = os.path.join(build_dir, CMAKE_CACHE_FILE_NAME)
+    if not os.path.exists(path):
+        return result
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(("#", "//")) or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            result[key.split(":", 1)[0]] = value
+    return result
+
+
+def get_configured_launcher(build_dir: str):
+    """
+    Returns the compiler launcher configured in the given build directory:
+    a pair (path to the launcher, environment variables), or None.
+    """
+    cache = read_cmake_cache(build_dir)
+    for language in COMPILER_LAUNCHER_LANGUAGES:
+        value = cache.get(f"CMAKE_{language}_COMPILER_LAUNCHER", None)
+        if not value:
+            continue
+        parts = value.split(";")
+        env = dict(p.split("=", 1) for p in parts if "=" in p)
+        launcher = parts[-1]
+        if get_launcher_name(launcher) in COMPILER_LAUNCHERS:
+            return launcher, env
+    return None
+
+
 class Configure(Step):
     """
     CMake configure step.
     """
+    input_options = ALL_OPTIONS
+    input_files = ("**/CMakeLists.txt", "**/*.cmake")
+    # Files generated by conan install.
+    input_build_files = ("conaninfo.txt", "conanbuildinfo.cmake",
+                         "conan_paths.cmake", "conan_toolchain.cmake")
 
     def execute(self, ctx: Context):
         src_dir = ctx.get_param("src_dir")
         build_dir = ctx.get_param("build_dir")
         options = ctx.get_options()
         generator = options.pop("generator")
+        launcher = options.pop("compiler_launcher", "none")
+        cache_dir = options.pop("compiler_cache_dir", None)
         others = _convert_dict_to_kv_params(options)
+        launcher = find_compiler_launcher(launcher)
+        if launcher is not None:
+            logger.info(f"Using compiler launcher: {launcher}")
+            others += " " + get_compiler_launcher_params(launcher, cache_dir)
         ctx.sh(f"cmake -S {src_dir} -B {build_dir} -G {generator} {others}")
 
 
@@ -28,7 +154,10 @@ class Build(Step):
         src_dir = ctx.get_param("src_dir")
         build_dir = ctx.get_param("build_dir")
         config = ctx.get_option("config")
-        n_jobs = ctx.get_option_default("j", 1)
+        n_jobs = resources.get_n_jobs(
+            ctx.get_option_default("j", resources.AUTO),
+            ctx.get_option_default("mem_per_job",
+                                   resources.DEFAULT_MEMORY_PER_JOB))
         verbose = ctx.get_option_default("verbose", False)
         cmd = f"cmake --build {build_dir} --config {config} -j {n_jobs}"
         if verbose:
@@ -36,7 +165,253 @@ class Build(Step):
         if ctx.has_option("target"):
             target = ctx.get_option("target")
             cmd += f" --target {target}"
-        ctx.sh(cmd)
+        launcher = get_configured_launcher(build_dir)
+        stats_before = None
+        if launcher is not None:
+            stats_before = self.read_compiler_cache_stats(ctx, launcher)
+        try:
+            ctx.sh(cmd)
+        finally:
+            if stats_before is not None:
+                stats_after = self.read_compiler_cache_stats(ctx, launcher)
+                if stats_after is not None:
+                    self.print_compiler_cache_stats(launcher, stats_before,
+                                                    stats_after)
+
+    def read_compiler_cache_stats(self, ctx: Context, launcher):
+        """
+        Returns the current compiler cache statistics (see
+        parse_compiler_cache_stats), or None if not available.
+
+        Note: the statistics are only read, never zeroed: the cache (and its
+        statistics) can be shared with other builds and the user.
+        """
+        path, env = launcher
+        name = get_launcher_name(path)
+        if name == "sccache":
+            flags = "--show-stats --stats-format=json"
+        else:
+            flags = "--print-stats"
+        try:
+            output = ctx.sh(f"\"{path}\" {flags}", capture_stdout=True,
+                            env_extend=env).stdout
+            return parse_compiler_cache_stats(name, output)
+        except Exception as e:
+            logger.warning(f"Unable to get the compiler cache statistics: {e}")
+            return None
+
+    def print_compiler_cache_stats(self, launcher, before: dict, after: dict):
+        path, _ = launcher
+        hits = after["hits"] - before["hits"]
+        misses = after["misses"] - before["misses"]
+        total = hits + misses
+        hit_rate = f", hit rate: {100*hits/total:.1f}%" if total > 0 else ""
+        # Note: includes the compilations of the concurrent builds, that
+        # use the same cache.
+        print(f"Compiler cache ({get_launcher_name(path)}): "
+              f"{hits} hit(s), {misses} miss(es){hit_rate}")
+
+
+def parse_compiler_cache_stats(name: str, output: str) -> dict:
+    """
+    Returns the number of the compiler cache hits and misses
+    ({"hits": ..., "misses": ...}) from the output of
+    `ccache --print-stats` or `sccache --show-stats --stats-format=json`.
+    """
+    if name == "sccache":
+        stats = json.loads(output[output.index("{"):output.rindex("}")+1])
+        stats = stats["stats"]
+        return {
+            "hits": sum(stats["cache_hits"]["counts"].values()),
+            "misses": sum(stats["cache_misses"]["counts"].values())
+        }
+    values = {}
+    for line in output.splitlines():
+        key, _, value = line.partition("\t")
+        if value.strip().isdigit():
+            values[key.strip()] = int(value)
+    if "cache_miss" not in values:
+        raise ValueError(f"Unexpected ccache statistics: {output}")
+    return {
+        "hits": (values.get("direct_cache_hit", 0)
+                 + values.get("preprocessed_cache_hit", 0)),
+        "misses": values["cache_miss"]
+    }
+
+
+def read_ctest_cost_data(path: str) -> dict:
+    """
+    Returns the test durations measured by CTest in the previous runs
+    (test name -> average duration [s]), from the given CTestCostData.txt.
+    """
+    result = {}
+    if not os.path.exists(path):
+        return result
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line == "---":
+                # The list of the failed tests follows.
+                break
+            parts = line.rsplit(" ", 2)
+            if len(parts) != 3:
+                continue
+            name, _, cost = parts
+            try:
+                result[name] = float(cost)
+            except ValueError:
+                continue
+    return result
+
+
+def list_ctest_tests(ctx: Context, build_dir: str, config: str):
+    """
+    Returns the list of tests (CTest JSON test descriptions: name, command,
+    properties), in the CTest order (test number - 1).
+    """
+    output = ctx.sh(f"ctest -C {config} --show-only=json-v1",
+                    capture_stdout=True, cwd=build_dir).stdout
+    return json.loads(output)["tests"]
+
+
+def get_shard(tests, costs: dict, shard_index: int, shard_count: int):
+    """
+    Returns the (1-based) numbers of the tests assigned to the given shard.
+
+    The tests are assigned greedily, from the longest one, to the shard
+    with the lowest total duration so far; the tests with unknown duration
+    are assumed to take the average time.
+    """
+    known = [costs[t] for t in tests if t in costs]
+    default_cost = sum(known)/len(known) if known else 1.0
+    order = sorted(range(len(tests)),
+                   key=lambda i: (-costs.get(tests[i], default_cost), i))
+    totals = [0.0]*shard_count
+    result = []
+    for i in order:
+        shard = min(range(shard_count), key=lambda s: (totals[s], s))
+        totals[shard] += costs.get(tests[i], default_cost)
+        if shard == shard_index:
+            result.append(i + 1)
+    return sorted(result)
+
+
+def read_failed_tests(build_dir: str):
+    """
+    Returns the names of the tests that failed in the last CTest run.
+    """
+    path = os.path.join(build_dir, CTEST_FAILED_TESTS_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        # Format: test number:test name
+        return {line.strip().split(":", 1)[1] for line in f
+                if ":" in line}
+
+
+def _hash_file_cached(path: str, file_hashes: dict) -> str:
+    if path not in file_hashes:
+        file_hash = hashlib.sha256()
+        hash_file(path, file_hash)
+        file_hashes[path] = file_hash.hexdigest()
+    return file_hashes[path]
+
+
+def is_library(name: str):
+    # Note: versioned shared libraries, e.g. libfoo.so.1.2.
+    return name.endswith(LIBRARY_SUFFIXES) or ".so." in name
+
+
+def compute_libraries_hash(build_dir: str, file_hashes: dict) -> str:
+    """
+    Computes the hash of all the libraries built in the given build
+    directory (their paths and content).
+
+    :param file_hashes: file path -> hash, the hashes computed so far
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(build_dir):
+        dirs[:] = sorted(d for d in dirs if d != "CMakeFiles")
+        for name in sorted(files):
+            if not is_library(name):
+                continue
+            path = os.path.join(root, name)
+            if not os.path.isfile(path):
+                continue
+            rel_path = os.path.relpath(path, build_dir)
+            h.update(f"{rel_path}:{_hash_file_cached(path, file_hashes)}"
+                     .encode("utf-8"))
+    return h.hexdigest()
+
+
+def compute_test_fingerprint(test: dict, file_hashes: dict, build_dir: str,
+                             libraries_hash: str = None) -> str:
+    """
+    Computes the fingerprint of the given test: its command line and
+    properties, the content of the test executable, the files passed
+    in the command line and the REQUIRED_FILES. Relative paths are resolved
+    against the test WORKING_DIRECTORY, or the build directory.
+
+    :param test: CTest JSON test description
+    :param file_hashes: file path -> hash, the hashes computed so far
+    :param build_dir: the build directory
+    :param libraries_hash: the hash of the libraries the test can load
+      (see compute_libraries_hash)
+    """
+    h = hashlib.sha256()
+    command = test.get("command", [])
+    properties = {p["name"]: p["value"] for p in test.get("properties", [])}
+    h.update(json.dumps([command, properties, libraries_hash],
+                        sort_keys=True).encode("utf-8"))
+    cwd = os.path.join(build_dir,
+                       properties.get("WORKING_DIRECTORY", None) or "")
+    required_files = properties.get("REQUIRED_FILES", [])
+    if isinstance(required_files, str):
+        required_files = required_files.split(";")
+    paths = list(command) + list(required_files)
+    for i, path in enumerate(paths):
+        if i == 0 and os.path.basename(path) == path:
+            # Executable name, looked up in the PATH.
+            path = shutil.which(path) or os.path.join(cwd, path)
+        else:
+            path = os.path.join(cwd, path)
+        if not os.path.isfile(path):
+            continue
+        h.update(f"{i}:{_hash_file_cached(path, file_hashes)}"
+                 .encode("utf-8"))
+    return h.hexdigest()
+
+
+class TestResultCache:
+    """
+    Fingerprints of the tests that passed, kept in the build directory.
+    """
+
+    def __init__(self, build_dir: str):
+        self.path = os.path.join(build_dir, TEST_CACHE_FILE_NAME)
+        self.fingerprints = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.fingerprints = json.load(f)
+            except ValueError:
+                logger.warning(f"Invalid test cache file: {self.path}, "
+                               f"ignoring it.")
+
+    def is_passed(self, name: str, test_fingerprint: str):
+        return self.fingerprints.get(name, None) == test_fingerprint
+
+    def set_passed(self, name: str, test_fingerprint: str):
+        self.fingerprints[name] = test_fingerprint
+
+    def remove(self, name: str):
+        self.fingerprints.pop(name, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.fingerprints, f, indent=2)
+        os.replace(tmp_path, self.path)
 
 
 class Test(Step):
@@ -45,16 +420,101 @@ class Test(Step):
         build_dir = ctx.get_param("build_dir")
         config = ctx.get_option("C")
         verbose = ctx.get_option_default("verbose", False)
+        n_jobs = resources.get_n_jobs(
+            ctx.get_option_default("j", 1),
+            ctx.get_option_default("mem_per_job",
+                                   resources.DEFAULT_MEMORY_PER_JOB))
+        shard_index = int(ctx.get_option_default("shard_index", 0))
+        shard_count = int(ctx.get_option_default("shard_count", 1))
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Invalid shard index: {shard_index}, "
+                             f"shard count: {shard_count}")
+        cost_data = ctx.get_option_default("shard_cost_data", None)
+        cache_results = _to_bool(ctx.get_option_default("cache_results",
+                                                        False))
         # Note: tests have to be run from the build dir
-        cwd = os.getcwd()
+        # With -j, CTest starts the longest tests first, according to
+        # the durations from the previous runs (Testing/Temporary/
+        # CTestCostData.txt in the build dir).
+        cmd = f"ctest -C {config} -j {n_jobs}"
+        if verbose:
+            cmd += " --verbose"
+        if shard_count > 1 and cost_data is None and not cache_results:
+            # Every shard_count-th test.
+            ctx.sh(f"{cmd} -I {shard_index + 1},,{shard_count}",
+                   cwd=build_dir)
+            return
+        elif shard_count == 1 and not cache_results:
+            ctx.sh(cmd, cwd=build_dir)
+            return
+        tests = list_ctest_tests(ctx, build_dir, config)
+        selected = list(range(1, len(tests) + 1))
+        if shard_count > 1:
+            if cost_data is None:
+                selected = selected[shard_index::shard_count]
+            else:
+                # Note: all the shards have to use the same cost data, so
+                # that each test is assigned to exactly one shard.
+                costs = read_ctest_cost_data(cost_data)
+                selected = get_shard([t["name"] for t in tests], costs,
+                                     shard_index, shard_count)
+            logger.info(f"Running shard {shard_index + 1}/{shard_count}: "
+                        f"{len(selected)} of {len(tests)} test(s).")
+        if cache_results:
+            self.execute_cached(ctx, cmd, build_dir, tests, selected)
+        elif selected:
+            ctx.sh(f"{cmd} -I 0,0,0,{','.join(map(str, selected))}",
+                   cwd=build_dir)
+
+    def execute_cached(self, ctx: Context, cmd: str, build_dir: str, tests,
+                       selected):
+        """
+        Runs only the selected tests, that have changed or have not passed
+        since the last run.
+        """
+        cache = TestResultCache(build_dir)
+        file_hashes = {}
+        fingerprints = {}
+        to_run = []
+        # Note: the tests are run again, when any of the libraries
+        # has been rebuilt.
+        libraries_hash = compute_libraries_hash(build_dir, file_hashes)
+        for number in selected:
+            test = tests[number - 1]
+            fingerprints[number] = compute_test_fingerprint(
+                test, file_hashes, build_dir, libraries_hash)
+            if not cache.is_passed(test["name"], fingerprints[number]):
+                to_run.append(number)
+        n_cached = len(selected) - len(to_run)
+        logger.info(f"Tests to run: {len(to_run)}, passed previously "
+                    f"(cached): {n_cached}.")
+        if not to_run:
+            return
+        failed_log = os.path.join(build_dir, CTEST_FAILED_TESTS_FILE)
+        if os.path.exists(failed_log):
+            os.remove(failed_log)
+        failed = None
         try:
-            os.chdir(build_dir)
-            cmd = f"ctest -C {config}"
-            if verbose:
-                cmd += " --verbose"
-            ctx.sh(cmd)
+            ctx.sh(f"{cmd} -I 0,0,0,{','.join(map(str, to_run))}",
+                   cwd=build_dir)
+            failed = set()
+        except subprocess.CalledProcessError:
+            failed = read_failed_tests(build_dir) or None
+            raise
         finally:
-            os.chdir(cwd)
+            if failed is None:
+                # Unknown result (e.g. CTest itself failed or was
+                # interrupted): run all the tests next time.
+                failed = {tests[number - 1]["name"] for number in to_run}
+            for number in to_run:
+                name = tests[number - 1]["name"]
+                if name in failed:
+                    cache.remove(name)
+                else:
+                    cache.set_passed(name, fingerprints[number])
+            cache.save()
+            logger.info(f"Tests run: {len(to_run)}, failed: {len(failed)}, "
+                        f"passed previously (cached): {n_cached}.")
 
 
 class Install(Step):
@@ -1,4 +1,181 @@
+import hashlib
+import json
+import os
+import time
+
 from pydevops.base import Step, Context
+from pydevops.fingerprint import hash_file
+from pydevops.utils import get_logger, FileLock
+
+CONAN_STATE_FILE_NAME = "pydevops_conan.json"
+CONAN_INFO_FILE_NAME = "conaninfo.txt"
+CONANFILE_NAMES = ("conanfile.txt", "conanfile.py")
+LOCKFILE_NAME = "conan.lock"
+SHARED_CACHE_LOCK_FILE_NAME = ".pydevops_cache.lock"
+SHARED_CACHE_USAGE_FILE_NAME = ".pydevops_cache_usage.json"
+
+GB = 1024**3
+
+logger = get_logger("conan")
+
+
+def get_install_hash(src_dir: str, options: dict, conan_home: str = None):
+    """
+    Returns the hash of the conan install inputs: conanfile, lockfile,
+    profile and the step options (settings).
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(options, sort_keys=True, default=str)
+             .encode("utf-8"))
+    h.update(str(conan_home).encode("utf-8"))
+    paths = [os.path.join(src_dir, name)
+             for name in CONANFILE_NAMES + (LOCKFILE_NAME, )]
+    profile = options.get("profile", None)
+    if profile:
+        paths.append(profile)
+    for path in paths:
+        if os.path.isfile(path):
+            h.update(path.encode("utf-8"))
+            hash_file(path, h)
+    return h.hexdigest()
+
+
+def read_full_requires(install_dir: str):
+    """
+    Returns the references of all the packages (including the transitive
+    dependencies) installed in the given install dir, according to
+    the conaninfo.txt.
+    """
+    path = os.path.join(install_dir, CONAN_INFO_FILE_NAME)
+    result = []
+    if not os.path.exists(path):
+        return result
+    section = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+            elif section == "full_requires" and line:
+                # name/version@user/channel:package_id
+                reference = line.split(":", 1)[0]
+                if "@" not in reference:
+                    reference += "@"
+                result.append(reference)
+    return result
+
+
+def get_dir_size(path: str):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class SharedCache:
+    """
+    Conan home directory shared by many build directories (and docker
+    containers). The installs are serialized with an inter-process file
+    lock. The last use of each package is recorded, so the least recently
+    used packages can be removed when the cache exceeds the given size.
+
+    :param path: path to the shared conan home directory
+    :param max_size: the maximum size of the packages in the cache [GB]
+      (None: no limit)
+    """
+
+    def __init__(self, path: str, max_size: float = None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = FileLock(os.path.join(self.path,
+                                          SHARED_CACHE_LOCK_FILE_NAME))
+        self.usage_path = os.path.join(self.path,
+                                       SHARED_CACHE_USAGE_FILE_NAME)
+
+    @property
+    def data_dir(self):
+        return os.path.join(self.path, ".conan", "data")
+
+    def read_usage(self) -> dict:
+        if not os.path.exists(self.usage_path):
+            return {}
+        try:
+            with open(self.usage_path) as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def write_usage(self, usage: dict):
+        tmp_path = f"{self.usage_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(usage, f, indent=2)
+        os.replace(tmp_path, self.usage_path)
+
+    def mark_used(self, references):
+        usage = self.read_usage()
+        now = time.time()
+        for reference in references:
+            usage[reference] = now
+        self.write_usage(usage)
+
+    def list_references(self) -> dict:
+        """
+        Returns the packages in the cache: reference -> path.
+        """
+        result = {}
+        if not os.path.isdir(self.data_dir):
+            return result
+        # data/name/version/user/channel
+        for name in os.listdir(self.data_dir):
+            for version in os.listdir(os.path.join(self.data_dir, name)):
+                version_dir = os.path.join(self.data_dir, name, version)
+                for user in os.listdir(version_dir):
+                    for channel in os.listdir(os.path.join(version_dir,
+                                                           user)):
+                        reference = f"{name}/{version}@"
+                        if user != "_":
+                            reference += f"{user}/{channel}"
+                        result[reference] = os.path.join(version_dir, user,
+                                                         channel)
+        return result
+
+    def evict(self, ctx: Context, keep):
+        """
+        Removes the least recently used packages, until the cache size is
+        below the limit. The packages from the `keep` list are never removed.
+        """
+        if self.max_size is None:
+            return
+        references = self.list_references()
+        sizes = {ref: get_dir_size(path) for ref, path in references.items()}
+        total = sum(sizes.values())
+        limit = self.max_size*GB
+        if total <= limit:
+            return
+        usage = self.read_usage()
+        keep = set(keep)
+        candidates = sorted((ref for ref in references if ref not in keep),
+                            key=lambda ref: usage.get(ref, 0))
+        for reference in candidates:
+            if total <= limit:
+                break
+            logger.info(f"Removing the least recently used package from "
+                        f"the shared cache: {reference}")
+            ctx.sh(f"conan remove -f {reference}",
+                   env_extend={"CONAN_USER_HOME": self.path})
+            total -= sizes[reference]
+            usage.pop(reference, None)
+        self.write_usage(usage)
+        if total > limit:
+            logger.warning(f"The shared conan cache size "
+                           f"({total/GB:.2f} GB) exceeds the limit "
+                           f"({self.max_size} GB), all the remaining "
+                           f"packages are in use.")
 
 
 class Install(Step):
@@ -10,13 +187,67 @@ class Install(Step):
         build = context.get_option_default("build", None)
         profile_file = context.get_option_default("profile", None)
         conan_home = context.get_option_default("conan_home", None)
+        shared_cache_dir = context.get_option_default("shared_cache_dir",
+                                                      None)
+        max_size = context.get_option_default("shared_cache_max_size", None)
         cmd = f"conan install --build=missing {src_dir} -if {build_dir} " \
               f"-s build_type={build_type} "
         if build:
             cmd += f"--build={build} "
         if profile_file:
             cmd += f"--profile={profile_file}"
-        if conan_home:
+
+        cache = None
+        if shared_cache_dir:
+            conan_home = shared_cache_dir
+            cache = SharedCache(
+                shared_cache_dir,
+                float(max_size) if max_size is not None else None)
+        install_hash = get_install_hash(src_dir, context.get_options(),
+                                        conan_home)
+        state_path = os.path.join(build_dir, CONAN_STATE_FILE_NAME)
+        if self.is_installed(build_dir, state_path, install_hash, cache):
+            logger.info("Conan dependencies are up to date, skipping "
+                        "conan install.")
+            return
+        if cache is not None:
+            with cache.lock:
+                context.sh(cmd, env_extend={"CONAN_USER_HOME": cache.path})
+                references = read_full_requires(build_dir)
+                cache.mark_used(references)
+                cache.evict(context, keep=references)
+        elif conan_home:
             context.sh(cmd, env_extend={"CONAN_USER_HOME": conan_home})
         else:
             context.sh(cmd)
+        with open(state_path, "w") as f:
+            json.dump({"hash": install_hash}, f)
+
+    def is_installed(self, build_dir: str, state_path: str,
+                     install_hash: str, cache: SharedCache = None):
+        """
+        Returns true if the dependencies were already installed in the given
+        build directory, for the same inputs. With the shared cache,
+        all the installed packages must still be present in the cache
+        (they could have been evicted by other builds); the packages are
+        then marked as used.
+        """
+        if not os.path.exists(os.path.join(build_dir, CONAN_INFO_FILE_NAME)):
+            return False
+        try:
+            with open(state_path) as f:
+                if json.load(f).get("hash", None) != install_hash:
+                    return False
+        except (OSError, ValueError):
+            return False
+        if cache is None:
+            return True
+        with cache.lock:
+            references = read_full_requires(build_dir)
+            missing = set(references) - set(cache.list_references())
+            if missing:
+                logger.info(f"Packages removed from the shared cache: "
+                            f"{', '.join(sorted(missing))}, reinstalling.")
+                return False
+            cache.mark_used(references)
+        return True
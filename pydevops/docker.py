@@ -1,17 +1,79 @@
 from pydevops.sh import Shell
+import hashlib
 import os
 import pathlib
+import subprocess
 from pydevops.utils import get_logger
+import pydevops.sync as sync
+
+# Source transfer modes.
+TRANSFER_COPY = "copy"
+TRANSFER_MOUNT = "mount"
+TRANSFER_MOUNT_RO = "mount-ro"
+TRANSFER_OVERLAY = "overlay"
+TRANSFER_MODES = (TRANSFER_COPY, TRANSFER_MOUNT, TRANSFER_MOUNT_RO,
+                  TRANSFER_OVERLAY)
+# The upper (container changes) and work directories of the overlay source
+# mount, in the local build directory.
+OVERLAY_DIR_NAME = "pydevops_docker_overlay"
+
+
+def index_parameters(params: str) -> dict:
+    params = params.strip().strip(";")
+    params = params.split(";")
+    result = {}
+    for p in params:
+        p = p.strip().strip("::")
+        p = p.split("::")
+        if len(p) != 2:
+            raise ValueError("Syntax error in docker options; each options"
+                             "should have a format name::params")
+        key, values = p
+        result[key] = values
+    return result
+
+
+def remove_container(parameters: str):
+    """
+    Removes the container pointed by the given docker parameters (if any).
+    """
+    container_id = index_parameters(parameters).get("container", None)
+    if container_id is None:
+        return
+    get_logger("pydevops.docker").info(f"Removing container: {container_id}")
+    try:
+        Shell().run(f"docker rm -f -v {container_id}", capture_stdout=True)
+    except subprocess.CalledProcessError:
+        # The container does not exist anymore.
+        pass
 
 
 class DockerClient:
     """
+    Executes commands in a long-lived docker container.
+
+    The container is created once (see `start`) and all the commands are
+    executed in it using `docker exec`, so the container state persists
+    between the commands and the pipeline invocations. The id of the
+    container is kept in the `container` parameter (see `params`).
+
+    :param parameters: docker parameters, in the format
+      key1::value1;key2::value2, where the available keys are:
+      name (image name), build (docker build parameters),
+      run (docker run parameters), shell (shell used to execute commands,
+      default: bash), container_name (name of the container, by default
+      derived from the build_dir), transfer (source transfer mode: copy,
+      mount, mount-ro or overlay, default: copy), container (container id)
+    :param build_dir: local build directory, used to name the container
     """
 
-    def __init__(self, parameters: str):
+    def __init__(self, parameters: str, build_dir: str = None):
         self.logger = get_logger(f"{type(self).__name__}_{id(self)}")
         self.parameters = self._index_parameters(parameters)
         self.image_id = None
+        self.build_dir = build_dir
+        # (host dir, container dir), see add_source_mount.
+        self.source_mount = None
         self.cmd_exec = Shell()
         build_params = self.parameters.get("build", None)
         name = self.parameters["name"]
@@ -22,17 +84,124 @@ class DockerClient:
         # Use the latest image with a given name
         self.image_id = self.cmd_exec.run(f"docker images -q {name}",
                                           capture_stdout=True).stdout
+        if self.transfer not in TRANSFER_MODES:
+            raise ValueError(f"Unknown docker transfer mode: {self.transfer},"
+                             f" available: {TRANSFER_MODES}")
+
+    @property
+    def transfer(self):
+        return self.parameters.get("transfer", TRANSFER_COPY)
+
+    @property
+    def is_source_mounted(self):
+        return self.transfer in (TRANSFER_MOUNT, TRANSFER_MOUNT_RO,
+                                 TRANSFER_OVERLAY)
+
+    def add_source_mount(self, src_dir: str, dst_dir: str):
+        """
+        Bind-mounts the host src_dir in the container's dst_dir, whenever
+        a new container is created (see `start`). The mount is not kept in
+        the docker parameters.
+        """
+        self.source_mount = (os.path.abspath(src_dir), dst_dir)
+
+    @property
+    def container_id(self):
+        return self.parameters.get("container", None)
+
+    @property
+    def shell(self):
+        return self.parameters.get("shell", "bash")
+
+    def start(self, recreate=False):
+        """
+        Makes sure the pipeline container is running: starts the existing
+        container or creates a new one, if necessary.
+
+        :param recreate: remove the existing container and create a new one
+        """
+        if recreate:
+            self.remove()
+        if self.container_id is not None:
+            status = self._get_container_status(self.container_id)
+            if status == "running":
+                return
+            elif status is not None:
+                self.logger.info(f"Starting container: {self.container_id}")
+                self.cmd_exec.run(f"docker start {self.container_id}",
+                                  capture_stdout=True)
+                return
+            self.logger.info(f"Container {self.container_id} not found.")
+        if not self.image_id:
+            raise ValueError("Build docker image first.")
+        container_name = self._get_container_name()
+        # Remove the leftovers from the previous runs, if any.
+        self._remove(container_name)
+        self.logger.info(f"Creating container: {container_name}")
+        run_params = self.parameters.get("run", "")
+        if self.source_mount is not None:
+            src_dir, dst_dir = self.source_mount
+            if self.transfer == TRANSFER_OVERLAY:
+                mount = self._create_overlay_mount(src_dir, dst_dir)
+            else:
+                mode = ":ro" if self.transfer == TRANSFER_MOUNT_RO else ""
+                mount = f"-v {src_dir}:{dst_dir}{mode}"
+            run_params = f"{run_params} {mount}"
+        # Note: the image entrypoint is expected to be a shell.
+        container_id = self.cmd_exec.run(
+            f"docker run -d --name {container_name} {run_params} "
+            f"{self.image_id} -c \"tail -f /dev/null\"",
+            capture_stdout=True).stdout
+        self.parameters["container"] = container_id.splitlines()[-1][:12]
+
+    def remove(self):
+        """
+        Stops and removes the pipeline container.
+        """
+        if self.container_id is None:
+            return
+        self.logger.info(f"Removing container: {self.container_id}")
+        self._remove(self.container_id)
+        self.parameters.pop("container")
 
     def cp_to_remote(self, src_dir: str, dst_dir: str):
         if src_dir == ".":
             src_dir = os.getcwd()
-        options = ""
-        if pathlib.Path(src_dir).is_dir():
-            options += "-r"
         # Write the directory to parent.
         dst_dir_parent = str(pathlib.Path(dst_dir).parents[0])
         self.mkdir(dst_dir_parent)
-        self.sh(f"cp -r {src_dir} {dst_dir}")
+        self.cmd_exec.run(f"docker cp {src_dir} {self.container_id}:{dst_dir}")
+
+    def sync_to_remote(self, src_dir: str, dst_dir: str, exclude=(),
+                       cache_file: str = None):
+        """
+        Transfers only new and modified files from the src_dir to the
+        container's dst_dir, see pydevops.sync.sync_to_remote.
+        """
+        return sync.sync_to_remote(self, src_dir, dst_dir, exclude=exclude,
+                                   cache_file=cache_file)
+
+    def cp_from_remote(self, src_dir: str, patterns, dst_dir: str,
+                       cache_file: str = None, exclude=()):
+        """
+        Copies the container's files matching the given glob patterns (relative
+        to the container's src_dir) to the local dst_dir, as a single compressed
+        tar stream; files that are up to date are skipped,
+        see pydevops.sync.fetch_from_remote.
+        """
+        return sync.fetch_from_remote(self, src_dir, patterns, dst_dir,
+                                      cache_file=cache_file,
+                                      exclude=exclude)
+
+    def remote_command_args(self, cmd: str):
+        """
+        Returns a list of arguments of the local process that runs the given
+        command in the container.
+        """
+        if self.container_id is None:
+            raise ValueError("Start docker container first.")
+        return ["docker", "exec", "-i", self.container_id, self.shell, "-l",
+                "-c", cmd]
 
     def rmdir(self, dir: str):
         self.sh(f"rm -rf {dir}")
@@ -44,10 +213,10 @@ class DockerClient:
         self.sh(f"mv {src} {dst}")
 
     def sh(self, cmd: str):
-        if self.image_id is None:
-            raise ValueError("Build docker image first.")
-        run_params = self.parameters.get("run", "")
-        self.cmd_exec.run(f"docker run --rm {run_params} {self.image_id} -l -c \"{cmd}\"")
+        if self.container_id is None:
+            raise ValueError("Start docker container first.")
+        self.cmd_exec.run(f"docker exec {self.container_id} "
+                          f"{self.shell} -l -c \"{cmd}\"")
 
     @property
     def params(self):
@@ -57,15 +226,66 @@ class DockerClient:
         return ";".join(result)
 
     def _index_parameters(self, params: str) -> dict:
-        params = params.strip().strip(";")
-        params = params.split(";")
-        result = {}
-        for p in params:
-            p = p.strip().strip("::")
-            p = p.split("::")
-            if len(p) != 2:
-                raise ValueError("Syntax error in docker options; each options"
-                                 "should have a format name::params")
-            key, values = p
-            result[key] = values
-        return result
+        return index_parameters(params)
+
+    def _get_container_name(self):
+        name = self.parameters.get("container_name", None)
+        if name is not None:
+            return name
+        build_dir = os.path.abspath(self.build_dir or os.getcwd())
+        digest = hashlib.sha1(build_dir.encode("utf-8")).hexdigest()[:12]
+        return f"pydevops-{digest}"
+
+    def _get_container_status(self, container: str):
+        try:
+            return self.cmd_exec.run(
+                f"docker inspect -f \"{{{{.State.Status}}}}\" {container}",
+                capture_stdout=True).stdout
+        except subprocess.CalledProcessError:
+            return None
+
+    def _create_overlay_mount(self, src_dir: str, dst_dir: str):
+        """
+        Returns the docker run parameters, that mount an overlay of the host
+        src_dir (the read-only lower layer) in the container's dst_dir.
+        The changes made in the container are kept in the local build
+        directory (the upper layer), each new container starts with
+        an empty upper layer.
+
+        The overlay is mounted by the docker daemon (local volume driver),
+        i.e. a Linux docker host is required.
+        """
+        build_dir = os.path.abspath(self.build_dir or os.getcwd())
+        overlay_dir = os.path.join(build_dir, OVERLAY_DIR_NAME)
+        for path in (src_dir, overlay_dir):
+            if "," in path or ":" in path:
+                raise ValueError(f"The overlay transfer mode does not support "
+                                 f"paths with ',' or ':': {path}")
+        if pathlib.Path(src_dir) in pathlib.Path(overlay_dir).parents:
+            raise ValueError(f"The overlay transfer mode requires the build "
+                             f"directory outside the source directory: "
+                             f"{build_dir}")
+        upper_dir = os.path.join(overlay_dir, "upper")
+        work_dir = os.path.join(overlay_dir, "work")
+        if os.path.exists(overlay_dir):
+            # The files created in the container can be owned by root:
+            # remove them in a container.
+            self.cmd_exec.run(
+                f"docker run --rm -v {overlay_dir}:/overlay {self.image_id} "
+                f"-c \"rm -rf /overlay/upper /overlay/work\"",
+                capture_stdout=True)
+        os.makedirs(upper_dir, exist_ok=True)
+        os.makedirs(work_dir, exist_ok=True)
+        options = f"lowerdir={src_dir},upperdir={upper_dir},workdir={work_dir}"
+        return (f"--mount 'type=volume,dst={dst_dir},volume-driver=local,"
+                f"volume-opt=type=overlay,volume-opt=device=overlay,"
+                f"\"volume-opt=o={options}\"'")
+
+    def _remove(self, container: str):
+        try:
+            # -v: also the anonymous volumes, e.g. the overlay source mount.
+            self.cmd_exec.run(f"docker rm -f -v {container}",
+                              capture_stdout=True)
+        except subprocess.CalledProcessError:
+            # The container does not exist.
+            pass
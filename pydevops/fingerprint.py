@@ -0,0 +1,178 @@
+"""Step input fingerprints, used by the incremental mode."""
+import hashlib
+import json
+import os
+import pathlib
+import re
+import threading
+
+from pydevops.utils import get_logger
+
+FINGERPRINTS_FILE_NAME = "pydevops_fingerprints.json"
+ALL_OPTIONS = "*"
+CMAKE_CACHE_FILE_NAME = "CMakeCache.txt"
+PYVENV_CFG_FILE_NAME = "pyvenv.cfg"
+
+
+def hash_file(path: str, h, chunk_size=1024*1024):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+
+def glob_to_regex(pattern: str):
+    """
+    Converts the given glob pattern (relative path) to a regular expression:
+    `**` matches any number of directories, `*` and `?` do not match
+    the path separator.
+    """
+    result = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            result.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            result.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            result.append("[^/]")
+            i += 1
+        else:
+            result.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(result) + r"\Z")
+
+
+def is_pruned_dir(path: str):
+    """
+    Returns true if the given directory should not be searched for
+    the input files: hidden directories (e.g. .git, .venv), other build
+    directories and python virtual environments.
+    """
+    return (os.path.basename(path).startswith(".")
+            or os.path.isfile(os.path.join(path, CMAKE_CACHE_FILE_NAME))
+            or os.path.isfile(os.path.join(path, PYVENV_CFG_FILE_NAME)))
+
+
+def find_input_files(src_dir: str, patterns, exclude_dir: str = None):
+    """
+    Returns a sorted list of files matching the given glob patterns.
+    Patterns are relative to the src_dir. The exclude_dir, the paths
+    ignored by the .pydevopsignore (.gitignore) file of the src_dir and
+    the directories for which is_pruned_dir is true are not searched.
+    """
+    # Imported here: sync is needed only in the incremental mode.
+    import pydevops.sync as sync
+    src_dir = os.path.abspath(src_dir)
+    exclude_dir = (os.path.abspath(exclude_dir)
+                   if exclude_dir is not None else None)
+    ignore = sync.IgnoreRules.from_dir(src_dir)
+    regexes = [glob_to_regex(p) for p in patterns]
+    # Patterns without a directory part match only the top-level files.
+    recursive = any("/" in p for p in patterns)
+    result = []
+    for dir_path, dir_names, file_names in os.walk(src_dir):
+        rel_dir = os.path.relpath(dir_path, src_dir)
+        rel_dir = "" if rel_dir == "." else pathlib.Path(rel_dir).as_posix()
+        kept_dirs = []
+        for d in dir_names if recursive else ():
+            rel_path = f"{rel_dir}/{d}" if rel_dir else d
+            full_path = os.path.join(dir_path, d)
+            if (full_path == exclude_dir
+                    or ignore.is_ignored(rel_path, is_dir=True)
+                    or is_pruned_dir(full_path)):
+                continue
+            kept_dirs.append(d)
+        dir_names[:] = kept_dirs
+        for f in file_names:
+            rel_path = f"{rel_dir}/{f}" if rel_dir else f
+            if (any(r.match(rel_path) for r in regexes)
+                    and not ignore.is_ignored(rel_path, is_dir=False)):
+                result.append(rel_path)
+    return sorted(result)
+
+
+def has_declared_inputs(step):
+    return any(v is not None for v in (step.input_options, step.input_files,
+                                       step.input_build_files,
+                                       step.input_env))
+
+
+def _hash_files(h, root_dir: str, files):
+    for file in files:
+        h.update(file.encode())
+        hash_file(os.path.join(root_dir, file), h)
+
+
+def compute_fingerprint(step, ctx) -> str:
+    """
+    Computes the fingerprint of the step inputs: selected options,
+    input files (content) and environment variables.
+
+    :param step: step instance
+    :param ctx: step context (see Context.step_view)
+    """
+    h = hashlib.sha256()
+    h.update(f"{type(step).__module__}.{type(step).__qualname__}".encode())
+    if step.input_options is None:
+        options = {}
+    elif step.input_options == ALL_OPTIONS:
+        options = ctx.get_options()
+    else:
+        options = {k: ctx.get_option_default(k, None)
+                   for k in step.input_options}
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    env = {k: os.environ.get(k, None) for k in (step.input_env or ())}
+    h.update(json.dumps(env, sort_keys=True).encode())
+    build_dir = ctx.get_param("build_dir")
+    if step.input_files:
+        src_dir = ctx.get_param("src_dir")
+        _hash_files(h, src_dir, find_input_files(src_dir, step.input_files,
+                                                 exclude_dir=build_dir))
+    if step.input_build_files:
+        h.update(b"build_dir")
+        _hash_files(h, build_dir, find_input_files(build_dir,
+                                                   step.input_build_files))
+    return h.hexdigest()
+
+
+class FingerprintStore:
+    """
+    Fingerprints of the successfully executed steps, kept in the build
+    directory.
+    """
+
+    def __init__(self, build_dir: str):
+        self.path = os.path.join(build_dir, FINGERPRINTS_FILE_NAME)
+        self.logger = get_logger(f"{type(self).__name__}_{id(self)}")
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        if pathlib.Path(self.path).exists():
+            try:
+                with open(self.path) as f:
+                    self.fingerprints = json.load(f)
+            except ValueError:
+                self.logger.warning(f"Invalid fingerprints file: {self.path},"
+                                    f" ignoring it.")
+
+    def get(self, step_name: str):
+        with self.lock:
+            return self.fingerprints.get(step_name, None)
+
+    def set(self, step_name: str, fingerprint: str):
+        with self.lock:
+            self.fingerprints[step_name] = fingerprint
+            self._save()
+
+    def remove(self, step_name: str):
+        with self.lock:
+            if self.fingerprints.pop(step_name, None) is not None:
+                self._save()
+
+    def _save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.fingerprints, f, indent=2)
@@ -0,0 +1,175 @@
+"""Github REST API client."""
+import os
+import pathlib
+import threading
+
+API_URL = "https://api.github.com"
+UPLOADS_URL = "https://uploads.github.com"
+
+
+class FileUploadReader:
+    """
+    File-like object, that reads the given file in chunks and prints
+    the upload progress. Its length is the size of the file, so the
+    request is sent with the Content-Length header, without reading the
+    whole file into memory.
+    """
+
+    def __init__(self, path, chunk_size=1024*1024, progress_step=10):
+        self.path = path
+        self.name = pathlib.Path(path).name
+        self.size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+        self.progress_step = progress_step
+        self.n_read = 0
+        self.last_progress = 0
+        self.file = open(path, "rb")
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        data = self.file.read(size)
+        self.n_read += len(data)
+        if self.size > 0:
+            progress = 100*self.n_read // self.size
+            if progress >= self.last_progress + self.progress_step:
+                self.last_progress = progress
+                print(f"Uploading {self.name}: {progress}% "
+                      f"({self.n_read}/{self.size} bytes)")
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GithubClient:
+    """
+    Github releases API client for a single repository.
+
+    All the requests share a single session with a pool of keep-alive
+    connections. The responses to GET requests are cached together with their
+    ETags: repeated requests are conditional (If-None-Match) and the cached
+    response is returned when the resource has not changed (304 Not Modified).
+
+    :param repository_name: Github user_name/repository_name
+    :param token: Github Personal Access Token (PAT)
+    :param pool_size: the maximum number of connections kept in the pool
+    """
+
+    def __init__(self, repository_name: str, token: str, pool_size=4,
+                 api_url=API_URL, uploads_url=UPLOADS_URL):
+        # Imported here, so that the pipelines that do not use Github
+        # do not pay for importing requests.
+        import requests
+        import requests.adapters
+        self.repository_name = repository_name
+        self.api_url = api_url
+        self.uploads_url = uploads_url
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"token {token}",
+            "Accept": "application/vnd.github+json"
+        })
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.etag_cache = {}
+        self.etag_cache_lock = threading.Lock()
+
+    def get_releases_url(self):
+        return f"{self.api_url}/repos/{self.repository_name}/releases"
+
+    def get_uploads_url(self):
+        return f"{self.uploads_url}/repos/{self.repository_name}/releases"
+
+    def create_release(self, tag_name, target_commitish, name, body,
+                       prerelease):
+        return self.session.post(
+            url=self.get_releases_url(),
+            json={
+                "tag_name": tag_name,
+                "target_commitish": target_commitish,
+                "name": name,
+                "body": body,
+                "draft": False,
+                "prerelease": prerelease
+            }
+        )
+
+    def get_release_by_tag(self, tag_name):
+        return self.get(f"{self.get_releases_url()}/tags/{tag_name}")
+
+    def edit_release(self, release_id, tag_name, target_commitish, name, body,
+                     prerelease):
+        return self.session.patch(
+            url=f"{self.get_releases_url()}/{release_id}",
+            json={
+                "tag_name": tag_name,
+                "target_commitish": target_commitish,
+                "name": name,
+                "body": body,
+                "draft": False,
+                "prerelease": prerelease
+            }
+        )
+
+    def list_assets(self, release_id):
+        """
+        Returns the list of all the assets of the given release (all pages).
+        """
+        result = []
+        url = f"{self.get_releases_url()}/{release_id}/assets?per_page=100"
+        while url is not None:
+            r = self.get(url)
+            r.raise_for_status()
+            result.extend(r.json())
+            url = r.links.get("next", {}).get("url", None)
+        return result
+
+    def upload_asset(self, release_id, asset_path, asset_name=None,
+                     content_type="application/gzip"):
+        """
+        Uploads the given file as a release asset. The file is streamed
+        from disk.
+        """
+        if asset_name is None:
+            asset_name = pathlib.Path(asset_path).name
+        with FileUploadReader(asset_path) as reader:
+            return self.session.post(
+                url=f"{self.get_uploads_url()}/{release_id}/assets",
+                params={"name": asset_name},
+                headers={"Content-Type": content_type},
+                data=reader
+            )
+
+    def delete_asset(self, asset_id):
+        return self.session.delete(
+            url=f"{self.get_releases_url()}/assets/{asset_id}")
+
+    def get(self, url):
+        """
+        Conditional GET request: returns the cached response, if the resource
+        has not changed since the last request.
+        """
+        with self.etag_cache_lock:
+            cached = self.etag_cache.get(url, None)
+        headers = {}
+        if cached is not None:
+            headers["If-None-Match"] = cached.headers["ETag"]
+        r = self.session.get(url, headers=headers)
+        if r.status_code == 304 and cached is not None:
+            return cached
+        if r.ok and "ETag" in r.headers:
+            with self.etag_cache_lock:
+                self.etag_cache[url] = r
+        return r
@@ -0,0 +1,130 @@
+"""Startup time profile: module imports and the other startup sections."""
+import contextlib
+import importlib.abc
+import sys
+import threading
+import time
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    Measures the execution time of each module imported after
+    the profiler is installed, and the time of the named sections
+    (e.g. loading the devops.py).
+
+    The profiler is a meta path finder: it finds the module spec using
+    the other finders and wraps the loader's exec_module.
+    """
+
+    def __init__(self):
+        # module name -> (cumulative time, self time) [s]
+        self.imports = {}
+        # section name -> time [s]
+        self.sections = {}
+        self.startup_cpu_time = time.process_time()
+        self.local = threading.local()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self.local, "finding", False):
+            return None
+        self.local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    self._wrap_loader(name, spec.loader)
+                    return spec
+            return None
+        finally:
+            self.local.finding = False
+
+    def _wrap_loader(self, name, loader):
+        # Loaders that are classes (e.g. builtin modules) are shared by many
+        # modules, don't touch them.
+        if (loader is None or isinstance(loader, type)
+                or not hasattr(loader, "exec_module")):
+            return
+        exec_module = loader.exec_module
+
+        def timed_exec_module(module):
+            stack = self.local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += total
+                self.imports[name] = (total, total - children)
+
+        try:
+            loader.exec_module = timed_exec_module
+        except AttributeError:
+            # E.g. loaders with __slots__.
+            pass
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[name] = time.perf_counter() - start
+
+    def report(self, n_imports=20):
+        """
+        Returns the report: CPU time of the interpreter startup and
+        the pydevops imports, the time of each section and the slowest
+        imports.
+        """
+        lines = [f"{'Startup':<50} {'Time [s]':>10}",
+                 f"{'Interpreter startup (CPU)':<50} "
+                 f"{self.startup_cpu_time:>10.3f}"]
+        for name, duration in self.sections.items():
+            lines.append(f"{name:<50} {duration:>10.3f}")
+        imports = sorted(self.imports.items(), key=lambda e: e[1][0],
+                         reverse=True)[:n_imports]
+        if imports:
+            lines.append("")
+            lines.append(f"{'Module':<50} {'Cumul. [s]':>10} {'Self [s]':>10}")
+            for name, (total, self_time) in imports:
+                lines.append(f"{name:<50} {total:>10.3f} {self_time:>10.3f}")
+        return "\n".join(lines)
+
+
+_profiler = None
+
+
+def enable() -> ImportProfiler:
+    """
+    Starts profiling the imports in the current process.
+    """
+    global _profiler
+    _profiler = ImportProfiler()
+    _profiler.install()
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def section(name: str):
+    """
+    Measures the time of the given startup section (if the profiling is
+    turned on).
+    """
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.section(name)
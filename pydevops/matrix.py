@@ -0,0 +1,396 @@
+"""
+Running many pydevops pipelines (option combinations, remote targets)
+concurrently.
+"""
+import dataclasses
+import itertools
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterable
+from typing import Dict, List, Tuple
+
+import pydevops.resources as resources
+import pydevops.sh as sh
+from pydevops.utils import get_logger
+
+logger = get_logger("matrix")
+
+PASSED = "PASSED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+
+HOST_TARGET = "host"
+DOCKER_TARGET = "docker"
+TARGET_KINDS = (HOST_TARGET, DOCKER_TARGET)
+
+
+def parse_axes(axes_str) -> Dict[str, List[str]]:
+    """
+    Parses the list of axis=value1,value2,... items.
+    e.g. ["build_type=Debug,Release", "python=ON,OFF"]
+    """
+    result = {}
+    for axis in axes_str:
+        key, values = axis.split("=", 1)
+        key = key.strip()
+        values = [v.strip() for v in values.split(",") if v.strip()]
+        if not key or not values:
+            raise ValueError(f"Invalid matrix axis: {axis}, "
+                             f"expected: name=value1,value2,...")
+        result[key] = values
+    return result
+
+
+def get_combinations(axes: Dict[str, List[str]]) -> List[Dict[str, str]]:
+    """
+    Returns all the combinations of the axes values (the cartesian product).
+    """
+    keys = list(axes.keys())
+    return [dict(zip(keys, values))
+            for values in itertools.product(*(axes[k] for k in keys))]
+
+
+def get_job_name(values: Dict[str, str]) -> str:
+    """
+    Returns the name of the given combination, that can be used as
+    a directory name, e.g. build_type-Debug_python-ON.
+    """
+    name = "_".join(f"{k.strip('/').replace('/', '-')}-{v}"
+                    for k, v in values.items())
+    return re.sub(r"[^A-Za-z0-9_.\-]", "-", name)
+
+
+def to_args_list(args_dict: dict) -> List[str]:
+    """
+    Converts the given pydevops arguments to the command line list
+    (no quoting is needed, the process is started without the shell).
+    """
+    result = []
+    for k, v in args_dict.items():
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            if v:
+                result.append(f"--{k}")
+        elif isinstance(v, Iterable) and not isinstance(v, str):
+            v = list(v)
+            if len(v) > 0:
+                result.append(f"--{k}")
+                result.extend(str(e) for e in v)
+        else:
+            result.extend([f"--{k}", str(v)])
+    return result
+
+
+@dataclasses.dataclass(frozen=True)
+class Job:
+    """
+    A single pydevops run.
+
+    :param name: the name of the job, used as the output prefix
+    :param args: the pydevops command line arguments
+    """
+    name: str
+    args: List[str]
+
+
+@dataclasses.dataclass(frozen=True)
+class JobResult:
+    name: str
+    status: str
+    duration: float
+    exit_code: int = None
+
+
+def get_max_parallel(n_jobs: int, n_cpus: int, memory: int = None,
+                     memory_per_job: float = resources.DEFAULT_MEMORY_PER_JOB):
+    """
+    Returns the number of jobs that can be run concurrently: each job gets
+    at least one CPU and the memory of a single compilation job.
+    """
+    result = min(n_jobs, n_cpus)
+    if memory is not None and memory_per_job > 0:
+        result = min(result, int(memory // (memory_per_job*resources.GB)))
+    return max(result, 1)
+
+
+class Runner:
+    """
+    Runs the given pydevops jobs in separate processes, at most max_parallel
+    of them at the same time. The output of each job is printed with
+    the job name prefix.
+
+    The CPUs and memory of the machine (or the budget of this process)
+    are split evenly between the running jobs: the budget of each job is
+    passed to its process in the PYDEVOPS_CPU_BUDGET and
+    PYDEVOPS_MEMORY_BUDGET environment variables, so e.g. the parallel
+    compile jobs of all the builds do not oversubscribe the machine.
+
+    When the jobs run on the same remote host (or docker container), whose
+    resources are not known here, each job gets the 1/max_parallel share of
+    the remote machine instead, passed in the PYDEVOPS_RESOURCE_SHARE
+    environment variable (forwarded by the job to the remote pydevops).
+
+    :param jobs: jobs to run
+    :param max_parallel: the maximum number of jobs run at the same time,
+      None: determined by the available CPUs and memory
+    :param fail_fast: cancel the remaining jobs after the first failure
+    :param split_resources: split the CPUs and memory between the jobs;
+      turn it off, when each job runs on a different remote host or container
+      (all the jobs are then run at the same time by default)
+    :param remote: the jobs run on the same remote host or docker container
+      (all the jobs are run at the same time by default)
+    """
+
+    def __init__(self, jobs: List[Job], max_parallel: int = None,
+                 fail_fast: bool = False, split_resources: bool = True,
+                 remote: bool = False):
+        self.jobs = jobs
+        self.cpu_budget = None
+        self.memory_budget = None
+        self.resource_share = None
+        if split_resources and remote:
+            if max_parallel is None:
+                max_parallel = len(jobs)
+            max_parallel = max(min(max_parallel, len(jobs)), 1)
+            self.resource_share = 1/max_parallel
+        elif split_resources:
+            n_cpus = resources.get_cpu_count()
+            memory = resources.get_available_memory()
+            if max_parallel is None:
+                max_parallel = get_max_parallel(len(jobs), n_cpus, memory)
+            max_parallel = max(min(max_parallel, len(jobs)), 1)
+            self.cpu_budget = max(n_cpus // max_parallel, 1)
+            if memory is not None:
+                self.memory_budget = memory / max_parallel / resources.GB
+        elif max_parallel is None:
+            max_parallel = len(jobs)
+        self.max_parallel = max(min(max_parallel, len(jobs)), 1)
+        self.fail_fast = fail_fast
+        self.output_lock = threading.Lock()
+        self.results = {}
+        self.processes = {}
+        self.cancelled = threading.Event()
+
+    def get_env(self):
+        env = dict(os.environ)
+        if self.cpu_budget is not None:
+            env[resources.CPU_BUDGET_ENV] = str(self.cpu_budget)
+        if self.memory_budget is not None:
+            env[resources.MEMORY_BUDGET_ENV] = f"{self.memory_budget:.3f}"
+        if self.resource_share is not None:
+            env[resources.RESOURCE_SHARE_ENV] = f"{self.resource_share:.6f}"
+        return env
+
+    def print(self, job: Job, line: str):
+        with self.output_lock:
+            sys.stdout.write(f"[{job.name}] {line}")
+            if not line.endswith("\n"):
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    def run_job(self, job: Job):
+        if self.cancelled.is_set():
+            self.results[job.name] = JobResult(job.name, CANCELLED, 0.0)
+            return
+        cmd = [sys.executable, "-m", "pydevops"] + list(job.args)
+        logger.debug(f"Starting {job.name}: {cmd}")
+        start = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL, env=self.get_env(),
+                start_new_session=os.name != "nt",
+                encoding="utf-8", errors="replace")
+        except OSError as e:
+            self.print(job, f"Unable to start pydevops: {e}")
+            self.results[job.name] = JobResult(job.name, FAILED, 0.0)
+            return
+        self.processes[job.name] = process
+        for line in process.stdout:
+            self.print(job, line)
+        exit_code = process.wait()
+        duration = time.monotonic() - start
+        if exit_code == 0:
+            status = PASSED
+        elif self.cancelled.is_set():
+            status = CANCELLED
+        else:
+            status = FAILED
+        self.results[job.name] = JobResult(job.name, status, duration,
+                                           exit_code)
+        if status == FAILED and self.fail_fast:
+            self.cancel()
+
+    def cancel(self):
+        self.cancelled.set()
+        for process in list(self.processes.values()):
+            if process.poll() is None:
+                sh.kill_process_tree(process)
+
+    def run(self) -> List[JobResult]:
+        """
+        Runs all the jobs, returns the results in the order of the jobs.
+        """
+        message = (f"Running {len(self.jobs)} jobs, at most "
+                   f"{self.max_parallel} at the same time")
+        if self.cpu_budget is not None:
+            message += f" (per job: {self.cpu_budget} CPUs"
+            if self.memory_budget is not None:
+                message += f", {self.memory_budget:.1f} GB of memory"
+            message += ")"
+        elif self.resource_share is not None:
+            message += (f" (per job: {self.resource_share:.0%} of the remote "
+                        f"CPUs and memory)")
+        logger.info(message)
+        pending = list(self.jobs)
+        pending_lock = threading.Lock()
+
+        def worker():
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    job = pending.pop(0)
+                self.run_job(job)
+
+        workers = [threading.Thread(target=worker, daemon=True)
+                   for _ in range(self.max_parallel)]
+        for w in workers:
+            w.start()
+        try:
+            for w in workers:
+                while w.is_alive():
+                    w.join(timeout=0.5)
+        except BaseException:
+            self.cancel()
+            raise
+        return [self.results.get(job.name,
+                                 JobResult(job.name, CANCELLED, 0.0))
+                for job in self.jobs]
+
+
+def summary(results: List[JobResult]) -> str:
+    """
+    Returns a summary table: status and wall time of each job.
+    """
+    width = max([len("Job")] + [len(r.name) for r in results])
+    lines = [f"{'Job':<{width}} {'Status':>10} {'Wall [s]':>10} {'Exit':>5}"]
+    for r in results:
+        exit_code = str(r.exit_code) if r.exit_code is not None else "-"
+        lines.append(f"{r.name:<{width}} {r.status:>10} {r.duration:>10.2f} "
+                     f"{exit_code:>5}")
+    n_passed = sum(r.status == PASSED for r in results)
+    lines.append(f"{n_passed}/{len(results)} passed")
+    return "\n".join(lines)
+
+
+def get_matrix_variants(args_dict: dict, axes: Dict[str, List[str]]):
+    """
+    Returns the pydevops arguments of each combination of the axes values:
+    a list of (name, arguments) pairs. Each combination is run in its own
+    build subdirectory (also on the remote host or in the docker container,
+    if set), with the axes values passed as options. The remote source
+    directories get the combination subdirectory too, so the concurrent
+    combinations do not synchronize (or clean) the same directory.
+
+    :param args_dict: the pydevops arguments (without the matrix ones)
+    :param axes: axis name (option) -> list of values
+    """
+    result = []
+    for values in get_combinations(axes):
+        name = get_job_name(values)
+        job_args = dict(args_dict)
+        for key in ("build_dir", "ssh_src_dir", "ssh_build_dir",
+                    "docker_src_dir", "docker_build_dir", "artifacts_dir"):
+            if job_args.get(key, None) is not None:
+                job_args[key] = os.path.join(job_args[key], name)
+        job_args["options"] = (list(job_args.get("options", None) or [])
+                               + [f"{k}={v}" for k, v in values.items()])
+        result.append((name, job_args))
+    return result
+
+
+def parse_targets(targets_str) -> List[Tuple[str, str]]:
+    """
+    Parses the list of target=value items, where the target is `host`
+    (the value: remote host address) or `docker` (the value: docker
+    parameters).
+    e.g. ["host=user@10.0.0.1:22", "docker=name::ubuntu:22.04"]
+    """
+    result = []
+    for target in targets_str:
+        kind, _, value = target.partition("=")
+        kind = kind.strip()
+        value = value.strip()
+        if kind not in TARGET_KINDS or not value:
+            raise ValueError(f"Invalid target: {target}, expected: "
+                             f"host=address or docker=parameters")
+        result.append((kind, value))
+    return result
+
+
+def get_target_name(kind: str, value: str) -> str:
+    if kind == DOCKER_TARGET:
+        # Docker parameters: use the image name only.
+        for param in value.split(";"):
+            key, _, param_value = param.strip().partition("::")
+            if key == "name":
+                value = param_value
+                break
+    return re.sub(r"[^A-Za-z0-9_.\-]", "-", f"{kind}-{value}")
+
+
+def get_target_variants(args_dict: dict, targets: List[Tuple[str, str]]):
+    """
+    Returns the pydevops arguments of each target: a list of
+    (name, arguments) pairs. Each target gets its own local build
+    subdirectory (with its own pydevops.cfg).
+
+    :param args_dict: the pydevops arguments (without the targets)
+    :param targets: a list of (kind, value) pairs, see parse_targets
+    """
+    result = []
+    names = set()
+    for i, (kind, value) in enumerate(targets):
+        name = get_target_name(kind, value)
+        if name in names:
+            name = f"{name}-{i}"
+        names.add(name)
+        job_args = dict(args_dict)
+        for key in ("build_dir", "artifacts_dir"):
+            if job_args.get(key, None) is not None:
+                job_args[key] = os.path.join(job_args[key], name)
+        if kind == HOST_TARGET:
+            job_args["host"] = value
+            job_args["docker"] = None
+        else:
+            job_args["host"] = "localhost"
+            job_args["docker"] = value
+        result.append((name, job_args))
+    return result
+
+
+def create_jobs(variants) -> List[Job]:
+    """
+    Returns the jobs for the given list of (name, pydevops arguments).
+    """
+    return [Job(name=name, args=to_args_list(args)) for name, args in variants]
+
+
+def run(jobs: List[Job], max_parallel: int = None,
+        fail_fast: bool = False, split_resources: bool = True,
+        remote: bool = False) -> int:
+    """
+    Runs the given jobs and prints the summary report.
+    Returns the exit code: 0 if all the jobs passed, 1 otherwise.
+    """
+    runner = Runner(jobs, max_parallel=max_parallel, fail_fast=fail_fast,
+                    split_resources=split_resources, remote=remote)
+    results = runner.run()
+    logger.info(f"Summary:\n{summary(results)}")
+    return 0 if all(r.status == PASSED for r in results) else 1
@@ -0,0 +1,112 @@
+"""Cache of the normalized pipeline description (devops.py)."""
+import hashlib
+import json
+import os
+import types
+
+from pydevops.base import (normalize_steps, get_step_reference,
+                           is_step_reference)
+from pydevops.utils import get_logger
+
+PIPELINE_CACHE_FILE_NAME = "pydevops_pipeline.json"
+# devops.py attributes kept in the cache.
+CFG_ATTRIBUTES = ("stages", "init_stages", "build_stages", "aliases",
+                  "defaults", "build_directory", "depends_on",
+                  "max_parallel_steps", "timeouts", "artifacts")
+
+logger = get_logger("pipeline")
+
+
+class NotCacheableError(ValueError):
+    pass
+
+
+def hash_cfg(path: str, version: str) -> str:
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    with open(path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def to_json_value(value, name: str):
+    """
+    Converts the given devops.py value to its JSON equivalent. Raises
+    NotCacheableError if the value cannot be saved without a loss.
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v, name) for v in value]
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value.keys()):
+            raise NotCacheableError(f"{name}: keys must be strings")
+        return {k: to_json_value(v, name) for k, v in value.items()}
+    raise NotCacheableError(f"{name}: value of type {type(value).__name__} "
+                            f"cannot be cached")
+
+
+def to_step_reference(step):
+    if is_step_reference(step):
+        return step
+    reference = get_step_reference(step)
+    module_name, _, qualname = reference.partition(":")
+    # Classes defined in the devops.py (or locally) cannot be imported
+    # without executing the devops.py.
+    if (module_name in ("pydevops_cfg", "__main__")
+            or "<locals>" in qualname):
+        raise NotCacheableError(f"stages: step {reference} is not importable")
+    return reference
+
+
+def normalize(cfg) -> dict:
+    """
+    Returns the normalized (JSON) description of the given devops.py module:
+    the steps are replaced with references to their classes.
+
+    Raises NotCacheableError if the pipeline cannot be described in JSON.
+    """
+    result = {}
+    for name in CFG_ATTRIBUTES:
+        if not hasattr(cfg, name):
+            continue
+        value = getattr(cfg, name)
+        if name == "stages":
+            value = {stage: [[step_name, to_step_reference(step)]
+                             for step_name, step in normalize_steps(steps)]
+                     for stage, steps in value.items()}
+        result[name] = to_json_value(value, name)
+    return result
+
+
+def load(build_dir: str, cfg_hash: str):
+    """
+    Returns the cached pipeline description (as a module-like object)
+    for the devops.py with the given hash, or None if not available.
+    """
+    path = os.path.join(build_dir, PIPELINE_CACHE_FILE_NAME)
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("hash", None) != cfg_hash:
+        return None
+    return types.SimpleNamespace(**cache["pipeline"])
+
+
+def save(build_dir: str, cfg_hash: str, cfg):
+    """
+    Saves the normalized description of the given devops.py module, if
+    it can be cached.
+    """
+    try:
+        pipeline = normalize(cfg)
+    except NotCacheableError as e:
+        logger.warning(f"The pipeline will be not cached: {e}")
+        return
+    path = os.path.join(build_dir, PIPELINE_CACHE_FILE_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"hash": cfg_hash, "pipeline": pipeline}, f, indent=2)
+    os.replace(tmp_path, path)
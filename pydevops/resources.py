@@ -0,0 +1,103 @@
+"""Available CPU and memory resources, parallelism of the build tools."""
+import os
+
+try:
+    import psutil
+except ImportError:
+    # Optional.
+    psutil = None
+
+AUTO = "auto"
+# The budget (number of CPUs, memory in GB) assigned to the current process,
+# e.g. by the parent pydevops running many pipelines concurrently.
+CPU_BUDGET_ENV = "PYDEVOPS_CPU_BUDGET"
+MEMORY_BUDGET_ENV = "PYDEVOPS_MEMORY_BUDGET"
+# The fraction (0-1] of the CPUs and memory of the machine assigned to
+# the current process, e.g. one of many pipelines run concurrently on the
+# same remote host (whose resources are not known to the parent pydevops).
+RESOURCE_SHARE_ENV = "PYDEVOPS_RESOURCE_SHARE"
+# The default amount of memory needed by a single compilation job [GB].
+DEFAULT_MEMORY_PER_JOB = 2.0
+
+GB = 1024**3
+
+
+def get_resource_share() -> float:
+    """
+    Returns the fraction of the machine resources assigned to the current
+    process: the PYDEVOPS_RESOURCE_SHARE environment variable, 1 if not set.
+    """
+    share = os.environ.get(RESOURCE_SHARE_ENV, None)
+    if not share:
+        return 1.0
+    return min(max(float(share), 0.0), 1.0)
+
+
+def get_cpu_count() -> int:
+    """
+    Returns the number of CPUs available to the current process, limited
+    by the PYDEVOPS_RESOURCE_SHARE and PYDEVOPS_CPU_BUDGET environment
+    variables (if set).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        result = len(os.sched_getaffinity(0))
+    else:
+        result = os.cpu_count() or 1
+    result = int(result*get_resource_share())
+    budget = os.environ.get(CPU_BUDGET_ENV, None)
+    if budget:
+        result = min(result, int(budget))
+    return max(result, 1)
+
+
+def _read_meminfo_available():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                # The value is in kB.
+                return int(line.split()[1])*1024
+    return None
+
+
+def get_available_memory():
+    """
+    Returns the amount of memory available for new processes [bytes],
+    limited by the PYDEVOPS_RESOURCE_SHARE and PYDEVOPS_MEMORY_BUDGET
+    (in GB) environment variables (if set), or None if it cannot be
+    determined.
+    """
+    result = None
+    if psutil is not None:
+        result = psutil.virtual_memory().available
+    elif os.path.exists("/proc/meminfo"):
+        result = _read_meminfo_available()
+    elif hasattr(os, "sysconf"):
+        try:
+            result = (os.sysconf("SC_AVPHYS_PAGES")
+                      * os.sysconf("SC_PAGE_SIZE"))
+        except (ValueError, OSError):
+            result = None
+    if result is not None:
+        result = int(result*get_resource_share())
+    budget = os.environ.get(MEMORY_BUDGET_ENV, None)
+    if budget:
+        budget = int(float(budget)*GB)
+        result = budget if result is None else min(result, budget)
+    return result
+
+
+def get_n_jobs(n_jobs=AUTO, memory_per_job=DEFAULT_MEMORY_PER_JOB) -> int:
+    """
+    Returns the number of parallel jobs to run.
+
+    :param n_jobs: the number of jobs, or "auto": the number of available
+      CPUs, limited by the available memory
+    :param memory_per_job: memory needed by a single job [GB]
+    """
+    if str(n_jobs).strip().lower() != AUTO:
+        return int(n_jobs)
+    result = get_cpu_count()
+    memory = get_available_memory()
+    if memory is not None and float(memory_per_job) > 0:
+        result = min(result, int(memory // (float(memory_per_job)*GB)))
+    return max(result, 1)
@@ -1,11 +1,20 @@
+import collections
 import os
 import pathlib
 import shlex
+import signal
 import subprocess
+import sys
+import threading
+import time
 from pydevops.base import *
 from pydevops.utils import get_logger
+import pydevops.trace as trace
 import shutil
 
+# The size of the chunks, in which the output of async commands is read.
+STREAM_CHUNK_SIZE = 64*1024
+
 
 @dataclass(frozen=True)
 class CommandResult:
@@ -43,6 +52,114 @@ def sanitize_output(stream):
     return stream.decode("UTF-8").strip()
 
 
+def kill_process_tree(process: subprocess.Popen):
+    """
+    Kills the given process and all its children.
+    """
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            # The process is a process group leader (see start_new_session).
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        # Already terminated.
+        pass
+
+
+def get_timeout(timeout: float = None, deadline: float = None):
+    """
+    Returns the timeout of a command, that should be finished in timeout
+    seconds and before the deadline (time.monotonic() value).
+    """
+    if deadline is not None:
+        remaining = max(deadline - time.monotonic(), 0)
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+
+class OutputStream:
+    """
+    Reads the command output line by line and writes it to the console,
+    the log file, the buffer of the last tail_size bytes and, optionally,
+    collects the whole output.
+    """
+
+    def __init__(self, console=True, log_file: str = None, tail_size=0,
+                 capture=False):
+        self.console = console
+        self.log_file = log_file
+        self.tail_size = tail_size
+        self.tail = collections.deque()
+        self.tail_bytes = 0
+        self.captured = [] if capture else None
+
+    def consume(self, stream, header: str = None):
+        log = open(self.log_file, "ab") if self.log_file is not None else None
+        try:
+            if log is not None and header is not None:
+                log.write(header.encode("utf-8"))
+            for line in iter(stream.readline, b""):
+                self.write(line, log)
+        finally:
+            stream.close()
+            if log is not None:
+                log.close()
+
+    async def consume_async(self, stream, header: str = None):
+        log = open(self.log_file, "ab") if self.log_file is not None else None
+        try:
+            if log is not None and header is not None:
+                log.write(header.encode("utf-8"))
+            # Note: StreamReader.readline fails on lines longer than
+            # the stream limit (64 KiB), e.g. verbose compiler commands.
+            # The parts of the current (incomplete) line.
+            pending = []
+            while True:
+                chunk = await stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                *lines, last = chunk.split(b"\n")
+                if lines:
+                    lines[0] = b"".join(pending) + lines[0]
+                    pending = []
+                    for line in lines:
+                        self.write(line + b"\n", log)
+                if last:
+                    pending.append(last)
+            if pending:
+                self.write(b"".join(pending), log)
+        finally:
+            if log is not None:
+                log.close()
+
+    def write(self, line: bytes, log=None):
+        if self.console:
+            sys.stdout.write(line.decode("utf-8", errors="replace"))
+            sys.stdout.flush()
+        if log is not None:
+            log.write(line)
+            log.flush()
+        if self.captured is not None:
+            self.captured.append(line)
+        if self.tail_size > 0:
+            self.tail.append(line)
+            self.tail_bytes += len(line)
+            while self.tail_bytes > self.tail_size and len(self.tail) > 1:
+                self.tail_bytes -= len(self.tail.popleft())
+
+    def get_tail(self) -> str:
+        tail = b"".join(self.tail)[-self.tail_size:] if self.tail_size else b""
+        return tail.decode("utf-8", errors="replace")
+
+    def get_captured(self) -> bytes:
+        return b"".join(self.captured or [])
+
+
 class Shell:
     """
     A current instance of shell prompt (including all the environment
@@ -53,15 +170,37 @@ class Shell:
     def __init__(self):
         self.logger = get_logger(f"{type(self).__name__}_{id(self)}")
 
-    def run(self, cmd: str, capture_stdout=False, env_extend:dict=None) \
-            -> CommandResult:
+    def run(self, cmd: str, capture_stdout=False, env_extend:dict=None,
+            cwd: str = None, timeout: float = None, deadline: float = None,
+            log_file: str = None, tail_size: int = 0) -> CommandResult:
+        """
+        Runs the given command, raises subprocess.CalledProcessError if
+        the command fails.
+
+        The output of the command is streamed (read line by line, as it
+        arrives) if it is captured, written to the log file or its tail is
+        kept; otherwise the command writes directly to the console.
+
+        :param cmd: command to run
+        :param capture_stdout: return the stdout (and stderr) of the command
+        :param env_extend: additional environment variables
+        :param cwd: working directory of the command
+        :param timeout: timeout of the command [s]; when exceeded, the whole
+          process tree is killed and subprocess.TimeoutExpired is raised
+        :param deadline: time.monotonic() value, at which the command should
+          be killed
+        :param log_file: path to the file, to which the output of the command
+          should be appended
+        :param tail_size: the number of the last bytes of the output
+          to keep and show in the error message, when the command fails
+        """
         self.logger.debug(f"Executing command: {cmd}")
         cmd_tokens = shlex.split(cmd)
         kwargs = {
-            "args": cmd_tokens,
-            "check": True
+            "args": cmd_tokens
         }
-        if capture_stdout:
+        stream = capture_stdout or log_file is not None or tail_size > 0
+        if stream:
             kwargs["stdout"] = subprocess.PIPE
             kwargs["stderr"] = subprocess.STDOUT
 
@@ -70,11 +209,72 @@ class Shell:
             parent_env = os.environ
             env = {**parent_env, **env_extend}
             kwargs["env"] = env
-        result = subprocess.run(**kwargs)
+        if cwd is not None:
+            self.logger.debug(f"In directory: {cwd}")
+            kwargs["cwd"] = cwd
+        timeout = get_timeout(timeout, deadline)
+        if timeout is not None and os.name != "nt":
+            # Run the command in a new process group, so the whole process
+            # tree can be killed on timeout.
+            kwargs["start_new_session"] = True
+        output = OutputStream(console=not capture_stdout, log_file=log_file,
+                              tail_size=tail_size, capture=capture_stdout)
+        with trace.span(cmd, trace.COMMAND, cmd=cmd) as span_args:
+            cpu_start = trace.get_children_cpu_time()
+            try:
+                return_code = self._execute(kwargs, output if stream else None,
+                                            timeout, header=f"$ {cmd}\n")
+                span_args["exit_code"] = return_code
+            except subprocess.TimeoutExpired:
+                span_args["timeout"] = timeout
+                raise
+            finally:
+                # Note: approximate, when commands are run concurrently.
+                cpu_end = trace.get_children_cpu_time()
+                if cpu_start[0] is not None:
+                    span_args["user_cpu"] = cpu_end[0] - cpu_start[0]
+                    span_args["sys_cpu"] = cpu_end[1] - cpu_start[1]
+        if return_code != 0:
+            tail = output.get_tail()
+            if tail:
+                self.logger.error(f"Command failed: {cmd}, last output:\n"
+                                  f"{tail}")
+            raise subprocess.CalledProcessError(
+                return_code, cmd_tokens,
+                output=output.get_captured() if capture_stdout else tail)
         stdout = ""
         if capture_stdout:
-            stdout = sanitize_output(result.stdout)
-        return CommandResult(return_code=result.returncode, stdout=stdout)
+            stdout = sanitize_output(output.get_captured())
+        return CommandResult(return_code=return_code, stdout=stdout)
+
+    def _execute(self, kwargs, output: OutputStream, timeout, header=None):
+        process = subprocess.Popen(**kwargs)
+        reader = None
+        if output is not None:
+            reader = threading.Thread(target=output.consume,
+                                      args=(process.stdout, header),
+                                      daemon=True)
+            reader.start()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"Command timed out after {timeout:.2f} s, "
+                              f"killing it: {kwargs['args']}")
+            kill_process_tree(process)
+            process.wait()
+            if reader is not None:
+                reader.join(timeout=5)
+            tail = output.get_tail() if output is not None else None
+            raise subprocess.TimeoutExpired(kwargs["args"], timeout,
+                                            output=tail) from None
+        except BaseException:
+            # E.g. KeyboardInterrupt.
+            kill_process_tree(process)
+            process.wait()
+            raise
+        if reader is not None:
+            reader.join()
+        return process.returncode
 
     def mkdir(self, path: str, exist_ok=False):
         self.logger.debug(f"Creating directory: {path}")
@@ -83,3 +283,130 @@ class Shell:
     def rmdir(self, path: str):
         self.logger.debug(f"Removing directory: {path}")
         rmdir(path)
+
+
+class AsyncShell:
+    """
+    Asyncio version of the Shell: commands are run as coroutines, so many
+    commands can be run concurrently, e.g. within a single step.
+
+    The semantics of the parameters are the same as in Shell.run.
+    """
+    def __init__(self):
+        self.logger = get_logger(f"{type(self).__name__}_{id(self)}")
+
+    async def run(self, cmd: str, capture_stdout=False, env_extend: dict = None,
+                  cwd: str = None, timeout: float = None,
+                  deadline: float = None, log_file: str = None,
+                  tail_size: int = 0) -> CommandResult:
+        """
+        Runs the given command, raises subprocess.CalledProcessError if
+        the command fails. If the coroutine is cancelled, the command
+        (and all its child processes) is killed.
+
+        See Shell.run for the description of the parameters.
+        """
+        # Imported here, importing asyncio noticeably slows down the startup.
+        import asyncio
+        self.logger.debug(f"Executing command: {cmd}")
+        cmd_tokens = shlex.split(cmd)
+        kwargs = {}
+        stream = capture_stdout or log_file is not None or tail_size > 0
+        if stream:
+            kwargs["stdout"] = asyncio.subprocess.PIPE
+            kwargs["stderr"] = asyncio.subprocess.STDOUT
+        if env_extend is not None:
+            self.logger.debug(f"With additional env variables: {env_extend}")
+            kwargs["env"] = {**os.environ, **env_extend}
+        if cwd is not None:
+            self.logger.debug(f"In directory: {cwd}")
+            kwargs["cwd"] = cwd
+        if os.name != "nt":
+            # Run the command in a new process group, so the whole process
+            # tree can be killed on timeout or cancellation.
+            kwargs["start_new_session"] = True
+        timeout = get_timeout(timeout, deadline)
+        output = OutputStream(console=not capture_stdout, log_file=log_file,
+                              tail_size=tail_size, capture=capture_stdout)
+        with trace.span(cmd, trace.COMMAND, cmd=cmd) as span_args:
+            process = await asyncio.create_subprocess_exec(*cmd_tokens,
+                                                           **kwargs)
+            reader = None
+            if stream:
+                reader = asyncio.ensure_future(
+                    output.consume_async(process.stdout, header=f"$ {cmd}\n"))
+            try:
+                await asyncio.wait_for(process.wait(), timeout=timeout)
+                if reader is not None:
+                    await reader
+            except asyncio.TimeoutError:
+                span_args["timeout"] = timeout
+                self.logger.error(f"Command timed out after {timeout:.2f} s, "
+                                  f"killing it: {cmd_tokens}")
+                await self._kill(process, reader)
+                raise subprocess.TimeoutExpired(
+                    cmd_tokens, timeout, output=output.get_tail()) from None
+            except BaseException:
+                # E.g. the coroutine was cancelled.
+                await asyncio.shield(self._kill(process, reader))
+                raise
+            return_code = process.returncode
+            span_args["exit_code"] = return_code
+        if return_code != 0:
+            tail = output.get_tail()
+            if tail:
+                self.logger.error(f"Command failed: {cmd}, last output:\n"
+                                  f"{tail}")
+            raise subprocess.CalledProcessError(
+                return_code, cmd_tokens,
+                output=output.get_captured() if capture_stdout else tail)
+        stdout = ""
+        if capture_stdout:
+            stdout = sanitize_output(output.get_captured())
+        return CommandResult(return_code=return_code, stdout=stdout)
+
+    async def run_many(self, cmds, max_parallel: int = None, **kwargs):
+        """
+        Runs the given commands concurrently, at most max_parallel commands
+        at a time (by default: all of them). Returns the list of
+        CommandResults, in the order of the given commands.
+
+        If any of the commands fails, the remaining commands are cancelled
+        (the running ones are killed) and the exception is raised.
+
+        :param cmds: commands to run
+        :param max_parallel: the maximum number of commands run concurrently
+        :param kwargs: parameters of each command (see run)
+        """
+        import asyncio
+        cmds = list(cmds)
+        if not cmds:
+            return []
+        semaphore = asyncio.Semaphore(max_parallel or len(cmds))
+
+        async def run_one(cmd):
+            async with semaphore:
+                return await self.run(cmd, **kwargs)
+
+        tasks = [asyncio.ensure_future(run_one(cmd)) for cmd in cmds]
+        done, pending = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in tasks:
+            if task in done and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+
+    async def _kill(self, process, reader):
+        import asyncio
+        if process.returncode is None:
+            kill_process_tree(process)
+        await process.wait()
+        if reader is not None:
+            try:
+                await asyncio.wait_for(reader, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
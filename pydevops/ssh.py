@@ -1,20 +1,96 @@
+import atexit
 import os
 import pathlib
+import shlex
+import shutil
+import tempfile
 from pydevops.sh import Shell
+from pydevops.utils import get_logger
+import pydevops.sync as sync
 
 
 class SshClient:
 
-    def __init__(self, address: str, start_dir: str):
+    def __init__(self, address: str, start_dir: str, options=None,
+                 multiplex=None):
         """
+        By default, a single master connection is opened for the client and
+        all the subsequent ssh and scp calls are multiplexed over it
+        (OpenSSH ControlMaster). The connection is closed by `close`, or at the
+        latest, when the interpreter exits.
 
-
-        :param start_dir: execute commands with this current working directory 
+        :param address: remote host address: user@remote_address:port_number,
+          where :port_number is optional
+        :param start_dir: execute commands with this current working directory
+        :param options: a list of additional ssh options, in the ssh_config
+          format Key=Value (e.g. Compression=yes)
+        :param multiplex: whether to reuse a single ssh connection for all
+          the commands, by default turned on on all systems except Windows,
+          unless ControlMaster=no is given in the options
         """
-
+        self.logger = get_logger(f"{type(self).__name__}_{id(self)}")
         self.host, self.port = self.split_address(address)
         self.cmd_exec = Shell()
         self.start_dir = start_dir
+        self.options = list(options or [])
+        if multiplex is None:
+            # Windows OpenSSH does not support connection multiplexing.
+            multiplex = (os.name != "nt"
+                         and "ControlMaster=no" not in self.options)
+        self.control_dir = None
+        self.control_path = None
+        if multiplex:
+            self.open()
+
+    def open(self):
+        """
+        Opens the master connection to the remote host.
+        """
+        if self.control_path is not None:
+            return
+        # Note: the unix socket path length is limited, so keep it short.
+        control_dir = tempfile.mkdtemp(prefix="pydevops-ssh-")
+        control_path = os.path.join(control_dir, "%C")
+        self.logger.debug(f"Opening master connection to {self.host}")
+        port = f"-p{self.port}" if self.port else ""
+        options = self._options_str(
+            self.options + [f"ControlPath={control_path}"])
+        try:
+            self.cmd_exec.run(f"ssh -f -N -M {port} {options} {self.host}")
+        except Exception as e:
+            # Fall back to a separate connection for each command.
+            self.logger.warning(f"Unable to open the master connection to "
+                                f"{self.host}: {e}")
+            shutil.rmtree(control_dir, ignore_errors=True)
+            return
+        self.control_dir = control_dir
+        self.control_path = control_path
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Closes the master connection to the remote host (if opened).
+        """
+        if self.control_path is None:
+            return
+        self.logger.debug(f"Closing master connection to {self.host}")
+        port = f"-p{self.port}" if self.port else ""
+        try:
+            self.cmd_exec.run(f"ssh -O exit {port} {self._options_str()} "
+                              f"{self.host}", capture_stdout=True)
+        except Exception as e:
+            self.logger.warning(f"Unable to close the master connection: {e}")
+        finally:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+            self.control_dir = None
+            self.control_path = None
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def cp_to_remote(self, src_dir: str, dst_dir: str, cd_to_start_dir=True):
         if src_dir == ".":
@@ -28,13 +104,66 @@ class SshClient:
         dst_dir_name = str(pathlib.Path(dst_dir).name)
         src_dir_name = str(pathlib.Path(src_dir).name)
         self.mkdir(dst_dir_parent, cd_to_start_dir=cd_to_start_dir)
-        self.cmd_exec.run(f"scp {options} {port} {src_dir} {self.host}:{dst_dir_parent}")
+        self.cmd_exec.run(f"scp {options} {port} {self._options_str()} "
+                          f"{src_dir} {self.host}:{dst_dir_parent}")
         if dst_dir_name != src_dir_name:
             # TODO note below will not work correctly if in the dst dir there is
             # already some directory named as the src dirrectory.
             self.rename(os.path.join(dst_dir_parent, src_dir_name), dst_dir,
                         cd_to_start_dir=cd_to_start_dir)
 
+    def sync_to_remote(self, src_dir: str, dst_dir: str, exclude=(),
+                       cache_file: str = None):
+        """
+        Transfers only new and modified files from the src_dir to the remote
+        dst_dir, see pydevops.sync.sync_to_remote.
+        """
+        return sync.sync_to_remote(self, src_dir, dst_dir, exclude=exclude,
+                                   cache_file=cache_file)
+
+    def cp_from_remote(self, src_dir: str, patterns, dst_dir: str,
+                       cache_file: str = None, exclude=()):
+        """
+        Copies the remote files matching the given glob patterns (relative
+        to the remote src_dir) to the local dst_dir, as a single compressed
+        tar stream; files that are up to date are skipped,
+        see pydevops.sync.fetch_from_remote.
+        """
+        return sync.fetch_from_remote(self, src_dir, patterns, dst_dir,
+                                      cache_file=cache_file,
+                                      exclude=exclude)
+
+    def forward_unix_socket(self, remote_path: str):
+        """
+        Forwards the remote unix socket to a local one, over the master
+        connection. Returns the path to the local socket, or None if
+        the connection multiplexing is turned off.
+        """
+        if self.control_path is None:
+            return None
+        local_path = os.path.join(self.control_dir,
+                                  f"fwd-{len(os.listdir(self.control_dir))}")
+        port = f"-p{self.port}" if self.port else ""
+        self.cmd_exec.run(f"ssh -O forward {port} {self._options_str()} "
+                          f"-L {local_path}:{remote_path} {self.host}",
+                          capture_stdout=True)
+        if not os.path.exists(local_path):
+            return None
+        return local_path
+
+    def remote_command_args(self, cmd: str):
+        """
+        Returns a list of arguments of the local process that runs the given
+        command on the remote host.
+        """
+        args = ["ssh"]
+        if self.port:
+            args.append(f"-p{self.port}")
+        for option in self._options():
+            args.extend(["-o", option])
+        args.extend([self.host, cmd])
+        return args
+
     def rmdir(self, dir: str, cd_to_start_dir=True):
         # The below works in Windows cmd and unix bash.
         self.sh(f"rm -rf {dir}", cd_to_start_dir=cd_to_start_dir)
@@ -50,7 +179,8 @@ class SshClient:
     def sh(self, cmd: str, cd_to_start_dir=True):
         port = f"-p{self.port}" if self.port else ""
         start_cd_cmd = f"cd {self.start_dir} && " if cd_to_start_dir else ""
-        self.cmd_exec.run(f"ssh {port} {self.host} {start_cd_cmd} {cmd}")
+        self.cmd_exec.run(f"ssh {port} {self._options_str()} {self.host} "
+                          f"{start_cd_cmd} {cmd}")
 
     def split_address(self, address: str):
         parts = address.split(":")
@@ -58,3 +188,14 @@ class SshClient:
             return address, None
         else:
             return parts[0], parts[1]
+
+    def _options(self):
+        options = list(self.options)
+        if self.control_path is not None:
+            options.append(f"ControlPath={self.control_path}")
+        return options
+
+    def _options_str(self, options=None):
+        if options is None:
+            options = self._options()
+        return " ".join(f"-o {shlex.quote(o)}" for o in options)
@@ -0,0 +1,504 @@
+"""Incremental synchronization of directories with remote targets."""
+import base64
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import tarfile
+
+from pydevops.utils import get_logger
+
+logger = get_logger("pydevops.sync")
+
+MANIFEST_FILE_NAME = ".pydevops_manifest.json"
+IGNORE_FILE_NAMES = (".pydevopsignore", ".gitignore")
+DEFAULT_IGNORE_PATTERNS = (".git/", MANIFEST_FILE_NAME)
+SYNC_INFO_MEMBER = ".pydevops_sync.json"
+SYNC_CACHE_FILE_NAME = "pydevops_sync_cache.json"
+FETCH_CACHE_FILE_NAME = "pydevops_fetch_cache.json"
+
+# Executed on the remote side: prints the content of the given file
+# (path parts are joined on the remote side), or nothing if it does not exist.
+_READ_FILE_SCRIPT = """
+import os, sys
+path = os.path.join(*sys.argv[1:])
+if os.path.isfile(path):
+    with open(path, "rb") as f:
+        sys.stdout.buffer.write(f.read())
+"""
+
+# Executed on the remote side: extracts the tar stream from the stdin into
+# the given directory, removes the files removed from the source tree and
+# stores the new manifest.
+_APPLY_SCRIPT = """
+import json, os, sys, tarfile
+dst, manifest_name, info_name = sys.argv[1], sys.argv[2], sys.argv[3]
+os.makedirs(dst, exist_ok=True)
+info = None
+with tarfile.open(fileobj=sys.stdin.buffer, mode="r|gz") as tar:
+    for member in tar:
+        if member.name == info_name:
+            info = json.loads(tar.extractfile(member).read().decode("utf-8"))
+        elif hasattr(tarfile, "fully_trusted_filter"):
+            tar.extract(member, dst, filter="fully_trusted")
+        else:
+            tar.extract(member, dst)
+dirs = set()
+for name in info["removed"]:
+    path = os.path.join(dst, name)
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+    dirs.add(os.path.dirname(path))
+for d in sorted(dirs, key=len, reverse=True):
+    while d.startswith(dst) and os.path.normpath(d) != os.path.normpath(dst):
+        try:
+            os.rmdir(d)
+        except OSError:
+            break
+        d = os.path.dirname(d)
+with open(os.path.join(dst, manifest_name), "w") as f:
+    json.dump(info["manifest"], f)
+"""
+
+# Executed on the remote side: reads the request (glob patterns, hashes of
+# the local copies) from the stdin and writes a tar stream with the matching
+# files that differ from the local copies to the stdout. The first member of
+# the archive contains the hashes of the transferred files.
+_PACK_SCRIPT = """
+import fnmatch, glob, hashlib, io, json, os, sys, tarfile
+root, info_name = sys.argv[1], sys.argv[2]
+request = json.loads(sys.stdin.buffer.read().decode("utf-8"))
+exclude = request.get("exclude", [])
+files = {}
+for pattern in request["patterns"]:
+    for path in glob.glob(os.path.join(root, pattern), recursive=True):
+        paths = [path]
+        if os.path.isdir(path):
+            paths = [os.path.join(d, f) for d, _, fs in os.walk(path)
+                     for f in fs]
+        for p in paths:
+            name = os.path.relpath(p, root).replace(os.sep, "/")
+            if (os.path.isfile(p) and not name.startswith("../")
+                    and not any(fnmatch.fnmatchcase(name, e)
+                                for e in exclude)):
+                files[name] = p
+hashes = {}
+for name in sorted(files):
+    h = hashlib.sha256()
+    with open(files[name], "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+    hashes[name] = h.hexdigest()
+sent = {k: v for k, v in hashes.items() if request["hashes"].get(k) != v}
+with tarfile.open(fileobj=sys.stdout.buffer, mode="w|gz",
+                  dereference=True) as tar:
+    info = json.dumps({"files": hashes, "sent": sent}).encode("utf-8")
+    tar_info = tarfile.TarInfo(info_name)
+    tar_info.size = len(info)
+    tar.addfile(tar_info, io.BytesIO(info))
+    for name in sent:
+        tar.add(files[name], arcname=name, recursive=False)
+"""
+
+
+def python_command(script: str, *args):
+    """
+    Returns a shell command that runs the given python script with the given
+    arguments. The script is base64-encoded, so it does not require any
+    additional escaping, regardless of the remote shell.
+    """
+    encoded = base64.b64encode(script.encode("utf-8")).decode("ascii")
+    args = " ".join(f'"{a}"' for a in args)
+    return (f"python -c \"import base64;"
+            f"exec(base64.b64decode(b'{encoded}'))\" {args}")
+
+
+def read_remote_file(client, *path) -> bytes:
+    """
+    Returns the content of the given remote file (empty, if the file does not
+    exist).
+
+    :param client: remote client, that implements
+      `remote_command_args(cmd: str) -> list`
+    :param path: remote path parts, joined on the remote side
+    """
+    cmd = python_command(_READ_FILE_SCRIPT, *path)
+    result = subprocess.run(client.remote_command_args(cmd),
+                            stdout=subprocess.PIPE, check=True)
+    return result.stdout
+
+
+class IgnoreRules:
+    """
+    A subset of the .gitignore syntax: comments, negation (!), directory-only
+    patterns (trailing /) and patterns anchored to the root directory
+    (containing /). Only the ignore file located in the root directory is
+    taken into account.
+    """
+
+    def __init__(self, patterns=()):
+        self.rules = []
+        for p in patterns:
+            self.add(p)
+
+    @staticmethod
+    def from_dir(root_dir: str, extra_patterns=()):
+        patterns = list(DEFAULT_IGNORE_PATTERNS)
+        for name in IGNORE_FILE_NAMES:
+            path = pathlib.Path(root_dir) / name
+            if path.is_file():
+                patterns.extend(path.read_text().splitlines())
+                break
+        patterns.extend(extra_patterns)
+        return IgnoreRules(patterns)
+
+    def add(self, pattern: str):
+        pattern = pattern.rstrip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        self.rules.append((pattern, negate, dir_only, anchored))
+
+    def is_ignored(self, rel_path: str, is_dir: bool):
+        name = rel_path.rsplit("/", 1)[-1]
+        result = False
+        for pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if anchored:
+                matches = fnmatch.fnmatchcase(rel_path, pattern)
+            else:
+                matches = fnmatch.fnmatchcase(name, pattern)
+            if matches:
+                result = not negate
+        return result
+
+
+def hash_file(path: str, chunk_size=1024*1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_manifest(root_dir: str, ignore: IgnoreRules, cache: dict = None):
+    """
+    Returns a manifest of the given directory: relative path ->
+    [size, mtime_ns, sha256].
+
+    :param cache: previous manifest of the directory; the hash of a file is
+      reused if its size and modification time have not changed
+    """
+    cache = cache or {}
+    result = {}
+    root_dir = os.path.abspath(root_dir)
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        rel_dir = os.path.relpath(dir_path, root_dir)
+        rel_dir = "" if rel_dir == "." else pathlib.Path(rel_dir).as_posix()
+        kept_dirs = []
+        for d in dir_names:
+            rel_path = f"{rel_dir}/{d}" if rel_dir else d
+            full_path = os.path.join(dir_path, d)
+            if ignore.is_ignored(rel_path, is_dir=True):
+                continue
+            if os.path.islink(full_path):
+                file_names.append(d)
+            else:
+                kept_dirs.append(d)
+        dir_names[:] = kept_dirs
+        for f in file_names:
+            rel_path = f"{rel_dir}/{f}" if rel_dir else f
+            if ignore.is_ignored(rel_path, is_dir=False):
+                continue
+            full_path = os.path.join(dir_path, f)
+            st = os.lstat(full_path)
+            cached = cache.get(rel_path, None)
+            if (cached is not None and cached[0] == st.st_size
+                    and cached[1] == st.st_mtime_ns):
+                digest = cached[2]
+            elif os.path.islink(full_path):
+                digest = hashlib.sha256(
+                    os.readlink(full_path).encode("utf-8")).hexdigest()
+            else:
+                digest = hash_file(full_path)
+            result[rel_path] = [st.st_size, st.st_mtime_ns, digest]
+    return result
+
+
+def mirror_tree(src_dir: str, dst_dir: str):
+    """
+    Makes the local dst_dir a copy of the src_dir. Only the files whose
+    content differs are written, files that do not exist in the src_dir
+    are removed from the dst_dir.
+
+    :return: a pair: (number of written files, number of removed files)
+    """
+    src = build_manifest(src_dir, IgnoreRules())
+    dst = {}
+    if os.path.isdir(dst_dir):
+        dst = build_manifest(dst_dir, IgnoreRules())
+    changed = [k for k, v in src.items()
+               if k not in dst or dst[k][0] != v[0] or dst[k][2] != v[2]]
+    removed = [k for k in dst if k not in src]
+    for name in changed:
+        dst_path = os.path.join(dst_dir, name)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+        shutil.copy2(os.path.join(src_dir, name), dst_path,
+                     follow_symlinks=False)
+    for name in removed:
+        os.remove(os.path.join(dst_dir, name))
+    # Remove empty directories.
+    for dir_path, _, _ in sorted(os.walk(dst_dir), reverse=True):
+        if dir_path != dst_dir and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+    return len(changed), len(removed)
+
+
+def diff_manifests(local: dict, remote: dict):
+    """
+    Returns a pair: (files to transfer, files to remove).
+    """
+    changed = [k for k, v in local.items()
+               if k not in remote or remote[k][2] != v[2]]
+    removed = [k for k in remote if k not in local]
+    return sorted(changed), sorted(removed)
+
+
+class _CountingWriter(io.RawIOBase):
+
+    def __init__(self, output):
+        self.output = output
+        self.n_bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.output.write(b)
+        self.n_bytes += len(b)
+        return len(b)
+
+
+class _CountingReader(io.RawIOBase):
+
+    def __init__(self, input):
+        self.input = input
+        self.n_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.input.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.n_bytes += n
+        return n
+
+
+def write_tar_stream(output, root_dir, files, info: dict):
+    """
+    Writes a gzip-compressed tar stream with the given files (paths relative
+    to the root_dir) to the output. The info dictionary is stored as
+    the first member of the archive.
+
+    :return: number of bytes written
+    """
+    counter = _CountingWriter(output)
+    with tarfile.open(fileobj=counter, mode="w|gz") as tar:
+        info = json.dumps(info).encode("utf-8")
+        tar_info = tarfile.TarInfo(SYNC_INFO_MEMBER)
+        tar_info.size = len(info)
+        tar.addfile(tar_info, io.BytesIO(info))
+        for f in files:
+            tar.add(os.path.join(root_dir, f), arcname=f, recursive=False)
+    return counter.n_bytes
+
+
+def read_manifest_cache(cache_file: str = None):
+    if cache_file is None or not pathlib.Path(cache_file).is_file():
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def write_manifest_cache(cache_file: str, manifest: dict):
+    if cache_file is not None:
+        with open(cache_file, "w") as f:
+            json.dump(manifest, f)
+
+
+def sync_to_remote(client, src_dir: str, dst_dir: str, exclude=(),
+                   cache_file: str = None):
+    """
+    Synchronizes the local src_dir with the remote dst_dir. Only new and
+    changed files are transferred (as a single compressed tar stream),
+    files removed from the src_dir are removed from the dst_dir.
+
+    The remote directory keeps the manifest of its content
+    (MANIFEST_FILE_NAME), which is compared with the manifest of the
+    local directory.
+
+    :param client: remote client, that implements
+      `remote_command_args(cmd: str) -> list`
+    :param exclude: additional local paths that should not be transferred
+      (e.g. the local build directory)
+    :param cache_file: path to the file where the local manifest is cached
+      between runs, so that only modified files are hashed
+    """
+    src_dir = os.path.abspath(src_dir)
+    extra_patterns = []
+    for path in exclude:
+        path = pathlib.Path(os.path.abspath(path))
+        try:
+            rel = path.relative_to(src_dir).as_posix()
+        except ValueError:
+            continue
+        if rel != ".":
+            extra_patterns.append(f"/{rel}/")
+    ignore = IgnoreRules.from_dir(src_dir, extra_patterns)
+
+    local = build_manifest(src_dir, ignore,
+                           cache=read_manifest_cache(cache_file))
+    write_manifest_cache(cache_file, local)
+
+    remote = read_remote_file(client, dst_dir, MANIFEST_FILE_NAME)
+    remote = json.loads(remote.decode("utf-8").strip() or "{}")
+
+    changed, removed = diff_manifests(local, remote)
+    logger.info(f"Synchronizing {src_dir} with {dst_dir}: "
+                f"{len(changed)} file(s) to transfer, "
+                f"{len(removed)} file(s) to remove.")
+    if not changed and not removed:
+        return 0
+    cmd = python_command(_APPLY_SCRIPT, dst_dir, MANIFEST_FILE_NAME,
+                         SYNC_INFO_MEMBER)
+    process = subprocess.Popen(client.remote_command_args(cmd),
+                               stdin=subprocess.PIPE)
+    try:
+        n_bytes = write_tar_stream(process.stdin, src_dir, changed,
+                                   {"removed": removed, "manifest": local})
+    finally:
+        process.stdin.close()
+    return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, process.args)
+    logger.info(f"Transferred {n_bytes} bytes.")
+    return n_bytes
+
+
+def is_safe_member_name(name: str):
+    path = pathlib.PurePosixPath(name)
+    return (name and not path.is_absolute() and ".." not in path.parts
+            and not pathlib.PureWindowsPath(name).drive)
+
+
+def extract_verified(tar, member, dst_path: str, expected_hash: str):
+    """
+    Extracts the given tar member to the dst_path, verifying its sha256 hash.
+    The destination file is replaced only when the hash matches.
+    """
+    os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+    tmp_path = f"{dst_path}.pydevops-tmp"
+    h = hashlib.sha256()
+    try:
+        with tar.extractfile(member) as src, open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(1024*1024), b""):
+                h.update(chunk)
+                dst.write(chunk)
+        if h.hexdigest() != expected_hash:
+            raise ValueError(f"Integrity check failed for: {member.name}, "
+                             f"expected sha256: {expected_hash}, "
+                             f"got: {h.hexdigest()}")
+        os.chmod(tmp_path, member.mode & 0o777)
+        os.utime(tmp_path, (member.mtime, member.mtime))
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def fetch_from_remote(client, src_dir: str, patterns, dst_dir: str,
+                      cache_file: str = None, exclude=()):
+    """
+    Copies the remote files matching the given glob patterns (relative to
+    the remote src_dir, e.g. "install/**") to the local dst_dir, keeping
+    their relative paths. The files are transferred as a single compressed
+    tar stream. Files whose local copy has the same content (sha256) are
+    skipped, the hash of each transferred file is verified.
+
+    :param client: remote client, that implements
+      `remote_command_args(cmd: str) -> list`
+    :param cache_file: path to the file where the manifest of the dst_dir is
+      cached between runs, so that only modified local files are hashed
+    :param exclude: fnmatch patterns of the relative paths of the files,
+      that should not be copied (even if they match the patterns)
+    :return: a pair: (number of transferred files, number of bytes received)
+    """
+    dst_dir = os.path.abspath(dst_dir)
+    local = {}
+    if os.path.isdir(dst_dir):
+        local = build_manifest(dst_dir, IgnoreRules(),
+                               cache=read_manifest_cache(cache_file))
+    request = json.dumps({"patterns": list(patterns),
+                          "exclude": list(exclude),
+                          "hashes": {k: v[2] for k, v in local.items()}})
+    cmd = python_command(_PACK_SCRIPT, src_dir, SYNC_INFO_MEMBER)
+    process = subprocess.Popen(client.remote_command_args(cmd),
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    info = None
+    received = set()
+    try:
+        process.stdin.write(request.encode("utf-8"))
+        process.stdin.close()
+        counter = _CountingReader(process.stdout)
+        with tarfile.open(fileobj=counter, mode="r|gz") as tar:
+            for member in tar:
+                if member.name == SYNC_INFO_MEMBER:
+                    info = json.loads(
+                        tar.extractfile(member).read().decode("utf-8"))
+                    continue
+                if (info is None or not member.isfile()
+                        or not is_safe_member_name(member.name)
+                        or member.name not in info["sent"]):
+                    raise ValueError(f"Unexpected archive member: "
+                                     f"{member.name}")
+                dst_path = os.path.join(dst_dir, *member.name.split("/"))
+                expected_hash = info["sent"][member.name]
+                extract_verified(tar, member, dst_path, expected_hash)
+                st = os.stat(dst_path)
+                local[member.name] = [st.st_size, st.st_mtime_ns,
+                                      expected_hash]
+                received.add(member.name)
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, process.args)
+    if info is None:
+        raise ValueError("Invalid archive received: no file list.")
+    missing = set(info["sent"]) - received
+    if missing:
+        raise ValueError(f"Files missing in the archive: {sorted(missing)}")
+    write_manifest_cache(cache_file, local)
+    n_files = len(received)
+    logger.info(f"Fetched {n_files} file(s) ({counter.n_bytes} bytes) from "
+                f"{src_dir} to {dst_dir}, {len(info['files']) - n_files} "
+                f"file(s) up to date.")
+    return n_files, counter.n_bytes
@@ -0,0 +1,171 @@
+"""Pipeline execution trace, in the Chrome trace event format."""
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+TRACE_FILE_NAME = "pydevops_trace.json"
+
+STAGE = "stage"
+STEP = "step"
+COMMAND = "command"
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+def get_children_cpu_time():
+    """
+    Returns the user and system CPU time (in seconds) of all the terminated
+    child processes of the current process, or (None, None) if not available.
+    """
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime, usage.ru_stime
+
+
+class Tracer:
+    """
+    Collects spans (stages, steps, commands) of the pipeline execution.
+
+    The trace can be saved in the Chrome trace event format (JSON), which can
+    be viewed e.g. in Perfetto or chrome://tracing. Timestamps are wall
+    clock times, so that traces from different hosts can be merged.
+    """
+
+    def __init__(self, process_name: str = "pydevops"):
+        self.pid = os.getpid()
+        self.process_name = process_name
+        self.events = []
+        self.process_names = {self.pid: process_name}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args):
+        """
+        Records a span of the code executed in the `with` block. The yielded
+        dictionary of the span arguments can be updated in the block.
+        """
+        start = now_us()
+        t0 = time.perf_counter()
+        try:
+            yield args
+        finally:
+            duration = int((time.perf_counter() - t0)*1e6)
+            self.add_span(name, category, start, duration, **args)
+
+    def add_span(self, name: str, category: str, start: int, duration: int,
+                 **args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start,
+            "dur": duration,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def merge(self, trace: dict, process_name: str):
+        """
+        Merges the given trace (e.g. a trace of the remote pydevops) into
+        this one, as a separate process.
+        """
+        events = [e for e in trace.get("traceEvents", []) if e["ph"] != "M"]
+        with self.lock:
+            pid = max(self.process_names.keys()) + 1
+            self.process_names[pid] = process_name
+            for e in events:
+                self.events.append({**e, "pid": pid})
+
+    def to_dict(self):
+        with self.lock:
+            metadata = [{"name": "process_name", "ph": "M", "pid": pid,
+                         "args": {"name": name}}
+                        for pid, name in self.process_names.items()]
+            return {
+                "traceEvents": metadata + list(self.events),
+                "displayTimeUnit": "ms"
+            }
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    def summary(self, n_commands=10):
+        """
+        Returns a summary table: wall time of each stage and step, and the
+        longest commands.
+        """
+        with self.lock:
+            events = sorted(self.events, key=lambda e: e["ts"])
+        lines = [f"{'Stage/step':<50} {'Wall [s]':>10}"]
+        for e in events:
+            if e["cat"] == STAGE:
+                lines.append(f"{e['name']:<50} {e['dur']/1e6:>10.2f}")
+            elif e["cat"] == STEP:
+                lines.append(f"  {e['name']:<48} {e['dur']/1e6:>10.2f}")
+        commands = sorted((e for e in events if e["cat"] == COMMAND),
+                          key=lambda e: e["dur"], reverse=True)[:n_commands]
+        if commands:
+            lines.append("")
+            lines.append(f"{'Command':<50} {'Wall [s]':>10} {'User [s]':>10} "
+                         f"{'Sys [s]':>10} {'Exit':>5}")
+            for e in commands:
+                args = e["args"]
+                name = e["name"]
+                name = name if len(name) <= 50 else name[:47] + "..."
+                user, system = args.get("user_cpu"), args.get("sys_cpu")
+                user = f"{user:.2f}" if user is not None else "-"
+                system = f"{system:.2f}" if system is not None else "-"
+                lines.append(f"{name:<50} {e['dur']/1e6:>10.2f} {user:>10} "
+                             f"{system:>10} {str(args.get('exit_code')):>5}")
+        return "\n".join(lines)
+
+
+_tracer = None
+
+
+def enable(process_name: str = "pydevops") -> Tracer:
+    """
+    Turns on tracing in the current process.
+    """
+    global _tracer
+    _tracer = Tracer(process_name)
+    return _tracer
+
+
+def disable():
+    """
+    Turns off tracing in the current process.
+    """
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    """
+    Returns the current tracer, or None if the tracing is turned off.
+    """
+    return _tracer
+
+
+def span(name: str, category: str, **args):
+    """
+    Records a span using the current tracer (if the tracing is turned on).
+    """
+    if _tracer is None:
+        return contextlib.nullcontext(args)
+    return _tracer.span(name, category, **args)
@@ -4,15 +4,76 @@ import platform
 import shutil
 import re
 
-import requests
 from datetime import date
 import platform
 import tempfile
 import glob
 import subprocess
+import threading
+import zipfile
+import zlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from pydevops.base import Step, Context
+from pydevops.github import GithubClient
 import pydevops.sh
+import pydevops.sync
+
+DOCS_CACHE_DIR_NAME = "pydevops_docs_cache"
+# Files are compressed concurrently in chunks of this size.
+ZIP_CHUNK_SIZE = 4*1024*1024
+# Deflate window size, the dictionary of the next chunk.
+ZIP_WINDOW_SIZE = 32*1024
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _prefetch(iterable, n):
+    """
+    Yields the items of the given iterable, advancing it up to n items ahead.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(item)
+        if len(pending) > n:
+            yield pending.popleft()
+    yield from pending
+
+
+def _deflate(data, zdict, level, is_last):
+    """
+    Deflates a chunk of a file (raw deflate, as stored in zip files).
+
+    The chunk is compressed with the tail of the previous chunk as the
+    dictionary and, unless it is the last one, ends with a sync flush
+    (byte-aligned, not final block), so the deflated chunks of a file
+    concatenated form a single deflate stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zdict=zdict)
+    flush_mode = zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(data) + compressor.flush(flush_mode)
+
+
+class _PrecompressedData:
+    """
+    Stands in for the compressor of a zip file entry opened for writing:
+    returns the data that has already been deflated.
+    """
+    def __init__(self):
+        self.data = b""
+
+    def compress(self, data):
+        result, self.data = self.data, b""
+        return result
+
+    def flush(self):
+        return b""
 
 
 def _is_prerelease(release_name):
@@ -23,8 +84,19 @@ class PublishDocs(Step):
     """
     Publishes docs in a given repository.
 
+    The docs repository is cloned shallowly (a single branch, without
+    history), optionally with a sparse checkout limited to the
+    releases/<version> directory. Only the files whose content has changed
+    are written to the repository.
+
     :param install_dir: path to the directory with release artifacts. Assumes
       that the documentation is located in the docs/html subdirectory.
+    :param branch: docs repository branch, optional, by default the remote
+      default branch is used
+    :param sparse: use sparse checkout, optional, default: False
+    :param clone_cache: keep the clone of the docs repository in the build
+      directory and fetch it in the subsequent runs, instead of cloning it
+      again, optional, default: False
     """
 
     def __init__(self, name):
@@ -35,51 +107,77 @@ class PublishDocs(Step):
         repository = ctx.get_option("repository")
         commit_msg = ctx.get_option_default("commit_msg", "")
         version = ctx.get_option("version")
-        self.publish(ctx, repository, install_dir, commit_msg, version)
-
-    def publish(self, ctx, repository, install_dir, commit_msg, version):
-        cwd = os.getcwd()
+        branch = ctx.get_option_default("branch", None)
+        sparse = _to_bool(ctx.get_option_default("sparse", False))
+        cache_dir = None
+        if _to_bool(ctx.get_option_default("clone_cache", False)):
+            cache_dir = os.path.join(ctx.get_param("build_dir"),
+                                     DOCS_CACHE_DIR_NAME)
+        self.publish(ctx, repository, install_dir, commit_msg, version,
+                     branch=branch, sparse=sparse, cache_dir=cache_dir)
+
+    def publish(self, ctx, repository, install_dir, commit_msg, version,
+                branch=None, sparse=False, cache_dir=None):
         _, repository_name = os.path.split(repository)
         repository_name, _ = repository_name.split(".")
-        try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                os.chdir(temp_dir)
-                ctx.sh(f"git clone {repository}")
-                version = version.strip()
-                version_dir = os.path.join(repository_name, "releases", version)
-                docs_dir = os.path.join(install_dir, "docs", "html")
-                ctx.rmdir(version_dir)
-                ctx.mkdir(version_dir)
-                language_doc_dirs = os.listdir(docs_dir)
-                # Copy documentation for each language.
-                for d in language_doc_dirs:
-                    dst = os.path.join(version_dir, d)
-                    src = os.path.join(docs_dir, d)
-                    shutil.copytree(src, dst)
-                os.chdir(repository_name)
-                ctx.sh("git add -A")
-                commit_msg = f"Updated docs: {commit_msg}"
-                result = self.git_commit(commit_msg)
-                if result == "ntc":
-                    print("Nothing to commit")
-                elif result != "ok":
-                    # We need to leave the temporary directory before its deleted by the
-                    # context manager, otherwise we will get an "Access denied" error on Windows.
-                    os.chdir(cwd)
-                    raise ValueError("Something went wrong when committing the changes, "
+        version = version.strip()
+        version_path = f"releases/{version}"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if cache_dir is not None:
+                repository_dir = os.path.join(cache_dir, repository_name)
+            else:
+                repository_dir = os.path.join(temp_dir, repository_name)
+            self.checkout(ctx, repository, repository_dir, branch=branch,
+                          sparse_path=version_path if sparse else None)
+            version_dir = os.path.join(repository_dir, *version_path.split("/"))
+            docs_dir = os.path.join(install_dir, "docs", "html")
+            n_written, n_removed = pydevops.sync.mirror_tree(docs_dir,
+                                                             version_dir)
+            print(f"Docs {version_path}: {n_written} file(s) written, "
+                  f"{n_removed} file(s) removed.")
+            ctx.sh("git add -A", cwd=repository_dir)
+            commit_msg = f"Updated docs: {commit_msg}"
+            result = self.git_commit(commit_msg, cwd=repository_dir)
+            if result == "ntc":
+                print("Nothing to commit")
+            elif result != "ok":
+                raise ValueError("Something went wrong when committing the changes, "
                                  "check the errors in log.")
-                else:
-                    ctx.sh(f"git push {repository}")
-                os.chdir(cwd)
-        finally:
-            os.chdir(cwd)
-            shutil.rmtree(repository_name, ignore_errors=True)
-
-    def git_commit(self, msg: str):
+            else:
+                ctx.sh(f"git push {repository}", cwd=repository_dir)
+
+    def checkout(self, ctx, repository, repository_dir, branch=None,
+                 sparse_path=None):
+        """
+        Makes a shallow, single-branch checkout of the given repository in
+        the repository_dir. If the repository_dir already contains the clone
+        (clone cache), only the latest commit is fetched.
+        """
+        if pathlib.Path(repository_dir, ".git").is_dir():
+            if branch is None:
+                branch = ctx.sh("git rev-parse --abbrev-ref HEAD",
+                                capture_stdout=True, cwd=repository_dir).stdout
+            ctx.sh(f"git fetch --depth 1 origin {branch}", cwd=repository_dir)
+            ctx.sh("git reset --hard FETCH_HEAD", cwd=repository_dir)
+            ctx.sh("git clean -fdx", cwd=repository_dir)
+        else:
+            cmd = "git clone --depth 1 --single-branch"
+            if branch is not None:
+                cmd += f" --branch {branch}"
+            if sparse_path is not None:
+                cmd += " --filter=blob:none --sparse"
+            pydevops.sh.mkdir(os.path.dirname(repository_dir), exist_ok=True)
+            ctx.sh(f"{cmd} {repository} {repository_dir}")
+        if sparse_path is not None:
+            ctx.sh(f"git sparse-checkout set {sparse_path}",
+                   cwd=repository_dir)
+
+    def git_commit(self, msg: str, cwd: str = None):
         params = ["git", "commit", "-m", "'"+msg+"'"]
         print("Calling: %s"%(" ".join(params)))
         try:
-            out = subprocess.check_output(params)
+            out = subprocess.check_output(params, cwd=cwd,
+                                          stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
             out = str(e.output)
             if "nothing to commit" in out:
@@ -91,6 +189,31 @@ class PublishDocs(Step):
 
 
 class Package(Step):
+    """
+    Packages the given artifacts into the dst_dir.
+
+    A single regular file is stored under the dst_artifact name (if
+    provided), multiple regular files are stored with their original names.
+    A single directory is packed into dst_artifact.zip (the archive contains
+    the content of the directory). Multiple files and/or directories are
+    packed into a single dst_artifact.zip.
+
+    Archives are written in a single pass, directly from the source paths,
+    the files are compressed concurrently (in chunks). Regular files are
+    hard-linked into the dst_dir when possible (i.e. on the same file system),
+    otherwise they are copied.
+
+    :param src_artifact: list of paths (glob) to the input artifacts,
+      separated by semicolons
+    :param dst_dir: path where the package should be located
+    :param dst_artifact: the name of the output artifact, optional
+    :param compression_level: zip compression level (0-9), optional,
+      default: 6
+    :param link: whether to hard-link the regular files, optional,
+      default: True
+    :param workers: the number of files linked/copied or chunks compressed
+      concurrently, optional, default: 4
+    """
     def __init__(self, name):
         super().__init__(name)
 
@@ -99,76 +222,173 @@ class Package(Step):
         src_artifact = ctx.get_option("src_artifact")
         dst_dir = ctx.get_option("dst_dir")
         dst_artifact = ctx.get_option_default("dst_artifact", "__same__")
+        compression_level = int(ctx.get_option_default("compression_level",
+                                                       6))
+        link = _to_bool(ctx.get_option_default("link", True))
+        workers = max(1, int(ctx.get_option_default("workers", 4)))
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            artifacts = self.prepare_artifacts(
-                src_artifact=src_artifact,
-                dst_artifact=dst_artifact,
-                workdir=temp_dir)
-            # Copy artifacts from the temporary directory to the dst_dir.
-            pydevops.sh.mkdir(dst_dir, exist_ok=True)
-            self.copy_files(artifacts, dst_dir)
-
-    def zip_files(self, root_dir, dst_zip_file):
-        return shutil.make_archive(dst_zip_file, "zip", root_dir=root_dir)
-
-    def prepare_artifacts(self, src_artifact: str, dst_artifact :str,
-                          workdir: str):
-        src_artifact = src_artifact.strip().strip(";")
         dst_artifact = dst_artifact.strip()
-        patterns = src_artifact.split(";")
-        output_files = []
-        for pattern in patterns:
-            output_files.extend(glob.glob(pattern))
-
-        # Copy input artifacts to the temporary workdir.
-        output_files = self.copy_files(output_files, workdir)
-
+        if dst_artifact == "__same__":
+            dst_artifact = None
+        files = self.get_artifacts(src_artifact)
+        pydevops.sh.mkdir(dst_dir, exist_ok=True)
         is_all_regular_files = all(pathlib.Path(file).is_file()
-                                   for file in output_files)
+                                   for file in files)
 
-        if dst_artifact != "__same__":
-            dst_path = os.path.join(workdir, dst_artifact)
-        else:
-            dst_path = None
-
-        if len(output_files) == 1 and is_all_regular_files:
+        if len(files) == 1 and is_all_regular_files:
             # A single, regular file.
             # Simply, change the name to the target name.
-            if dst_path is not None:
-                os.rename(output_files[0], dst_path)
-                output_files = [dst_path]
+            name = dst_artifact or pathlib.Path(files[0]).name
+            self.link_or_copy(files[0], os.path.join(dst_dir, name), link)
         elif is_all_regular_files:
             # If we only have regular files, simply publish all of them,
             # with their original names.
-            pass
-        elif len(output_files) == 1 and not is_all_regular_files:
-            # A single directory: zip it in the work dir and rename.
-            os.rename(output_files[0], dst_path)
-            zip_name = self.zip_files(dst_path, dst_path)
-            output_files = [zip_name]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self.link_or_copy, file,
+                                       os.path.join(dst_dir,
+                                                    pathlib.Path(file).name),
+                                       link)
+                           for file in files]
+                for future in futures:
+                    future.result()
+        elif len(files) == 1:
+            # A single directory: zip its content.
+            name = dst_artifact or pathlib.Path(files[0]).name
+            entries = self.get_archive_entries(files[0], arc_dir="")
+            self.zip_files(entries, os.path.join(dst_dir, f"{name}.zip"),
+                           compression_level, workers)
         else:
-            # Multiple files and/or directories.
-            # First, move all the workdir content to new directory 'archive'.
-            archive_dir = pathlib.Path(workdir) / "archive"
-            archive_dir.mkdir(parents=True)
-            for file in output_files:
-                shutil.move(file, str(archive_dir))
-            # Zip the "archive" directory.
-            output_files = [self.zip_files(archive_dir, dst_path)]
+            # Multiple files and/or directories: zip all of them.
+            name = dst_artifact or "archive"
+            entries = []
+            for file in files:
+                entries.extend(self.get_archive_entries(
+                    file, arc_dir=pathlib.Path(file).name))
+            self.zip_files(entries, os.path.join(dst_dir, f"{name}.zip"),
+                           compression_level, workers)
+
+    def get_artifacts(self, src_artifact: str):
+        src_artifact = src_artifact.strip().strip(";")
+        patterns = src_artifact.split(";")
+        output_files = []
+        for pattern in patterns:
+            output_files.extend(glob.glob(pattern))
         return output_files
 
-    def copy_files(self, files, target_dir):
+    def get_archive_entries(self, path: str, arc_dir: str):
+        """
+        Returns a list of pairs (source path, archive entry name) for the
+        given file or directory (recursively).
+        """
+        path = pathlib.Path(path)
+        if path.is_file():
+            return [(str(path), arc_dir)]
         result = []
-        for file in files:
-            input_path = pathlib.Path(file)
-            if input_path.is_dir():
-                dst = os.path.join(target_dir, input_path.name)
-                result.append(shutil.copytree(str(input_path), dst))
-            else:
-                result.append(shutil.copy(str(input_path), target_dir))
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            rel_dir = pathlib.Path(dir_path).relative_to(path).as_posix()
+            rel_dir = "" if rel_dir == "." else rel_dir
+            arc_rel_dir = "/".join(p for p in (arc_dir, rel_dir) if p)
+            if arc_rel_dir:
+                result.append((dir_path, arc_rel_dir + "/"))
+            for f in sorted(file_names):
+                result.append((os.path.join(dir_path, f),
+                               "/".join(p for p in (arc_rel_dir, f) if p)))
         return result
 
+    def zip_files(self, entries, dst_zip_file, compression_level=6,
+                  workers=4):
+        """
+        Writes the given (source path, entry name) pairs into a new zip file.
+
+        The files are deflated in chunks by a pool of workers and the
+        compressed chunks are written to the archive in order.
+        """
+        tmp_file = f"{dst_zip_file}.tmp"
+        compressor = _PrecompressedData()
+        dest = None
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                zipfile.ZipFile(tmp_file, "w",
+                                compression=zipfile.ZIP_DEFLATED,
+                                compresslevel=compression_level,
+                                allowZip64=True) as zf:
+            chunks = self.read_chunks(entries, pool, compression_level)
+            try:
+                for src, arc_name, chunk, deflated, is_last in _prefetch(
+                        chunks, 2*workers):
+                    if chunk is None:
+                        zf.write(src, arc_name)
+                        continue
+                    if dest is None:
+                        zinfo = zipfile.ZipInfo.from_file(src, arc_name)
+                        zinfo.compress_type = zipfile.ZIP_DEFLATED
+                        dest = zf.open(zinfo, "w")
+                        # The zip file computes the CRC and sizes of the
+                        # entry, the data is already deflated by the workers.
+                        dest._compressor = compressor
+                    compressor.data = deflated.result()
+                    dest.write(chunk)
+                    if is_last:
+                        dest.close()
+                        dest = None
+            finally:
+                if dest is not None:
+                    dest.close()
+        os.replace(tmp_file, dst_zip_file)
+        return dst_zip_file
+
+    def read_chunks(self, entries, pool, compression_level):
+        """
+        Reads the given entries in ZIP_CHUNK_SIZE chunks and submits them
+        to the pool for compression.
+
+        Yields (src, entry name, chunk, deflated chunk future, is last chunk
+        of the entry); chunk is None for directories.
+        """
+        for src, arc_name in entries:
+            if os.path.isdir(src):
+                yield src, arc_name, None, None, True
+                continue
+            with open(src, "rb") as f:
+                zdict = b""
+                chunk = f.read(ZIP_CHUNK_SIZE)
+                while True:
+                    next_chunk = f.read(ZIP_CHUNK_SIZE)
+                    is_last = not next_chunk
+                    deflated = pool.submit(_deflate, chunk, zdict,
+                                           compression_level, is_last)
+                    yield src, arc_name, chunk, deflated, is_last
+                    if is_last:
+                        break
+                    zdict = chunk[-ZIP_WINDOW_SIZE:]
+                    chunk = next_chunk
+
+    def link_or_copy(self, src: str, dst: str, link=True):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            # E.g. the artifact is already in the dst_dir.
+            return dst
+        # Replace the dst only when the new file is complete.
+        tmp = f"{dst}.tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        try:
+            linked = False
+            if link:
+                try:
+                    os.link(src, tmp)
+                    linked = True
+                except OSError:
+                    # E.g. different file systems.
+                    pass
+            if not linked:
+                shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            raise
+        return dst
+
 
 class PublishReleases(Step):
     """
@@ -206,9 +426,15 @@ class PublishReleases(Step):
     :param token: Github Personal Access Token (PAT)
     :param description: description of the release.
     :param repository: repository name, e.g. us4useu/arrus
+    :param parallel_uploads: the number of assets uploaded concurrently,
+      optional, default: 4
     """
     def __init__(self, name):
         super().__init__(name)
+        self.client = None
+        # Names of the release assets, fetched once, updated after each upload.
+        self.asset_names = None
+        self.asset_names_lock = threading.Lock()
 
     def execute(self, ctx: Context):
         release_name = ctx.get_option("release_name")
@@ -217,26 +443,32 @@ class PublishReleases(Step):
         repository_name = ctx.get_option("repository_name")
         token = ctx.get_option("token")
         description = ctx.get_option_default("description", "")
+        parallel_uploads = max(1, int(ctx.get_option_default(
+            "parallel_uploads", 4)))
+        self.client = GithubClient(repository_name=repository_name,
+                                   token=token, pool_size=parallel_uploads)
         is_prerelease = _is_prerelease(release_name)
         # Target branch to which the tag should be associated.
         target_commitish = ctx.get_option_default(
             "target_commitish", "master" if not is_prerelease else release_name
         )
         release_id = self.create_release(
-            repository_name=repository_name,
             release=release_name,
             body=description,
             prerelease=is_prerelease,
-            token=token,
             target_commitish=target_commitish
         )
+        print("Getting assets")
+        self.asset_names = set(asset["name"] for asset
+                               in self.client.list_assets(release_id))
         artifacts = self.get_artifacts(src_artifact)
-        for artifact in artifacts:
-            self.publish_asset(
-                repository_name=repository_name,
-                asset_path=artifact,
-                release_id=release_id,
-                token=token)
+        with ThreadPoolExecutor(max_workers=parallel_uploads) as pool:
+            futures = [pool.submit(self.publish_asset,
+                                   asset_path=artifact,
+                                   release_id=release_id)
+                       for artifact in artifacts]
+            for future in futures:
+                future.result()
 
     def get_artifacts(self, src_artifact):
         src_artifact = src_artifact.strip().strip(";")
@@ -246,8 +478,7 @@ class PublishReleases(Step):
             output_files.extend(glob.glob(pattern))
         return output_files
 
-    def create_release(self, repository_name, release, body, token, prerelease,
-                       target_commitish):
+    def create_release(self, release, body, prerelease, target_commitish):
         """
         Create new release, using the given parameters.
         If the release already exists, update it (append to the description
@@ -255,23 +486,17 @@ class PublishReleases(Step):
         """
         release_tag = release if not prerelease else f"{release}-first"
         print(f"Creating release: "
-              f"repository_name: {repository_name}, "
+              f"repository_name: {self.client.repository_name}, "
               f"release (tag_name): {release} "
               f"body: {body} "
               f"target commitish: {target_commitish} "
         )
-        response = requests.post(url=self.get_api_url(repository_name),
-                headers={
-                    "Authorization": f"token {token}"
-                },
-                json={
-                    "tag_name": release_tag,
-                    "target_commitish": target_commitish,
-                    "name": release,
-                    "body": body,
-                    "draft": False,
-                    "prerelease": prerelease
-                }
+        response = self.client.create_release(
+            tag_name=release_tag,
+            target_commitish=target_commitish,
+            name=release,
+            body=body,
+            prerelease=prerelease
         )
         # Check if the release already exists. If it is, just update it.
         if not response.ok:
@@ -281,25 +506,21 @@ class PublishReleases(Step):
                 response.raise_for_status()
             elif resp["errors"][0]["code"] == "already_exists":
                 print(f"RELEASE for tag {release_tag} EXISTS, UPDATING IT")
-                r = self.get_release_by_tag(
-                    repository_name=repository_name,
-                    release_tag=release_tag,
-                    token=token
-                )
+                print("Getting release by tag")
+                r = self.client.get_release_by_tag(release_tag)
                 r.raise_for_status()
                 release_id = r.json()["id"]
                 current_body = r.json()["body"]
                 # Append description after new line.
                 new_body = f"{current_body}\n{body}"
-                r = self.edit_release(
-                    repository_name=repository_name,
+                print("Editing release")
+                r = self.client.edit_release(
                     release_id=release_id,
-                    release_tag=release_tag,
-                    release_name=release,
+                    tag_name=release_tag,
+                    name=release,
                     body=new_body,
                     target_commitish=target_commitish,
-                    prerelease=prerelease,
-                    token=token)
+                    prerelease=prerelease)
                 print(resp)
                 r.raise_for_status()
                 return release_id
@@ -310,86 +531,19 @@ class PublishReleases(Step):
             release_id = response.json()["id"]
             return release_id
 
-    def get_release_by_tag(self, repository_name, release_tag, token):
-        print("Getting release by tag")
-        return requests.get(
-            url=f"{self.get_api_url(repository_name)}/tags/{release_tag}",
-            headers={
-                "Authorization": f"token {token}"
-            }
-        )
-
-    def edit_release(self, repository_name, release_id, release_name,
-                     release_tag, body,
-                     target_commitish, prerelease, token):
-        print("Editing release")
-        return requests.patch(
-            url=f"{self.get_api_url(repository_name)}/{str(release_id)}",
-            headers={
-                "Authorization": f"token {token}"
-            },
-            json={
-                "tag_name": release_tag,
-                "target_commitish": target_commitish,
-                "name": release_name,
-                "body": body,
-                "draft": False,
-                "prerelease": prerelease
-            }
-        )
-
-    def publish_asset(self, repository_name, asset_path, release_id, token):
-        # Get current assets.
+    def publish_asset(self, asset_path, release_id):
         asset_name = pathlib.Path(asset_path).name
-        r = self.get_assets(repository_name, release_id, token)
-        r.raise_for_status()
-        current_assets = r.json()
-        existing_assets = [asset for asset in current_assets
-                           if asset["name"] == asset_name]
-        if len(existing_assets) > 0:
-            raise RuntimeError(f"Release {release_id} contains more than "
-                               f"one asset with name: {asset_name}")
-        with open(asset_path, "rb") as f:
-            data = f.read()
-            r = self.upload_asset(repository_name, release_id,
-                                  asset_name, token, data)
+        with self.asset_names_lock:
+            if asset_name in self.asset_names:
+                raise RuntimeError(f"Release {release_id} contains more than "
+                                   f"one asset with name: {asset_name}")
+            # Reserve the name.
+            self.asset_names.add(asset_name)
+        print(f"Uploading asset: {asset_name}")
+        try:
+            r = self.client.upload_asset(release_id, asset_path, asset_name)
             r.raise_for_status()
-
-    def get_api_url(self, repository_name):
-        return f"https://api.github.com/repos/{repository_name}/releases"
-
-    def get_uploads_url(self, repository_name):
-        return f"https://uploads.github.com/repos/{repository_name}/releases"
-
-    def get_assets(self, repository_name, release_id, token):
-        print("Getting assets")
-        return requests.get(
-            url=f"{self.get_api_url(repository_name)}/{str(release_id)}/assets",
-            headers={
-                "Authorization": f"token {token}"
-            }
-        )
-    
-    def delete_asset(self, repository_name, asset_id, token):
-        print("Deleting asset")
-        return requests.delete(
-            url=f"{self.get_api_url(repository_name)}/assets/{str(asset_id)}",
-            headers={
-                'Authorization': f"token {token}"
-            },
-        )
-
-    def upload_asset(self, repository_name, release_id, asset_name, token,
-                     file_to_upload):
-        print("Uploading asset")
-        return requests.post(
-            url=f"{self.get_uploads_url(repository_name)}/{str(release_id)}/assets?name={asset_name}",
-            headers={
-                "Content-Type": "application/gzip",
-                "Authorization": f"token {token}"
-            },
-            data=file_to_upload
-        )
-
-
-
+        except Exception:
+            with self.asset_names_lock:
+                self.asset_names.discard(asset_name)
+            raise
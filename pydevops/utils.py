@@ -1,4 +1,5 @@
 import logging
+import os
 import inspect
 
 LOGGING_FORMAT = "[%(asctime)s][%(name)s][%(levelname)s] %(message)s"
@@ -58,4 +59,58 @@ __LOGGER_FACTORY = LoggerFactory()
 
 
 def get_logger(*args, **kwargs):
-    return __LOGGER_FACTORY.get_logger(*args, **kwargs)
\ No newline at end of file
+    return __LOGGER_FACTORY.get_logger(*args, **kwargs)
+
+
+class FileLock:
+    """
+    Inter-process exclusive lock, based on the lock of the given file
+    (flock on POSIX, msvcrt.locking on Windows). Works also between
+    the processes of the docker containers sharing a directory with the host.
+
+    Usage:
+        with FileLock(path):
+            ...
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, "a+")
+        if os.name == "nt":
+            import msvcrt
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 s, try again.
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        if self.file is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,76 @@
+import json
+import os
+import socket
+
+import pytest
+
+from pydevops.agent import AgentServer, OUTPUT, EXIT
+
+pytestmark = pytest.mark.skipif(os.name == "nt",
+                                reason="The agent requires a POSIX host.")
+
+
+def send_request(server: AgentServer, request: bytes):
+    server_socket, client_socket = socket.socketpair()
+    with server_socket, client_socket:
+        client_socket.sendall(request + b"\n")
+        client_socket.shutdown(socket.SHUT_WR)
+        server.handle(server_socket)
+        server_socket.shutdown(socket.SHUT_WR)
+        with client_socket.makefile("rb") as f:
+            return [json.loads(line.decode("utf-8")) for line in f]
+
+
+def get_output(messages):
+    return "".join(m["data"] for m in messages if m["type"] == OUTPUT)
+
+
+@pytest.mark.parametrize("request_line", [
+    b"not json",
+    b"[1, 2]",
+    json.dumps({"src_dir": "."}).encode("utf-8"),
+    json.dumps({"args": None, "src_dir": "."}).encode("utf-8"),
+])
+def test_invalid_request_is_answered_with_error(request_line):
+    calls = []
+    server = AgentServer("unused.sock", run_func=calls.append)
+
+    messages = send_request(server, request_line)
+
+    assert calls == []
+    assert messages[-1] == {"type": EXIT, "code": 2}
+    assert "Invalid pydevops agent request" in get_output(messages)
+
+
+def test_run_gets_the_requested_environment_and_cwd(tmp_path, monkeypatch):
+    monkeypatch.delenv("PYDEVOPS_AGENT_TEST", raising=False)
+    cwd = os.getcwd()
+
+    def run_func(args):
+        # Note: the output of the file descriptors is captured (as of
+        # the child processes).
+        os.write(1, f"{args} {os.environ.get('PYDEVOPS_AGENT_TEST')} "
+                    f"{os.getcwd()}\n".encode("utf-8"))
+
+    server = AgentServer("unused.sock", run_func=run_func)
+    request = {"args": ["--help"], "src_dir": str(tmp_path),
+               "cwd": str(tmp_path),
+               "env": {**os.environ, "PYDEVOPS_AGENT_TEST": "remote"}}
+
+    messages = send_request(server, json.dumps(request).encode("utf-8"))
+
+    assert messages[-1] == {"type": EXIT, "code": 0}
+    assert get_output(messages) == f"['--help'] remote {tmp_path}\n"
+    assert "PYDEVOPS_AGENT_TEST" not in os.environ
+    assert os.getcwd() == cwd
+
+
+def test_run_error_is_reported(tmp_path):
+    server = AgentServer("unused.sock", run_func=lambda args: None)
+    request = {"args": [], "src_dir": str(tmp_path),
+               "cwd": str(tmp_path / "missing")}
+
+    messages = send_request(server, json.dumps(request).encode("utf-8"))
+
+    assert messages[-1] == {"type": EXIT, "code": 1}
+    assert "pydevops agent error" in get_output(messages)
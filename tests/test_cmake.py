@@ -0,0 +1,121 @@
+import json
+from argparse import Namespace
+
+import pytest
+
+from pydevops.base import Context
+from pydevops.cmake import (Build, compute_libraries_hash,
+                            compute_test_fingerprint)
+from pydevops.sh import CommandResult
+
+
+def create_build_dir(tmp_path):
+    build_dir = tmp_path / "build"
+    (build_dir / "tests").mkdir(parents=True)
+    (build_dir / "lib").mkdir()
+    (build_dir / "tests" / "test_core").write_bytes(b"exe")
+    (build_dir / "tests" / "data.bin").write_bytes(b"data")
+    (build_dir / "lib" / "libcore.so.1").write_bytes(b"lib")
+    return build_dir
+
+
+def fingerprint(build_dir, test):
+    file_hashes = {}
+    libraries_hash = compute_libraries_hash(str(build_dir), file_hashes)
+    return compute_test_fingerprint(test, file_hashes, str(build_dir),
+                                    libraries_hash)
+
+
+def test_relative_paths_are_resolved_against_the_build_dir(tmp_path,
+                                                          monkeypatch):
+    build_dir = create_build_dir(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    test = {"name": "core", "command": ["tests/test_core"],
+            "properties": [{"name": "REQUIRED_FILES",
+                            "value": ["tests/data.bin"]}]}
+    before = fingerprint(build_dir, test)
+
+    (build_dir / "tests" / "data.bin").write_bytes(b"new data")
+    after_data = fingerprint(build_dir, test)
+    (build_dir / "tests" / "test_core").write_bytes(b"new exe")
+    after_exe = fingerprint(build_dir, test)
+
+    assert len({before, after_data, after_exe}) == 3
+
+
+def test_relative_paths_are_resolved_against_the_working_directory(
+        tmp_path):
+    build_dir = create_build_dir(tmp_path)
+    test = {"name": "core", "command": [str(build_dir / "tests" /
+                                            "test_core"), "data.bin"],
+            "properties": [{"name": "WORKING_DIRECTORY",
+                            "value": str(build_dir / "tests")}]}
+    before = fingerprint(build_dir, test)
+
+    (build_dir / "tests" / "data.bin").write_bytes(b"new data")
+
+    assert fingerprint(build_dir, test) != before
+
+
+def test_rebuilt_library_changes_the_fingerprint(tmp_path):
+    build_dir = create_build_dir(tmp_path)
+    test = {"name": "core",
+            "command": [str(build_dir / "tests" / "test_core")]}
+    before = fingerprint(build_dir, test)
+    assert fingerprint(build_dir, test) == before
+
+    (build_dir / "lib" / "libcore.so.1").write_bytes(b"new lib")
+
+    assert fingerprint(build_dir, test) != before
+
+
+class FakeShell:
+    """
+    Records the commands, returns the next compiler cache statistics.
+    """
+    def __init__(self, stats):
+        self.stats = list(stats)
+        self.cmds = []
+
+    def run(self, cmd, capture_stdout=False, **kwargs):
+        self.cmds.append(cmd)
+        stdout = self.stats.pop(0) if capture_stdout else ""
+        return CommandResult(return_code=0, stdout=stdout)
+
+
+def build(tmp_path, launcher, stats):
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    (build_dir / "CMakeCache.txt").write_text(
+        f"CMAKE_CXX_COMPILER_LAUNCHER:FILEPATH=/usr/bin/{launcher}\n")
+    shell = FakeShell(stats)
+    ctx = Context(env=None, args=Namespace(src_dir=str(tmp_path),
+                                           build_dir=str(build_dir)),
+                  options={"config": "Release", "j": "2"}, cmd_exec=shell)
+    Build("/build/build").execute(ctx)
+    return shell.cmds
+
+
+def ccache_stats(hits, misses):
+    return (f"direct_cache_hit\t{hits}\npreprocessed_cache_hit\t1\n"
+            f"cache_miss\t{misses}\n")
+
+
+def sccache_stats(hits, misses):
+    return json.dumps({"stats": {
+        "cache_hits": {"counts": {"C/C++": hits}},
+        "cache_misses": {"counts": {"C/C++": misses, "CUDA": 1}}}})
+
+
+@pytest.mark.parametrize("launcher, stats", [
+    ("ccache", ccache_stats), ("sccache", sccache_stats)])
+def test_build_reports_compiler_cache_stats_difference(tmp_path, capsys,
+                                                       launcher, stats):
+    cmds = build(tmp_path, launcher, [stats(10, 5), stats(17, 8)])
+
+    assert len(cmds) == 3
+    assert cmds[1].startswith("cmake --build")
+    for cmd in cmds:
+        assert " -z" not in cmd
+        assert "--zero-stats" not in cmd
+    assert f"({launcher}): 7 hit(s), 3 miss(es)" in capsys.readouterr().out
@@ -0,0 +1,118 @@
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import pydevops.docker as docker
+
+
+class FakeShell:
+    """
+    Records the docker commands; the given containers exist (are running).
+    """
+
+    def __init__(self, containers=()):
+        self.containers = set(containers)
+        self.commands = []
+
+    def run(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        args = cmd.split()
+        if args[1] == "images":
+            return SimpleNamespace(stdout="0123456789ab")
+        if args[1] == "inspect":
+            if args[-1] not in self.containers:
+                raise subprocess.CalledProcessError(1, cmd)
+            return SimpleNamespace(stdout="running")
+        if args[1] == "run":
+            return SimpleNamespace(stdout="fedcba9876543210")
+        return SimpleNamespace(stdout="")
+
+
+def create_client(monkeypatch, parameters, containers=()):
+    shell = FakeShell(containers)
+    monkeypatch.setattr(docker, "Shell", lambda: shell)
+    client = docker.DockerClient(parameters, build_dir="/build")
+    client.add_source_mount("/src", "/container/src")
+    return client, shell
+
+
+def get_run_commands(shell):
+    return [c for c in shell.commands if c.startswith("docker run")]
+
+
+@pytest.mark.parametrize("parameters", [
+    "name::ubuntu;transfer::mount",
+    # The saved container does not exist anymore.
+    "name::ubuntu;transfer::mount;container::0123abcd",
+])
+def test_new_container_gets_the_source_mount(monkeypatch, parameters):
+    client, shell = create_client(monkeypatch, parameters)
+
+    client.start()
+
+    [run] = get_run_commands(shell)
+    assert "-v /src:/container/src " in run
+    assert client.container_id == "fedcba987654"
+    assert "-v" not in client.params
+
+
+def test_read_only_source_mount(monkeypatch):
+    client, shell = create_client(monkeypatch,
+                                  "name::ubuntu;transfer::mount-ro")
+
+    client.start()
+
+    [run] = get_run_commands(shell)
+    assert "-v /src:/container/src:ro " in run
+
+
+def test_running_container_is_reused(monkeypatch):
+    client, shell = create_client(
+        monkeypatch, "name::ubuntu;transfer::mount;container::0123abcd",
+        containers=["0123abcd"])
+
+    client.start()
+
+    assert get_run_commands(shell) == []
+    assert client.container_id == "0123abcd"
+
+
+def test_new_container_gets_the_overlay_source_mount(monkeypatch, tmp_path):
+    shell = FakeShell()
+    monkeypatch.setattr(docker, "Shell", lambda: shell)
+    build_dir = tmp_path / "build"
+    client = docker.DockerClient("name::ubuntu;transfer::overlay",
+                                 build_dir=str(build_dir))
+    client.add_source_mount("/src", "/container/src")
+
+    client.start()
+
+    [run] = get_run_commands(shell)
+    overlay_dir = build_dir / docker.OVERLAY_DIR_NAME
+    assert ("--mount 'type=volume,dst=/container/src,volume-driver=local,"
+            "volume-opt=type=overlay,volume-opt=device=overlay,"
+            f"\"volume-opt=o=lowerdir=/src,upperdir={overlay_dir}/upper,"
+            f"workdir={overlay_dir}/work\"' ") in run
+    assert (overlay_dir / "upper").is_dir()
+    assert (overlay_dir / "work").is_dir()
+    assert client.is_source_mounted
+
+    # A new container starts with a clean overlay.
+    client.start(recreate=True)
+
+    clean, run = get_run_commands(shell)[1:]
+    assert clean.startswith(f"docker run --rm -v {overlay_dir}:/overlay ")
+    assert "rm -rf /overlay/upper /overlay/work" in clean
+
+
+def test_overlay_requires_the_build_dir_outside_the_sources(monkeypatch,
+                                                           tmp_path):
+    shell = FakeShell()
+    monkeypatch.setattr(docker, "Shell", lambda: shell)
+    client = docker.DockerClient("name::ubuntu;transfer::overlay",
+                                 build_dir=str(tmp_path / "build"))
+    client.add_source_mount(str(tmp_path), "/container/src")
+
+    with pytest.raises(ValueError, match="outside the source directory"):
+        client.start()
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from pydevops.base import Context, Step
+from pydevops.cmake import Configure
+from pydevops.fingerprint import compute_fingerprint, find_input_files
+
+
+def touch(path, content="x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def test_find_input_files_skips_build_vcs_venv_and_ignored_dirs(tmp_path):
+    src = tmp_path / "src"
+    touch(src / "CMakeLists.txt")
+    touch(src / "cmake" / "Find.cmake")
+    touch(src / "lib" / "CMakeLists.txt")
+    touch(src / "build" / "CMakeLists.txt")
+    touch(src / "build-release" / "CMakeCache.txt")
+    touch(src / "build-release" / "CMakeLists.txt")
+    touch(src / ".git" / "CMakeLists.txt")
+    touch(src / "venv" / "pyvenv.cfg")
+    touch(src / "venv" / "lib" / "x.cmake")
+    touch(src / "third_party" / "CMakeLists.txt")
+    touch(src / ".gitignore", "third_party/\n")
+
+    files = find_input_files(str(src), Configure.input_files,
+                             exclude_dir=str(src / "build"))
+
+    assert files == ["CMakeLists.txt", "cmake/Find.cmake",
+                     "lib/CMakeLists.txt"]
+
+
+def test_patterns_without_directory_match_top_level_files(tmp_path):
+    touch(tmp_path / "conaninfo.txt")
+    touch(tmp_path / "sub" / "conaninfo.txt")
+
+    assert find_input_files(str(tmp_path), ["conaninfo.txt"]) == [
+        "conaninfo.txt"]
+
+
+def create_context(tmp_path, options):
+    args = SimpleNamespace(src_dir=str(tmp_path / "src"),
+                           build_dir=str(tmp_path / "build"))
+    return Context(env=None, args=args, options=options)
+
+
+def test_configure_fingerprint_includes_conan_generated_files(tmp_path):
+    touch(tmp_path / "src" / "CMakeLists.txt")
+    touch(tmp_path / "build" / "conan_paths.cmake", "a")
+    ctx = create_context(tmp_path, {"generator": "Ninja"})
+    step = Configure("/cfg/cmake")
+    before = compute_fingerprint(step, ctx)
+
+    touch(tmp_path / "build" / "conan_paths.cmake", "b")
+
+    assert compute_fingerprint(step, ctx) != before
+
+
+class SelectedOptions(Step):
+    input_options = ("a", )
+
+    def execute(self, context):
+        pass
+
+
+def test_only_declared_options_are_taken_into_account(tmp_path):
+    step = SelectedOptions("/stage/step")
+    first = compute_fingerprint(step, create_context(tmp_path,
+                                                     {"a": "1", "b": "1"}))
+    other_b = compute_fingerprint(step, create_context(tmp_path,
+                                                       {"a": "1", "b": "2"}))
+    other_a = compute_fingerprint(step, create_context(tmp_path,
+                                                       {"a": "2", "b": "1"}))
+
+    assert first == other_b
+    assert first != other_a
@@ -0,0 +1,254 @@
+import functools
+import hashlib
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import pydevops.github as github
+import pydevops.us4us as us4us
+from pydevops.base import Context
+
+REPOSITORY = "us4useu/test"
+RELEASE_ID = 7
+
+
+class FakeGithubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record(self):
+        url = urllib.parse.urlsplit(self.path)
+        with self.server.lock:
+            self.server.requests.append((self.command, url.path))
+        return url.path, urllib.parse.parse_qs(url.query)
+
+    def do_GET(self):
+        path, _ = self.record()
+        if path == f"/repos/{REPOSITORY}/releases/{RELEASE_ID}/assets":
+            with self.server.lock:
+                assets = [{"name": name} for name in self.server.assets]
+            etag = '"' + hashlib.sha256(
+                json.dumps(assets).encode("utf-8")).hexdigest() + '"'
+            if self.headers.get("If-None-Match", None) == etag:
+                with self.server.lock:
+                    self.server.n_not_modified += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_json(200, assets, headers={"ETag": etag})
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        path, query = self.record()
+        size = int(self.headers["Content-Length"])
+        if path == f"/repos/{REPOSITORY}/releases":
+            self.rfile.read(size)
+            self.send_json(201, {"id": RELEASE_ID})
+        elif path == f"/repos/{REPOSITORY}/releases/{RELEASE_ID}/assets":
+            h = hashlib.sha256()
+            n_left = size
+            while n_left > 0:
+                chunk = self.rfile.read(min(n_left, 64*1024))
+                if not chunk:
+                    break
+                h.update(chunk)
+                n_left -= len(chunk)
+            name = query["name"][0]
+            with self.server.lock:
+                self.server.uploads.append(
+                    (name, size, h.hexdigest(),
+                     self.headers.get("Transfer-Encoding", None)))
+                self.server.assets.append(name)
+            self.send_json(201, {"name": name})
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             FakeGithubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.uploads = []
+    server.assets = []
+    server.n_not_modified = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client_factory(server, monkeypatch):
+    factory = functools.partial(github.GithubClient, api_url=server.url,
+                                uploads_url=server.url)
+    monkeypatch.setattr(us4us, "GithubClient", factory)
+    return factory
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    Sizes of all the reads of the uploaded files.
+    """
+    result = []
+    read = github.FileUploadReader.read
+
+    def recording_read(self, size=-1):
+        data = read(self, size)
+        result.append(len(data))
+        return data
+
+    monkeypatch.setattr(github.FileUploadReader, "read", recording_read)
+    return result
+
+
+def create_file(path, size):
+    data = (hashlib.sha256(path.name.encode("utf-8")).digest()
+            * (size // 32 + 1))[:size]
+    path.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def publish(src_artifact, parallel_uploads=4):
+    step = us4us.PublishReleases("/publish/releases")
+    ctx = Context(env=None, args=None, options={
+        "release_name": "v1.0.0",
+        "src_artifact": src_artifact,
+        "repository_name": REPOSITORY,
+        "token": "token",
+        "parallel_uploads": str(parallel_uploads),
+    })
+    step.execute(ctx)
+
+
+def test_upload_asset_streams_the_file(tmp_path, server, client_factory,
+                                       reads):
+    size = 8*1024*1024 + 123
+    path = tmp_path / "large.tar.gz"
+    digest = create_file(path, size)
+    client = client_factory(REPOSITORY, "token")
+
+    r = client.upload_asset(RELEASE_ID, str(path))
+
+    r.raise_for_status()
+    assert server.uploads == [("large.tar.gz", size, digest, None)]
+    assert sum(reads) == size
+    assert max(reads) <= 1024*1024
+    assert len(reads) > 1
+
+
+def test_publish_releases_uploads_all_assets_once(tmp_path, server,
+                                                  client_factory, reads):
+    digests = {}
+    sizes = {}
+    for i in range(6):
+        size = 5*1024*1024 if i == 0 else 1000*(i + 1)
+        path = tmp_path / f"asset-{i}.zip"
+        digests[path.name] = create_file(path, size)
+        sizes[path.name] = size
+
+    publish(str(tmp_path / "*.zip"), parallel_uploads=3)
+
+    names = [name for name, _, _, _ in server.uploads]
+    assert len(names) == len(set(names))
+    assert sorted(names) == sorted(digests)
+    for name, size, digest, _ in server.uploads:
+        assert size == sizes[name]
+        assert digest == digests[name]
+    assert max(reads) < 5*1024*1024
+
+
+def test_publish_releases_rejects_duplicate_asset_names(tmp_path, server,
+                                                        client_factory):
+    for d in ("a", "b"):
+        (tmp_path / d).mkdir()
+        create_file(tmp_path / d / "asset.zip", 1000)
+    src_artifact = f"{tmp_path / 'a' / '*.zip'};{tmp_path / 'b' / '*.zip'}"
+
+    with pytest.raises(RuntimeError, match="asset.zip"):
+        publish(src_artifact, parallel_uploads=2)
+
+    assert [name for name, _, _, _ in server.uploads] == ["asset.zip"]
+
+
+def test_publish_releases_does_not_overwrite_existing_assets(
+        tmp_path, server, client_factory):
+    server.assets.append("asset.zip")
+    create_file(tmp_path / "asset.zip", 1000)
+
+    with pytest.raises(RuntimeError, match="asset.zip"):
+        publish(str(tmp_path / "asset.zip"))
+
+    assert server.uploads == []
+
+
+def count_requests(server, method, path):
+    with server.lock:
+        return sum(r == (method, path) for r in server.requests)
+
+
+def test_publish_releases_lists_assets_once(tmp_path, server,
+                                            client_factory):
+    for i in range(5):
+        create_file(tmp_path / f"asset-{i}.zip", 1000)
+
+    publish(str(tmp_path / "*.zip"), parallel_uploads=2)
+
+    assets_path = f"/repos/{REPOSITORY}/releases/{RELEASE_ID}/assets"
+    assert count_requests(server, "GET", assets_path) == 1
+    assert count_requests(server, "POST", assets_path) == 5
+    assert count_requests(server, "POST",
+                          f"/repos/{REPOSITORY}/releases") == 1
+
+
+def test_list_assets_returns_cached_response_when_not_modified(
+        server, client_factory):
+    server.assets.extend(["a.zip", "b.zip"])
+    client = client_factory(REPOSITORY, "token")
+
+    first = client.list_assets(RELEASE_ID)
+    second = client.list_assets(RELEASE_ID)
+    server.assets.append("c.zip")
+    third = client.list_assets(RELEASE_ID)
+
+    assets_path = f"/repos/{REPOSITORY}/releases/{RELEASE_ID}/assets"
+    assert count_requests(server, "GET", assets_path) == 3
+    assert server.n_not_modified == 1
+    assert first == second == [{"name": "a.zip"}, {"name": "b.zip"}]
+    assert third == first + [{"name": "c.zip"}]
+    assert len(client.etag_cache) == 1
+
+
+def test_get_returns_the_cached_response_on_304(server, client_factory):
+    client = client_factory(REPOSITORY, "token")
+    url = f"{server.url}/repos/{REPOSITORY}/releases/{RELEASE_ID}/assets"
+
+    first = client.get(url)
+    second = client.get(url)
+
+    assert first.status_code == 200
+    assert server.n_not_modified == 1
+    assert second is first
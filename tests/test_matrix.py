@@ -0,0 +1,54 @@
+import os
+
+import pydevops.resources as resources
+from pydevops.matrix import Job, Runner, get_matrix_variants
+
+
+def test_matrix_combinations_use_separate_remote_directories():
+    args = {"build_dir": "build", "ssh_src_dir": "/remote/src",
+            "ssh_build_dir": "/remote/build", "docker_src_dir": None,
+            "options": ["j=4"]}
+
+    variants = get_matrix_variants(args, {"build_type": ["Debug",
+                                                         "Release"]})
+
+    assert [name for name, _ in variants] == ["build_type-Debug",
+                                              "build_type-Release"]
+    for name, job_args in variants:
+        assert job_args["build_dir"] == os.path.join("build", name)
+        assert job_args["ssh_src_dir"] == os.path.join("/remote/src", name)
+        assert job_args["ssh_build_dir"] == os.path.join("/remote/build",
+                                                         name)
+        assert job_args["docker_src_dir"] is None
+    assert variants[0][1]["options"] == ["j=4", "build_type=Debug"]
+    assert args["ssh_src_dir"] == "/remote/src"
+
+
+def test_remote_jobs_get_a_share_of_the_remote_resources(monkeypatch):
+    monkeypatch.setenv(resources.CPU_BUDGET_ENV, "64")
+    jobs = [Job(name=f"job-{i}", args=[]) for i in range(4)]
+
+    runner = Runner(jobs, remote=True)
+    env = runner.get_env()
+
+    assert runner.max_parallel == 4
+    assert float(env[resources.RESOURCE_SHARE_ENV]) == 0.25
+    # The local budget does not apply to the remote machine.
+    assert runner.cpu_budget is None
+    assert runner.memory_budget is None
+
+
+def test_resource_share_limits_the_cpus_and_memory(monkeypatch):
+    monkeypatch.delenv(resources.CPU_BUDGET_ENV, raising=False)
+    monkeypatch.delenv(resources.MEMORY_BUDGET_ENV, raising=False)
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(16)),
+                        raising=False)
+    monkeypatch.setattr(resources, "psutil", None)
+    monkeypatch.setattr(resources, "_read_meminfo_available",
+                        lambda: 32*resources.GB)
+    monkeypatch.setattr(os.path, "exists", lambda path: True)
+    monkeypatch.setenv(resources.RESOURCE_SHARE_ENV, "0.25")
+
+    assert resources.get_cpu_count() == 4
+    assert resources.get_available_memory() == 8*resources.GB
+    assert resources.get_n_jobs(resources.AUTO, memory_per_job=4) == 2
@@ -0,0 +1,142 @@
+import random
+from types import SimpleNamespace
+
+from pydevops.base import create_context, sanitize, Environment
+
+
+def baseline_step_options(options: dict, step_name: str):
+    """
+    The reference implementation of the step options: all the options
+    parsed again for each step.
+    """
+    stage, step = step_name.strip("/").split("/")
+    stage, step = sanitize(stage), sanitize(step)
+    result = {}
+    for k, v in options.items():
+        parts = k.strip("/").split("/")
+        if len(parts) == 1:
+            result[sanitize(parts[0])] = v
+        elif len(parts) == 2:
+            if sanitize(parts[0]) == stage:
+                result[sanitize(parts[1])] = v
+        elif len(parts) == 3:
+            if sanitize(parts[0]) == stage and sanitize(parts[1]) == step:
+                result[sanitize(parts[2])] = v
+    return result
+
+
+def create_test_context(options, defaults=None, aliases=None):
+    env = Environment(host="localhost", docker=None, src_dir=".",
+                      build_dir="build")
+    cfg = SimpleNamespace(defaults=defaults or {}, aliases=aliases or {})
+    return create_context(env, SimpleNamespace(), options, cfg)
+
+
+def test_step_view_keeps_options_removed_by_callable_defaults_out():
+    def derived(ctx):
+        return f"derived-{ctx.remove_option('raw_flag')}"
+
+    ctx = create_test_context({"raw_flag": "X", "a": "1"},
+                              defaults={"derived": derived})
+
+    options = ctx.step_view("/build/compile").get_options()
+
+    assert options == {"derived": "derived-X", "a": "1"}
+
+
+def test_callable_defaults_are_evaluated_once_before_the_steps_run():
+    calls = []
+
+    def default(ctx):
+        calls.append(ctx.has_option("j"))
+        return "4"
+
+    ctx = create_test_context({}, defaults={"j": default})
+    ctx.step_view("/build/compile")
+    ctx.step_view("/test/ctest")
+
+    assert calls == [False]
+    assert ctx.step_view("/build/compile").get_option("j") == "4"
+
+
+def test_callable_default_is_overridden_by_the_user_option():
+    ctx = create_test_context({"j": "8"}, defaults={"j": lambda ctx: "4"})
+
+    assert ctx.step_view("/build/compile").get_option("j") == "8"
+
+
+def test_overridden_callable_default_is_not_called():
+    def default(ctx):
+        raise AssertionError("the default of an overridden option was called")
+
+    ctx = create_test_context({"a": "1", "j": "8"},
+                              defaults={"j": default, "b": lambda ctx: "2"})
+
+    options = ctx.step_view("/build/compile").get_options()
+
+    assert options == {"j": "8", "b": "2", "a": "1"}
+
+
+def test_callable_default_is_called_when_its_option_is_removed():
+    def default(ctx):
+        return "4"
+
+    ctx = create_test_context(
+        {"j": "8", "raw_j": "1"},
+        defaults={"j": default, "n": lambda ctx: ctx.remove_option("j")})
+
+    options = ctx.step_view("/build/compile").get_options()
+
+    assert options == {"j": "4", "n": "8", "raw_j": "1"}
+
+
+def test_step_view_scopes():
+    options = {
+        "j": "1",
+        "/build/j": "2",
+        "/build/compile/j": "3",
+        " test / ctest / j ": "4",
+        "/build/compile/too/deep": "x",
+    }
+    ctx = create_test_context(options)
+
+    assert ctx.step_view("/build/compile").get_options() == {"j": "3"}
+    assert ctx.step_view("/build/install").get_options() == {"j": "2"}
+    assert ctx.step_view("/test/ctest").get_options() == {"j": "4"}
+    assert ctx.step_view("/package/zip").get_options() == {"j": "1"}
+
+
+def test_step_view_matches_baseline_for_random_options():
+    rng = random.Random(1234)
+    stages = ["build", "test"]
+    steps = ["a", "b"]
+    names = ["x", "y", "z", "alias"]
+    for _ in range(500):
+        options = {}
+        for _ in range(rng.randint(0, 12)):
+            name = rng.choice(names)
+            scope = rng.randint(0, 2)
+            if scope == 0:
+                key = name
+            elif scope == 1:
+                key = f"/{rng.choice(stages)}/{name}"
+            else:
+                key = f"/{rng.choice(stages)}/{rng.choice(steps)}/{name}"
+            options[key] = str(rng.randint(0, 100))
+        removed = rng.choice(names)
+
+        def default(cfg_ctx, removed=removed):
+            if cfg_ctx.has_option(removed):
+                return cfg_ctx.remove_option(removed)
+            return "default"
+
+        defaults = {"d": default, "x": "x-default"}
+        aliases = {"alias": ["x", "y"]}
+        ctx = create_test_context(options, defaults=defaults, aliases=aliases)
+        for stage in stages:
+            for step in steps:
+                step_name = f"/{stage}/{step}"
+                expected = baseline_step_options(ctx.options, step_name)
+                actual = ctx.step_view(step_name).get_options()
+                assert actual == expected
+                assert list(actual) == list(expected)
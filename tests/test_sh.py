@@ -0,0 +1,22 @@
+import asyncio
+import sys
+
+from pydevops.sh import AsyncShell
+
+
+def test_async_run_captures_long_lines(tmp_path):
+    script = tmp_path / "long_lines.py"
+    script.write_text(
+        "import sys\n"
+        "sys.stdout.write('a' * 1000000 + '\\n')\n"
+        "sys.stdout.write('short\\n\\n')\n"
+        "sys.stdout.write('b' * 200000)\n")
+    log_file = tmp_path / "cmd.log"
+
+    result = asyncio.run(AsyncShell().run(
+        f"{sys.executable} {script}", capture_stdout=True,
+        log_file=str(log_file), tail_size=100))
+
+    expected = "a" * 1000000 + "\nshort\n\n" + "b" * 200000
+    assert result.stdout == expected
+    assert log_file.read_text().endswith(expected)
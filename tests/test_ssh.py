@@ -0,0 +1,49 @@
+import os
+import subprocess
+
+import pytest
+
+import pydevops.ssh as ssh
+
+
+class FakeShell:
+    """
+    Records the commands; fails the command opening the master connection,
+    if requested.
+    """
+
+    def __init__(self, fail_master=False):
+        self.fail_master = fail_master
+        self.commands = []
+
+    def run(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        if self.fail_master and " -M " in cmd:
+            raise subprocess.CalledProcessError(255, cmd)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="No multiplexing on Windows.")
+@pytest.mark.parametrize("fail_master", [False, True])
+def test_master_connection(monkeypatch, fail_master):
+    shell = FakeShell(fail_master=fail_master)
+    monkeypatch.setattr(ssh, "Shell", lambda: shell)
+
+    client = ssh.SshClient("user@host:2222", start_dir="/src",
+                           options=["Compression=yes"])
+    control_dir = client.control_dir
+    client.sh("ls")
+    client.close()
+
+    master_cmd = shell.commands[0]
+    assert " -M " in master_cmd and "ControlPath=" in master_cmd
+    ls_cmd = next(c for c in shell.commands if c.endswith(" ls"))
+    assert "Compression=yes" in ls_cmd
+    if fail_master:
+        assert control_dir is None
+        assert "ControlPath=" not in ls_cmd
+        assert not any("-O exit" in c for c in shell.commands)
+    else:
+        assert "ControlPath=" in ls_cmd
+        assert any("-O exit" in c for c in shell.commands)
+        assert not os.path.exists(control_dir)
+    assert client.control_path is None
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+import pydevops.sync as sync
+
+
+class LocalClient:
+    """
+    Runs the "remote" commands on the local machine.
+    """
+
+    def remote_command_args(self, cmd: str):
+        return ["sh", "-c", cmd]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Requires a POSIX shell.")
+def test_fetch_from_remote_skips_excluded_files(tmp_path):
+    remote = tmp_path / "remote"
+    (remote / "install").mkdir(parents=True)
+    (remote / "install" / "lib.so").write_bytes(b"lib")
+    (remote / "pydevops.cfg").write_bytes(b"remote context")
+    (remote / "pydevops_trace.json").write_bytes(b"{}")
+    local = tmp_path / "local"
+    local.mkdir()
+    (local / "pydevops.cfg").write_bytes(b"local context")
+
+    n_files, _ = sync.fetch_from_remote(
+        LocalClient(), str(remote), ["**"], str(local),
+        exclude=["pydevops.cfg", "pydevops_*"])
+
+    assert n_files == 1
+    assert (local / "install" / "lib.so").read_bytes() == b"lib"
+    assert (local / "pydevops.cfg").read_bytes() == b"local context"
+    assert not (local / "pydevops_trace.json").exists()
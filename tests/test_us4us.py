@@ -0,0 +1,73 @@
+import os
+import zipfile
+
+import pytest
+
+import pydevops.us4us as us4us
+from pydevops.base import Context
+
+
+def package(src_artifact, dst_dir, **options):
+    step = us4us.Package("/package")
+    ctx = Context(env=None, args=None, options={
+        "release_name": "v1.0.0",
+        "src_artifact": src_artifact,
+        "dst_dir": str(dst_dir),
+        **options,
+    })
+    step.execute(ctx)
+
+
+def test_package_keeps_the_artifact_already_in_dst_dir(tmp_path):
+    artifact = tmp_path / "artifact.tar.gz"
+    artifact.write_bytes(b"content")
+
+    package(str(artifact), tmp_path)
+    package(str(artifact), tmp_path, link="false")
+
+    assert artifact.read_bytes() == b"content"
+    assert sorted(os.listdir(tmp_path)) == ["artifact.tar.gz"]
+
+
+def test_package_replaces_the_previous_artifact(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    dst_dir = tmp_path / "dst"
+    dst_dir.mkdir()
+    (src_dir / "artifact.tar.gz").write_bytes(b"new")
+    (dst_dir / "artifact.tar.gz").write_bytes(b"old")
+
+    package(str(src_dir / "artifact.tar.gz"), dst_dir)
+
+    assert (dst_dir / "artifact.tar.gz").read_bytes() == b"new"
+    assert sorted(os.listdir(dst_dir)) == ["artifact.tar.gz"]
+
+
+@pytest.mark.parametrize("compression_level", [0, 6])
+def test_package_zips_the_directory(tmp_path, monkeypatch,
+                                    compression_level):
+    monkeypatch.setattr(us4us, "ZIP_CHUNK_SIZE", 64*1024)
+    src_dir = tmp_path / "install"
+    (src_dir / "lib").mkdir(parents=True)
+    (src_dir / "empty").mkdir()
+    files = {
+        "lib/large.so": os.urandom(100*1024) * 3 + b"x" * (64*1024),
+        "lib/exact.so": b"y" * (2*64*1024),
+        "empty.txt": b"",
+        "small.txt": b"hello",
+    }
+    for name, data in files.items():
+        (src_dir / name).write_bytes(data)
+    dst_dir = tmp_path / "dst"
+
+    package(str(src_dir), dst_dir, dst_artifact="package",
+            compression_level=str(compression_level), workers="3")
+
+    with zipfile.ZipFile(dst_dir / "package.zip") as zf:
+        assert zf.testzip() is None
+        names = zf.namelist()
+        for name, data in files.items():
+            assert zf.read(name) == data
+    assert "empty/" in names
+    assert "lib/" in names
+    assert sorted(os.listdir(dst_dir)) == ["package.zip"]